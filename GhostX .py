@@ -1,39 +1,62 @@
 import os
 import logging
-from dotenv import load_dotenv
-from collections import deque
-from telethon import TelegramClient, events
 import asyncio
-import logging
 import json
 import re
 import uuid
 import shutil
 import random
 import hashlib
-from datetime import datetime
-from collections import deque
+import math
+import time
+import base64
+import bisect
+import copy
+import signal
+import gc
+import tracemalloc
+import contextlib
+import contextvars
+import logging.handlers
+import io
+import sys
+import threading
+import unicodedata
+from datetime import datetime, timezone
+from collections import deque, OrderedDict
+from dotenv import load_dotenv
 from telethon import TelegramClient, events, errors
+from telethon.crypto import AuthKey
+from telethon.sessions import MemorySession, SQLiteSession
+from telethon.sessions.memory import _SentFileType
+from telethon.extensions import BinaryReader, html
+from telethon.helpers import add_surrogate, del_surrogate
+from telethon.utils import get_appropriated_part_size, get_peer_id
+from telethon.tl.functions.upload import SaveBigFilePartRequest, SaveFilePartRequest
+from telethon.tl.types.updates import State
 from telethon.tl.types import (
-    MessageMediaWebPage, MessageEntityTextUrl, MessageEntityUrl,
+    PeerUser, PeerChat, PeerChannel, MessageMediaWebPage, MessageEntityTextUrl, MessageEntityUrl,
     MessageMediaPhoto, MessageMediaDocument, MessageMediaPoll,
-    MessageMediaGeo, MessageMediaContact, MessageMediaVenue,
-    MessageMediaGame, MessageMediaInvoice, MessageMediaGeoLive,
-    MessageMediaDice, MessageMediaStory, InputMediaPoll, Poll,
-    PollAnswer, InputReplyToMessage, MessageEntityMention, MessageEntityMentionName
+    MessageEntityMention, MessageEntityMentionName, InputFile, InputFileBig
 )
-from PIL import Image
-import io
-import os
-from dotenv import load_dotenv
-import unicodedata
+# PIL is imported on first use in clean_image(); most messages never need it
 
 # Configuration
 load_dotenv()
 API_ID = int(os.getenv('API_ID', 23617139))
 API_HASH = os.getenv('API_HASH', '5bfc582b080fa09a1a2eaa6ee60fd5d4')
 SESSION_FILE = "stealth_copy_bot_session"
+SESSION_STATE_FILE = SESSION_FILE + ".json"  # Buffered session; the SQLite .session file is only read to migrate
+SESSION_FLUSH_INTERVAL = 10  # Seconds between batched session writes
 MAPPINGS_FILE = "channel_mappings.json"
+QUOTAS_FILE = "user_quotas.json"
+OUTBOX_FILE = "outbox.jsonl"
+QUEUE_CHECKPOINT_FILE = "queue_checkpoint.json"
+OUTBOX_TTL = 86400  # Seconds an unfinished delivery is kept for a resume that has no checkpointed job
+FORWARDED_FILE = "forwarded_messages.json"
+SENT_DIGESTS_FILE = "sent_digests.json"
+STATS_FILE = "pair_stats.json"
+SHUTDOWN_GRACE = 20  # Seconds in-flight sends get to finish on shutdown
 MAX_RETRIES = 3
 RETRY_DELAY = 5  # seconds
 MAX_QUEUE_SIZE = 100
@@ -45,10 +68,56 @@ FAST_MODE = False
 scramble_content_enabled = True
 DEFAULT_DELAY_RANGE = [1, 5]
 ANTI_FINGERPRINT_DELAY_RANGE = [2, 5]
-NUM_WORKERS = 5
+REPLY_DELAY_RANGE = [1.5, 3.0]  # Replies follow their parent sooner than a pair's own delay range
+NUM_WORKERS = 5  # Initial size of the adaptive worker pool
+MIN_WORKERS = 2
+MAX_WORKERS = 20
+MAPPINGS_RELOAD_INTERVAL = 5  # Seconds between checks of the mappings file for edits
+POOL_CHECK_INTERVAL = 5  # Seconds between worker pool adjustments
+POOL_DRAIN_TARGET = 30  # Size the pool to clear the backlog within this many seconds
+RECONNECT_BASE_DELAY = 1  # First reconnect delay in seconds, doubled per failed attempt
+RECONNECT_MAX_DELAY = 300
+RECONNECT_BUFFER_SIZE = 1000  # Extra queue room for updates that arrive while reconnecting
+BULK_RESOLVE_CONCURRENCY = 8  # Chat IDs resolved at once while validating /bulk
+DIGEST_INTERVAL = 60  # Seconds between owner alert digests
+DIGEST_MAX_PER_HOUR = 12  # Hard cap on digests sent to the owner
+DIGEST_MAX_ITEMS = 25  # Alerts per digest; the rest wait for the next one
+ALERT_COOLDOWNS = {'inactivity': 21600, 'queue': 1800}  # Seconds before a repeat alert is reported again
 JITTER = 0.5  # ±0.5s jitter for delays
 SILENT_MODE = False  # Disable verbose command outputs
+DEBUG_PORT = int(os.getenv('DEBUG_PORT', '0'))  # Serve /debug on 127.0.0.1:<port> when set
+MEMORY_PROFILE_FILE = os.getenv('MEMORY_PROFILE_FILE', '')  # Write periodic tracemalloc growth reports here when set
+MEMORY_PROFILE_INTERVAL = 600  # Seconds between memory snapshots
+MEMORY_TRACE_FRAMES = 5  # Stack depth recorded per allocation
+MEMORY_TOP_SITES = 20  # Growth sites written per report
+TRACE_FILE = os.getenv('TRACE_FILE', '')  # Export sampled job spans as JSONL here when set
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '0.05'))  # Fraction of jobs traced
+TRACE_MAX_BYTES = 10 * 1024 * 1024  # Rotate the trace file at this size
+TRACE_BACKUPS = 3
+TRANSFER_PART_SIZE = int(os.getenv('TRANSFER_PART_SIZE_KB', '512')) * 1024  # Must divide 512 KB, Telegram's largest part
+TRANSFER_CONCURRENCY = int(os.getenv('TRANSFER_CONCURRENCY', '4'))  # Parts in flight per media transfer
+PARALLEL_TRANSFER_MIN_SIZE = 10 * 1024 * 1024  # Documents this big are moved in parallel parts
+BIG_FILE_SIZE = 10 * 1024 * 1024  # Telegram requires SaveBigFilePart above this
+MEDIA_CACHE_SIZE = 512  # Source media and content digests remembered for reuse
+MEDIA_CACHE_TTL = 3600  # Seconds an uploaded file is reused before it is uploaded again
+LOOP_LAG_INTERVAL = 0.1  # Seconds between event-loop heartbeats
+LOOP_LAG_THRESHOLD = float(os.getenv('LOOP_LAG_THRESHOLD', '0.25'))  # Stalls this long are recorded with a stack
+LOOP_LAG_SAMPLES = 3000  # Heartbeats kept for lag percentiles (about five minutes)
+LOOP_STALLS_KEPT = 20  # Recent stalls shown in /debug
+LOOP_STALL_FRAMES = 8  # Stack depth recorded per stall
+CAPTURE_FILE = os.getenv('CAPTURE_FILE', '')  # Record source updates for offline replay when set
+AUTHORIZED_USERS = {int(u) for u in os.getenv('AUTHORIZED_USERS', '').split(',') if u.strip()}  # Extra command users
 NOTIFY_OWNER = True  # Enable owner notifications
+EXPRESS_WORKERS = 1  # Workers reserved for deletes and edits
+STARVATION_LIMIT = 5  # Serve a bulk job after this many consecutive corrections
+STARVATION_AGE = 30  # Seconds a bulk job may wait before it jumps ahead of corrections
+DEFAULT_USER_WEIGHT = 1.0  # Deficit round-robin quantum per user
+
+# Job priority classes (lower is served first)
+PRIORITY_DELETE = 0
+PRIORITY_EDIT = 1
+PRIORITY_NEW = 2
+JOB_KINDS = ('delete', 'edit', 'copy')  # Indexed by priority
 
 # Logging setup
 logging.basicConfig(
@@ -58,55 +127,613 @@ logging.basicConfig(
 )
 logger = logging.getLogger("StealthCopyBot")
 
+# Session storage
+class BufferedSession(MemorySession):
+    """Telethon session kept in memory and written to a JSON file in batches.
+
+    Entity and update-state changes only mark the session dirty; flush_session()
+    writes them off the event loop every SESSION_FLUSH_INTERVAL seconds and close()
+    writes once more on disconnect. DC and auth key changes are written at once,
+    since losing them means logging in again. Every write goes through an fsynced
+    temp file, so the file on disk is always a complete earlier state.
+    """
+
+    def __init__(self, path, legacy_path=None):
+        super().__init__()
+        self._entities = {}  # id -> (id, hash, username, phone, name); a changed entity replaces its row
+        self._usernames = {}  # username -> id
+        self._phones = {}  # phone -> id
+        self.path = path
+        self.dirty = False
+        self.persisted = (0, None, None, None)  # DC and auth key as last written to disk
+        self.version = 0  # Bumped per snapshot so a slow older write can't replace a newer one
+        self.written = 0
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            self.load()
+        elif legacy_path and os.path.exists(legacy_path):
+            self.migrate(legacy_path)
+
+    def set_dc(self, dc_id, server_address, port):
+        super().set_dc(dc_id, server_address, port)
+        if self.critical():
+            self.dirty = True
+
+    @MemorySession.auth_key.setter
+    def auth_key(self, value):
+        # Telethon reassigns the same key on every connect, so only a real change counts
+        self._auth_key = value
+        if self.critical():
+            self.dirty = True
+
+    @MemorySession.takeout_id.setter
+    def takeout_id(self, value):
+        self._takeout_id = value
+        self.dirty = True
+
+    def set_update_state(self, entity_id, state):
+        super().set_update_state(entity_id, state)
+        self.dirty = True
+
+    def process_entities(self, tlo):
+        for row in self._entities_to_rows(tlo):
+            if self._entities.get(row[0]) != row:
+                self.store_entity(row)
+                self.dirty = True
+
+    def store_entity(self, row):
+        """Insert or replace an entity row, keeping the username and phone indexes current."""
+        entity_id, entity_hash, username, phone, name = row
+        phone = str(phone) if phone else None  # SQLite hands phones back as integers
+        row = (entity_id, entity_hash, username, phone, name)
+        old = self._entities.get(entity_id)
+        if old:
+            if self._usernames.get(old[2]) == entity_id:
+                del self._usernames[old[2]]
+            if self._phones.get(old[3]) == entity_id:
+                del self._phones[old[3]]
+        self._entities[entity_id] = row
+        if username:
+            self._usernames[username] = entity_id
+        if phone:
+            self._phones[phone] = entity_id
+
+    def get_entity_rows_by_phone(self, phone):
+        row = self._entities.get(self._phones.get(phone))
+        return row[:2] if row else None
+
+    def get_entity_rows_by_username(self, username):
+        row = self._entities.get(self._usernames.get(username))
+        return row[:2] if row else None
+
+    def get_entity_rows_by_name(self, name):
+        return next((row[:2] for row in self._entities.values() if row[4] == name), None)
+
+    def get_entity_rows_by_id(self, id, exact=True):
+        ids = (id,) if exact else (get_peer_id(PeerUser(id)), get_peer_id(PeerChat(id)), get_peer_id(PeerChannel(id)))
+        return next((self._entities[i][:2] for i in ids if i in self._entities), None)
+
+    def cache_file(self, md5_digest, file_size, instance):
+        super().cache_file(md5_digest, file_size, instance)
+        self.dirty = True
+
+    def save(self):
+        """Called by Telethon after most changes; only DC and auth key changes are written here."""
+        if not self.critical():
+            return
+        try:
+            self.write(self.snapshot())
+        except Exception as e:
+            self.dirty = True  # flush_session retries; critical() stays true until a write lands
+            logger.error(f"Error saving session: {e}")
+
+    def critical(self):
+        """True while the DC or auth key differs from what is on disk."""
+        key = self._auth_key.key if self._auth_key else None
+        return (self._dc_id, self._server_address, self._port, key) != self.persisted
+
+    def close(self):
+        """Called by Telethon on disconnect; writes whatever is still buffered."""
+        if not self.dirty:
+            return
+        try:
+            self.write(self.snapshot())
+        except Exception as e:
+            self.dirty = True
+            logger.error(f"Error saving session: {e}")
+
+    def delete(self):
+        """Log out: forget the stored session."""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def snapshot(self):
+        """Copy the session into a JSON-ready dict; runs on the loop thread and clears the dirty flag."""
+        self.version += 1
+        self.dirty = False
+        return {
+            'version': self.version,
+            'dc': [self._dc_id, self._server_address, self._port],
+            'auth_key': base64.b64encode(self._auth_key.key).decode() if self._auth_key and self._auth_key.key else None,
+            'takeout_id': self._takeout_id,
+            'update_states': {str(entity_id): [s.pts, s.qts, s.date.timestamp(), s.seq]
+                              for entity_id, s in self._update_states.items()},
+            'entities': list(self._entities.values()),
+            'files': [[md5.hex(), size, kind.value, file_id, file_hash]
+                      for (md5, size, kind), (file_id, file_hash) in self._files.items()],
+        }
+
+    def write(self, state):
+        """Write a snapshot through an fsynced temp file; safe to call from a worker thread."""
+        with self.lock:
+            if state['version'] <= self.written:
+                return
+            tmp = self.path + ".tmp"
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)  # Holds the auth key
+            with os.fdopen(fd, "w") as f:
+                json.dump(state, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+            self.written = state['version']
+            key = base64.b64decode(state['auth_key']) if state['auth_key'] else None
+            self.persisted = (*state['dc'], key)
+
+    def load(self):
+        with open(self.path, "r") as f:
+            state = json.load(f)
+        self._dc_id, self._server_address, self._port = state['dc']
+        if state['auth_key']:
+            self._auth_key = AuthKey(base64.b64decode(state['auth_key']))
+        self._takeout_id = state['takeout_id']
+        self._update_states = {
+            int(entity_id): State(pts, qts, datetime.fromtimestamp(date, tz=timezone.utc), seq, unread_count=0)
+            for entity_id, (pts, qts, date, seq) in state['update_states'].items()
+        }
+        for row in state['entities']:
+            self.store_entity(row)
+        self._files = {(bytes.fromhex(md5), size, _SentFileType(kind)): (file_id, file_hash)
+                       for md5, size, kind, file_id, file_hash in state['files']}
+        self.version = self.written = state['version']
+        self.persisted = (*state['dc'], self._auth_key.key if self._auth_key else None)
+
+    def migrate(self, legacy_path):
+        """Import an existing SQLite session once so the account stays logged in."""
+        legacy = SQLiteSession(legacy_path)
+        try:
+            self._dc_id, self._server_address, self._port = legacy.dc_id, legacy.server_address, legacy.port
+            self._auth_key = legacy.auth_key
+            self._takeout_id = legacy.takeout_id
+            self._update_states = dict(legacy.get_update_states())
+            cursor = legacy._cursor()
+            try:
+                for row in cursor.execute('select id, hash, username, phone, name from entities'):
+                    self.store_entity(row)
+            finally:
+                cursor.close()
+        finally:
+            legacy.close()
+        self.write(self.snapshot())
+        logger.info(f"💾 Migrated session from {legacy_path} to {self.path}")
+
 # Initialize client
-client = TelegramClient(SESSION_FILE, API_ID, API_HASH)
+# Reconnection is driven by maintain_connection(); catch_up fetches updates missed while offline
+session = BufferedSession(SESSION_STATE_FILE, SESSION_FILE + ".session")
+client = TelegramClient(session, API_ID, API_HASH, auto_reconnect=False, catch_up=True)
+
+# Tracing
+trace_logger = logging.getLogger("StealthCopyBot.trace")
+trace_logger.propagate = False
+trace_state = contextvars.ContextVar('trace_state', default=None)  # (trace id, finished spans) of a sampled job
+current_span = contextvars.ContextVar('current_span', default=None)
+
+def start_tracing(path):
+    """Export sampled job spans to a size-rotated JSONL file."""
+    handler = logging.handlers.RotatingFileHandler(path, maxBytes=TRACE_MAX_BYTES, backupCount=TRACE_BACKUPS)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    trace_logger.handlers[:] = [handler]
+    trace_logger.setLevel(logging.INFO)
+    logger.info(f"🔬 Tracing {TRACE_SAMPLE_RATE:.0%} of jobs to {path}")
+
+@contextlib.contextmanager
+def span(name, **attrs):
+    """Time a stage as a child of the current span; a no-op outside sampled jobs."""
+    state = trace_state.get()
+    if state is None:
+        yield None
+        return
+    parent = current_span.get()
+    record = {
+        'trace': state[0], 'span': uuid.uuid4().hex[:16], 'parent': parent['span'] if parent else None,
+        'name': name, 'ts': time.time(), **attrs
+    }
+    token = current_span.set(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record['error'] = type(e).__name__
+        raise
+    finally:
+        record['ms'] = round((time.perf_counter() - start) * 1000, 3)
+        current_span.reset(token)
+        state[1].append(record)
+
+async def traced(name, awaitable, **attrs):
+    """Await inside a child span of the current job."""
+    with span(name, **attrs):
+        return await awaitable
+
+@contextlib.contextmanager
+def trace_job(job):
+    """Root span for a job, sampled at TRACE_SAMPLE_RATE; spans are written when it ends."""
+    if not trace_logger.handlers or random.random() >= TRACE_SAMPLE_RATE:
+        yield
+        return
+    spans = []
+    token = trace_state.set((uuid.uuid4().hex, spans))
+    try:
+        with span(JOB_KINDS[job.priority], user=job.user_id, pair=job.pair_name, msg=job.msg_id,
+                  queued_ms=round((time.monotonic() - job.enqueued) * 1000, 3)):
+            yield
+    finally:
+        trace_state.reset(token)
+        for record in spans:
+            trace_logger.info(json.dumps(record, separators=(',', ':')))
+
+# Job scheduling
+def tl_dump(obj):
+    """Encode a Telethon TL object as base64 of its wire bytes."""
+    return base64.b64encode(obj._bytes()).decode()
+
+def tl_load(data):
+    """Decode a TL object written by tl_dump."""
+    return BinaryReader(base64.b64decode(data)).tgread_object()
+
+class Job:
+    """Compact queued job holding only what the copy pipeline needs.
+
+    Source message IDs, a text and entity snapshot, the media reference and the
+    PairConfig are kept; the Telethon event and its client references are not.
+    """
+
+    __slots__ = ('priority', 'user_id', 'pair_name', 'pair', 'msg_ids', 'text',
+                 'entities', 'media', 'reply_to', 'silent', 'enqueued')
+
+    def __init__(self, priority, user_id, pair_name, pair=None, msg_ids=(), text='',
+                 entities=None, media=None, reply_to=None, silent=False):
+        self.priority = priority
+        self.user_id = user_id
+        self.pair_name = pair_name
+        self.pair = pair
+        self.msg_ids = msg_ids
+        self.text = text
+        self.entities = entities
+        self.media = media
+        self.reply_to = reply_to
+        self.silent = silent
+        self.enqueued = time.monotonic()
+
+    @classmethod
+    def from_message(cls, priority, message, pair):
+        """Snapshot a Telethon message into a job for a pair."""
+        media = message.media
+        if isinstance(media, MessageMediaWebPage):
+            media = None  # Skip web page previews
+        return cls(
+            priority, pair.user_id, pair.name, pair, (message.id,), message.raw_text or "",
+            tuple(message.entities) if message.entities else None, media,
+            getattr(message.reply_to, 'reply_to_msg_id', None), bool(message.silent)  # Story replies have no message ID
+        )
+
+    @property
+    def msg_id(self):
+        return self.msg_ids[0] if self.msg_ids else None
+
+    def to_dict(self):
+        """Serializable form for the shutdown checkpoint."""
+        return {
+            'p': self.priority, 'u': self.user_id, 'n': self.pair_name, 'i': list(self.msg_ids),
+            'x': self.text, 'r': self.reply_to, 's': self.silent,
+            'en': [tl_dump(e) for e in self.entities] if self.entities else None,
+            'm': tl_dump(self.media) if self.media else None,
+            'age': time.monotonic() - self.enqueued,
+        }
+
+    @classmethod
+    def from_dict(cls, data, pair):
+        """Rebuild a checkpointed job for its current PairConfig."""
+        job = cls(
+            data['p'], data['u'], data['n'], pair, tuple(data['i']), data['x'],
+            tuple(tl_load(e) for e in data['en']) if data['en'] else None,
+            tl_load(data['m']) if data['m'] else None, data['r'], data['s']
+        )
+        job.enqueued -= data.get('age', 0)
+        return job
+
+    @property
+    def key(self):
+        """Idempotency key: one delivery per source message, destination and owning pair."""
+        return f"{self.pair.source}:{self.msg_id}>{self.pair.destination}@{self.user_id}/{self.pair_name}"
+
+class JobScheduler:
+    """Priority job queue: deletes, then edits, then new messages.
+
+    Jobs are :class:`Job` records.
+    Each priority class holds one sub-queue per user, drained by deficit round-robin
+    using the user's weight, so one tenant's burst does not delay the others.
+    Corrections are never evicted; when the queue is full the busiest user's oldest
+    bulk job is dropped. ``reserve`` adds temporary room (used while reconnecting)
+    that is released once the queue drains back to half of ``maxlen``.
+    """
+
+    def __init__(self, maxlen):
+        self.maxlen = maxlen
+        self.reserve = 0
+        self.queues = [{} for _ in range(PRIORITY_NEW + 1)]  # user_id -> deque
+        self.rotation = [deque() for _ in range(PRIORITY_NEW + 1)]  # users with queued jobs
+        self.deficits = {}  # (priority, user_id) -> deficit
+        self.buckets = {}  # user_id -> [tokens, last refill]
+        self.size = 0
+        self.streak = 0
+
+    def __len__(self):
+        return self.size
+
+    def __bool__(self):
+        return self.size > 0
+
+    def __iter__(self):
+        for queues in self.queues:
+            for q in list(queues.values()):
+                yield from list(q)
+
+    def depth(self, priority):
+        """Number of queued jobs in a priority class."""
+        return sum(len(q) for q in self.queues[priority].values())
+
+    def user_depth(self, user_id):
+        """Number of queued jobs for a user across all classes."""
+        return sum(len(queues.get(user_id, ())) for queues in self.queues)
+
+    def _bulk_depth(self, user_id):
+        return len(self.queues[PRIORITY_NEW].get(user_id, ()))
+
+    def _drop_oldest(self, user_id, reason):
+        """Drop a user's oldest bulk job; ``reason`` says which limit forced it."""
+        q = self.queues[PRIORITY_NEW].get(user_id)
+        if not q:
+            return False
+        dropped = q.popleft()
+        self.size -= 1
+        if not q:
+            self._retire(PRIORITY_NEW, user_id)
+        logger.warning(f"{reason}, dropped oldest job for pair '{dropped.pair_name}'")
+        return True
+
+    def _retire(self, priority, user_id):
+        del self.queues[priority][user_id]
+        self.rotation[priority].remove(user_id)
+        self.deficits.pop((priority, user_id), None)
+
+    def append(self, job):
+        """Queue a job for its user and class, enforcing queue share and capacity."""
+        priority, user_id = job.priority, job.user_id
+        if priority >= PRIORITY_NEW:
+            share = user_quota(user_id, 'share')
+            if share and self._bulk_depth(user_id) >= max(1, int(self.maxlen * share)):
+                self._drop_oldest(user_id, f"User {user_id} at queue share {share:.0%}")
+        if self.size >= self.maxlen + self.reserve:
+            busiest = max(self.rotation[PRIORITY_NEW], key=self._bulk_depth, default=None)
+            if busiest is None or (priority >= PRIORITY_NEW and self._bulk_depth(busiest) <= self._bulk_depth(user_id)):
+                busiest = user_id
+            if not self._drop_oldest(busiest, "Queue full") and priority >= PRIORITY_NEW:
+                logger.warning(f"Queue full, dropped new job for pair '{job.pair_name}'")
+                return
+        q = self.queues[priority].get(user_id)
+        if q is None:
+            q = self.queues[priority][user_id] = deque()
+            self.rotation[priority].append(user_id)
+        q.append(job)
+        self.size += 1
+
+    def _may_send(self, user_id, now):
+        """Token bucket for the user's optional send rate (jobs per minute)."""
+        rate = user_quota(user_id, 'rate')
+        if not rate:
+            return True
+        capacity = max(1.0, rate / 6)
+        tokens, last = self.buckets.get(user_id, (capacity, now))
+        tokens = min(capacity, tokens + (now - last) * rate / 60)
+        self.buckets[user_id] = [tokens, now]
+        return tokens >= 1
+
+    def _pop_fair(self, priority, now):
+        """Deficit round-robin over the users queued in a class."""
+        users = self.rotation[priority]
+        for _ in range(len(users) * 8 + 1):
+            if not users:
+                return None
+            user_id = users[0]
+            if priority == PRIORITY_NEW and not self._may_send(user_id, now):
+                users.rotate(-1)
+                continue
+            key = (priority, user_id)
+            if self.deficits.get(key, 0) < 1:
+                self.deficits[key] = self.deficits.get(key, 0) + user_quota(user_id, 'weight')
+                if self.deficits[key] < 1:
+                    users.rotate(-1)
+                    continue
+            q = self.queues[priority][user_id]
+            job = q.popleft()
+            self.size -= 1
+            self.deficits[key] -= 1
+            if priority == PRIORITY_NEW and user_id in self.buckets:
+                self.buckets[user_id][0] -= 1
+            if not q:
+                self._retire(priority, user_id)
+            elif self.deficits[key] < 1:
+                users.rotate(-1)
+            return job
+        return None
+
+    def _oldest(self, priority):
+        return min((q[0].enqueued for q in self.queues[priority].values()), default=None)
+
+    def popleft(self, express=False):
+        """Pop the next job, or None. Express workers only take deletes and edits."""
+        if self.reserve and self.size <= self.maxlen // 2:
+            self.reserve = 0
+        limit = PRIORITY_EDIT if express else PRIORITY_NEW
+        waiting = [p for p in range(limit + 1) if self.queues[p]]
+        if not waiting:
+            return None
+        order = waiting
+        bulk = [p for p in waiting if p >= PRIORITY_NEW]
+        clock = time.monotonic()
+        if waiting[0] < PRIORITY_NEW and bulk:
+            # Starvation protection: keep bulk copies moving under a stream of corrections
+            for p in bulk:
+                if self.streak >= STARVATION_LIMIT or clock - self._oldest(p) > STARVATION_AGE:
+                    order = [p] + [w for w in waiting if w != p]
+                    break
+        for priority in order:
+            job = self._pop_fair(priority, clock)
+            if job:
+                self.streak = self.streak + 1 if priority < PRIORITY_NEW and bulk else 0
+                return job
+        return None
+
+    def discard(self, source, msg_ids):
+        """Drop queued new-message jobs for source messages that were deleted."""
+        removed = 0
+        for user_id, q in list(self.queues[PRIORITY_NEW].items()):
+            kept = [job for job in q if not (job.pair.source == source and job.msg_id in msg_ids)]
+            if len(kept) != len(q):
+                removed += len(q) - len(kept)
+                q.clear()
+                q.extend(kept)
+                if not q:
+                    self._retire(PRIORITY_NEW, user_id)
+        self.size -= removed
+        return removed
+
+    def supersede(self, edit):
+        """Replace the content of a queued new-message job with its edited version."""
+        q = self.queues[PRIORITY_NEW].get(edit.user_id, ())
+        for job in q:
+            if job.pair_name == edit.pair_name and job.msg_id == edit.msg_id:
+                job.text, job.entities, job.media = edit.text, edit.entities, edit.media
+                job.reply_to, job.silent = edit.reply_to, edit.silent
+                return True
+        return False
 
 # Data structures
 channel_mappings = {}
-message_queue = deque(maxlen=MAX_QUEUE_SIZE)
+pair_configs = {}  # (user_id, pair_name) -> PairConfig
+source_index = {}  # source chat ID -> active PairConfigs, rebuilt on every change
+resolved_peers = {}  # destination chat ID -> InputPeer, kept across rebuilds
+user_quotas = {}
+outbox = {}  # idempotency key -> {'total': parts, 'ids': delivered destination message IDs, 't': first part time, 'x'/'en': text sent}
+outbox_handle = None
+sent_digests = {}  # message map key -> digest of the text, entities and media last sent there
+media_cache = OrderedDict()  # ('src', kind, id) -> (raw md5, content digest); ('sha', digest) -> uploaded file; LRU order
+# The content digest is the sha256 of a cleaned photo, or the md5 of a document (sent unchanged)
+message_queue = JobScheduler(MAX_QUEUE_SIZE)
 is_connected = False
+connected_event = asyncio.Event()
 pair_stats = {}
 OWNER_ID = None
 worker_tasks = []
+worker_jobs = {}  # worker task -> (job, start time) while a job runs
+loaded_signature = None  # (mtime, size) of the mappings file currently in effect
+worker_waits = {}  # worker task -> (reason, resume time) while a job sleeps
+pool_workers = []  # Regular workers managed by the pool controller
+retiring_workers = set()
+pool_stats = {'latency': 0.0, 'utilisation': 0.0}  # Moving averages for the pool controller
+flood_wait_until = 0.0  # Monotonic time until which Telegram asked us to back off
+pending_alerts = OrderedDict()  # (category, key) -> [latest text, count] for the next digest
+alert_sent_at = {}  # (category, key) -> time the alert last went out
+digest_times = deque()  # Send times of digests within the last hour
+background_tasks = []
+loop_lag = deque(maxlen=LOOP_LAG_SAMPLES)  # Seconds each heartbeat fired late
+loop_stalls = deque(maxlen=LOOP_STALLS_KEPT)  # {'at', 'seconds', 'task', 'stack'} per blocking episode
+loop_heartbeat = 0.0  # Monotonic time of the last heartbeat
+watchdog_stop = threading.Event()
+shutting_down = False
+shutdown_event = asyncio.Event()
 
 # Known trap patterns
 TRAP_VARIANTS = ["🔥 Black Dragon Entry 🔥", "EURUSD Buy @"]
+TRAP_VARIANTS_LOWER = tuple(p.lower() for p in TRAP_VARIANTS)
+TRAP_LINK_RE = re.compile(r"https?://(fxleaks|track|redirect|trk)\.", re.IGNORECASE)
+QUOTE_LINE_RE = re.compile(r'^>\s.*?\n', re.MULTILINE)
 
 # Helper Functions
+PAIR_DEFAULTS = {
+    'header_patterns': [],
+    'footer_patterns': [],
+    'remove_phrases': [],
+    'remove_mentions': False,
+    'trap_phrases': [],
+    'trap_image_hashes': [],
+    'delay_range': DEFAULT_DELAY_RANGE,
+    'status': 'active',
+    'last_activity': None,
+    'stealth_mode': True,
+    'content_scramble': False,
+    'custom_header': '',
+    'custom_footer': '',
+}
+
+def mappings_signature():
+    """(mtime, size) of the mappings file, or None if it does not exist."""
+    try:
+        st = os.stat(MAPPINGS_FILE)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
 def save_mappings():
     """Save channel mappings to a JSON file."""
+    global loaded_signature
     try:
-        with open(MAPPINGS_FILE, "w") as f:
-            json.dump(channel_mappings, f)
+        write_json_atomic(MAPPINGS_FILE, channel_mappings)
+        loaded_signature = mappings_signature()  # Our own write is not a reload
     except Exception as e:
         logger.error(f"Error saving mappings: {e}")
 
+def apply_mapping_defaults(mappings):
+    """Fill in settings missing from older mapping files."""
+    required = PAIR_DEFAULTS.keys()
+    for pairs in mappings.values():
+        for mapping in pairs.values():
+            if required <= mapping.keys():
+                continue  # Up-to-date mapping; the common case
+            for key in required - mapping.keys():
+                mapping[key] = copy.copy(PAIR_DEFAULTS[key])
+
+def ensure_pair_stats():
+    """Add zeroed stats for pairs that have none, keeping existing counters."""
+    for user_id, pairs in channel_mappings.items():
+        user_stats = pair_stats.setdefault(user_id, {})
+        for pair_name in pairs:
+            if pair_name not in user_stats:
+                user_stats[pair_name] = {
+                    'forwarded': 0, 'edited': 0, 'deleted': 0, 'blocked': 0, 'queued': 0, 'last_activity': None
+                }
+
 def load_mappings():
     """Load channel mappings from JSON, handling corrupted files."""
-    global channel_mappings
+    global channel_mappings, loaded_signature
     try:
+        loaded_signature = mappings_signature()
         with open(MAPPINGS_FILE, "r") as f:
             channel_mappings = json.load(f)
-        for user_id, pairs in channel_mappings.items():
-            if user_id not in pair_stats:
-                pair_stats[user_id] = {}
-            for pair_name, mapping in pairs.items():
-                mapping.setdefault('header_patterns', [])
-                mapping.setdefault('footer_patterns', [])
-                mapping.setdefault('remove_phrases', [])
-                mapping.setdefault('remove_mentions', False)
-                mapping.setdefault('trap_phrases', [])
-                mapping.setdefault('trap_image_hashes', [])
-                mapping.setdefault('delay_range', DEFAULT_DELAY_RANGE)
-                mapping.setdefault('status', 'active')
-                mapping.setdefault('last_activity', None)
-                mapping.setdefault('stealth_mode', True)
-                mapping.setdefault('content_scramble', False)
-                mapping.setdefault('custom_header', '')
-                mapping.setdefault('custom_footer', '')
-                pair_stats[user_id][pair_name] = {
-                    'forwarded': 0, 'edited': 0, 'deleted': 0, 'blocked': 0, 'queued': 0, 'last_activity': None
-                }
+        apply_mapping_defaults(channel_mappings)
+        ensure_pair_stats()
     except FileNotFoundError:
         logger.info("No mappings file found. Starting fresh.")
     except json.JSONDecodeError as e:
@@ -115,30 +742,476 @@ def load_mappings():
         channel_mappings = {}
     except Exception as e:
         logger.error(f"Error loading mappings: {e}")
+    rebuild_pair_configs()
+
+class PairConfig:
+    """Immutable, precompiled view of one pair's JSON mapping.
+
+    Chat IDs are converted to integers, filters compiled and the custom header/footer
+    HTML parsed once, so the per-message path never parses or probes the raw dict.
+    ``raw`` is the stored mapping itself.
+    """
+
+    __slots__ = ('user_id', 'name', 'raw', 'source', 'destination', 'peer', 'active',
+                 'header_re', 'footer_re', 'remove_phrases', 'remove_mentions', 'trap_re',
+                 'trap_image_hashes', 'delay_range', 'stealth_mode', 'content_scramble',
+                 'custom_header', 'custom_footer')
+
+    def __init__(self, user_id, name, raw):
+        fields = {
+            'user_id': user_id,
+            'name': name,
+            'raw': raw,
+            'source': int(raw['source']),
+            'destination': int(raw['destination']),
+            'active': raw.get('status', 'active') == 'active',
+            'header_re': compile_patterns(raw.get('header_patterns', [])),
+            'footer_re': compile_patterns(raw.get('footer_patterns', [])),
+            'remove_phrases': tuple(raw.get('remove_phrases', [])),
+            'remove_mentions': bool(raw.get('remove_mentions', False)),
+            'trap_re': compile_patterns(raw.get('trap_phrases', [])),
+            'trap_image_hashes': frozenset(raw.get('trap_image_hashes', [])),
+            'delay_range': tuple(raw.get('delay_range', DEFAULT_DELAY_RANGE)),
+            'stealth_mode': bool(raw.get('stealth_mode', True)),
+            'content_scramble': bool(raw.get('content_scramble', False)),
+            'custom_header': parse_template(raw.get('custom_header', '')),
+            'custom_footer': parse_template(raw.get('custom_footer', '')),
+        }
+        fields['peer'] = resolved_peers.get(fields['destination'], fields['destination'])
+        for key, value in fields.items():
+            object.__setattr__(self, key, value)
+
+    def __setattr__(self, key, value):
+        raise AttributeError("PairConfig is immutable; rebuild it from the mapping")
+
+def build_pair_configs(mappings, strict=False):
+    """PairConfigs and the source dispatch index for a mappings dict.
+
+    Invalid pairs are logged and skipped, or raise ValueError when ``strict``.
+    """
+    configs, index = {}, {}
+    for user_id, pairs in mappings.items():
+        for pair_name, mapping in pairs.items():
+            try:
+                pair = PairConfig(user_id, pair_name, mapping)
+            except (KeyError, TypeError, ValueError, AttributeError) as e:
+                if strict:
+                    raise ValueError(f"pair '{pair_name}' of user {user_id}: {e!r}")
+                logger.error(f"Invalid mapping for pair '{pair_name}': {e}")
+                continue
+            configs[(user_id, pair_name)] = pair
+            if pair.active:
+                index.setdefault(pair.source, []).append(pair)
+    return configs, {source: tuple(pairs) for source, pairs in index.items()}
+
+def rebuild_pair_configs():
+    """Build PairConfigs for all mappings and swap them in with the dispatch index."""
+    global pair_configs, source_index
+    pair_configs, source_index = build_pair_configs(channel_mappings)
+    refresh_authorized_users()
+
+def commit_mappings():
+    """Persist channel mappings and swap in rebuilt pair configs."""
+    save_mappings()
+    rebuild_pair_configs()
+    repoint_jobs()
+    if is_connected:
+        asyncio.ensure_future(resolve_peers())
+
+def repoint_jobs():
+    """Point queued and running jobs at the current PairConfig; jobs of removed pairs keep their old one."""
+    for job in [*message_queue, *(job for job, _ in worker_jobs.values())]:
+        job.pair = pair_configs.get((job.user_id, job.pair_name), job.pair)
+
+def pause_mapping(user_id, pair_name):
+    """Pause a pair in the live mappings and save, if it still exists."""
+    mapping = channel_mappings.get(user_id, {}).get(pair_name)
+    if mapping:
+        mapping['status'] = 'paused'
+        commit_mappings()
+
+async def resolve_peers():
+    """Resolve destination peers once so sends skip entity lookups."""
+    pending = {pair.destination for pair in pair_configs.values()} - resolved_peers.keys()
+    for destination in pending:
+        try:
+            resolved_peers[destination] = await client.get_input_entity(destination)
+        except Exception as e:
+            logger.warning(f"Could not resolve destination {destination}: {e}")
+    if resolved_peers.keys() & pending:
+        rebuild_pair_configs()
+
+def read_mappings_file():
+    """Parse and validate the mappings file; runs in a worker thread."""
+    with open(MAPPINGS_FILE, "r") as f:
+        mappings = json.load(f)
+    if not isinstance(mappings, dict) or not all(isinstance(pairs, dict) for pairs in mappings.values()):
+        raise ValueError("expected {user_id: {pair_name: mapping}}")
+    apply_mapping_defaults(mappings)
+    return mappings, build_pair_configs(mappings, strict=True)
+
+async def watch_mappings():
+    """Reload channel_mappings.json when it changes on disk, keeping queue, stats and message map."""
+    global channel_mappings, pair_configs, source_index, loaded_signature
+    while True:
+        await asyncio.sleep(MAPPINGS_RELOAD_INTERVAL)
+        signature = mappings_signature()
+        if signature is None or signature == loaded_signature:
+            continue
+        try:
+            mappings, (configs, index) = await asyncio.to_thread(read_mappings_file)
+        except Exception as e:
+            loaded_signature = signature  # Don't retry until the file changes again
+            logger.error(f"❌ Rejected edited mappings file, keeping current config: {e}")
+            notify_owner(f"❌ Mappings reload rejected: {e}", None, 'reload')
+            continue
+        if mappings_signature() != signature:
+            continue  # Changed again (or saved by a command) while validating; next poll picks it up
+        # Swap on the loop thread; handlers and workers see either the old or the new config
+        channel_mappings, pair_configs, source_index = mappings, configs, index
+        loaded_signature = signature
+        ensure_pair_stats()
+        refresh_authorized_users()
+        repoint_jobs()
+        logger.info(f"🔄 Reloaded mappings: {len(pair_configs)} pairs, {len(source_index)} sources")
+        if is_connected:
+            await resolve_peers()
+
+def save_quotas():
+    """Save per-user scheduling weights and quotas to a JSON file."""
+    try:
+        with open(QUOTAS_FILE, "w") as f:
+            json.dump(user_quotas, f)
+    except Exception as e:
+        logger.error(f"Error saving quotas: {e}")
+
+def load_quotas():
+    """Load per-user scheduling weights and quotas."""
+    global user_quotas
+    try:
+        with open(QUOTAS_FILE, "r") as f:
+            user_quotas = json.load(f)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.error(f"Error loading quotas: {e}")
+
+def load_outbox():
+    """Replay the outbox journal, keeping only unfinished deliveries, and compact it.
+
+    Runs after load_checkpoint(). Records for removed pairs are dropped, as are records
+    older than OUTBOX_TTL that no restored job will resume.
+    """
+    global outbox_handle
+    try:
+        with open(OUTBOX_FILE, "r") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # torn final line from a crash
+                if entry.get('done'):
+                    outbox.pop(entry['k'], None)
+                    continue
+                record = outbox.setdefault(entry['k'], {'total': entry['n'], 'ids': [], 't': entry.get('t', time.time())})
+                record['ids'].append(entry['id'])
+                if 'x' in entry:
+                    record['x'], record['en'] = entry['x'], [tl_load(e) for e in entry['en']]
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.error(f"Error loading outbox: {e}")
+    # Keys written before they named the pair belong to the only pair on their route, if there is one
+    owners = {}
+    for pair in pair_configs.values():
+        owners.setdefault(f"{pair.source}>{pair.destination}", []).append(pair)
+    for key in [key for key in outbox if '@' not in key]:
+        source, destination, _, _ = parse_outbox_key(key)
+        pairs = owners.get(f"{source}>{destination}", [])
+        if len(pairs) == 1:
+            outbox[f"{key}@{pairs[0].user_id}/{pairs[0].name}"] = outbox.pop(key)
+    queued = {job.key for job in message_queue}
+    cutoff = time.time() - OUTBOX_TTL
+    for key in [key for key, record in outbox.items() if key not in queued and (
+            record['t'] < cutoff or not outbox_key_live(key))]:
+        del outbox[key]
+        logger.info(f"📮 Expired unfinished delivery {key}")
+    try:
+        with open(OUTBOX_FILE + ".tmp", "w") as f:
+            for key, record in outbox.items():
+                for msg_id in record['ids']:
+                    f.write(json.dumps(outbox_entry(key, record, msg_id)) + "\n")
+        os.replace(OUTBOX_FILE + ".tmp", OUTBOX_FILE)
+        outbox_handle = open(OUTBOX_FILE, "a", buffering=1)
+    except Exception as e:
+        logger.error(f"Error compacting outbox: {e}")
+    if outbox:
+        logger.info(f"📮 {len(outbox)} partially delivered messages in outbox")
+
+def parse_outbox_key(key):
+    """(source, destination, user_id, pair_name) of an outbox key; the last two are None for legacy keys."""
+    route, _, owner = key.partition('@')
+    source, _, rest = route.partition(':')
+    user_id, _, pair_name = owner.partition('/')
+    return source, rest.partition('>')[2], user_id or None, pair_name or None
+
+def outbox_key_live(key):
+    """Whether the pair named by an outbox key still exists with the same route."""
+    source, destination, user_id, pair_name = parse_outbox_key(key)
+    pair = pair_configs.get((user_id, pair_name))
+    return pair is not None and (str(pair.source), str(pair.destination)) == (source, destination)
+
+def outbox_entry(key, record, msg_id):
+    """Journal line for one delivered part; the first part of a split message also carries its text."""
+    entry = {'k': key, 'n': record['total'], 'id': msg_id}
+    if msg_id == record['ids'][0]:
+        entry['t'] = int(record['t'])
+        if 'x' in record:
+            entry['x'], entry['en'] = record['x'], [tl_dump(e) for e in record['en']]
+    return entry
+
+def record_delivery(key, msg_id, total, text=None, entities=None):
+    """Journal one delivered part so retries and restarts resume after it.
+
+    Split messages keep the rendered ``text`` and ``entities`` so a resume sends the
+    rest of the same text, even when filters such as the scrambler are not repeatable.
+    """
+    record = outbox.get(key)
+    if record is None:
+        record = outbox[key] = {'total': total, 'ids': [], 't': time.time()}
+        if total > 1 and text is not None:
+            record['x'], record['en'] = text, list(entities or [])
+    record['ids'].append(msg_id)
+    if outbox_handle:
+        outbox_handle.write(json.dumps(outbox_entry(key, record, msg_id)) + "\n")
+
+def finish_delivery(key):
+    """Close an outbox record once its mapping is stored or the job is abandoned."""
+    if outbox.pop(key, None) is not None and outbox_handle:
+        outbox_handle.write(json.dumps({'k': key, 'done': 1}) + "\n")
+
+def write_json_atomic(path, data):
+    """Write JSON through a temp file so a crash never leaves a torn file."""
+    with open(path + ".tmp", "w") as f:
+        json.dump(data, f)
+    os.replace(path + ".tmp", path)
+
+async def flush_session():
+    """Write buffered session changes every SESSION_FLUSH_INTERVAL seconds, off the event loop."""
+    while True:
+        await asyncio.sleep(SESSION_FLUSH_INTERVAL)
+        if not session.dirty:
+            continue
+        try:
+            await asyncio.to_thread(session.write, session.snapshot())
+        except Exception as e:
+            session.dirty = True  # Retry with the next flush
+            logger.error(f"Error saving session: {e}")
+
+def save_checkpoint(in_flight=()):
+    """Checkpoint unfinished jobs, the message-ID map and stats to disk."""
+    jobs = [job.to_dict() for job in list(in_flight) + list(message_queue)]
+    for path, data, label in (
+        (QUEUE_CHECKPOINT_FILE, jobs, "queue"),
+        (FORWARDED_FILE, getattr(client, 'forwarded_messages', {}), "message map"),
+        (SENT_DIGESTS_FILE, sent_digests, "edit digests"),
+        (STATS_FILE, pair_stats, "stats"),
+    ):
+        try:
+            write_json_atomic(path, data)
+        except Exception as e:
+            logger.error(f"Error checkpointing {label}: {e}")
+    logger.info(f"💾 Checkpointed {len(jobs)} jobs")
+
+def load_checkpoint():
+    """Restore the message-ID map, stats and queued jobs from the last shutdown."""
+    try:
+        with open(FORWARDED_FILE, "r") as f:
+            client.forwarded_messages = json.load(f)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.error(f"Error loading message map: {e}")
+    try:
+        with open(SENT_DIGESTS_FILE, "r") as f:
+            sent_digests.update(json.load(f))
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.error(f"Error loading edit digests: {e}")
+    try:
+        with open(STATS_FILE, "r") as f:
+            for user_id, pairs in json.load(f).items():
+                for pair_name, stats in pairs.items():
+                    if pair_name in pair_stats.get(user_id, {}):
+                        pair_stats[user_id][pair_name].update(stats)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.error(f"Error loading stats: {e}")
+    try:
+        with open(QUEUE_CHECKPOINT_FILE, "r") as f:
+            jobs = json.load(f)
+        os.remove(QUEUE_CHECKPOINT_FILE)
+    except FileNotFoundError:
+        return
+    except Exception as e:
+        logger.error(f"Error loading queue checkpoint: {e}")
+        return
+    restored = 0
+    for data in jobs:
+        pair = pair_configs.get((data['u'], data['n']))
+        if pair is None:
+            continue  # pair removed while stopped
+        try:
+            message_queue.append(Job.from_dict(data, pair))
+            restored += 1
+        except Exception as e:
+            logger.error(f"Error restoring job for pair '{data.get('n')}': {e}")
+    logger.info(f"📥 Restored {restored} queued jobs")
+
+def user_quota(user_id, key):
+    """Scheduling setting for a user: 'weight', 'share' (queue fraction) or 'rate' (jobs/min)."""
+    value = user_quotas.get(user_id, {}).get(key)
+    if key == 'weight':
+        return max(0.125, value or DEFAULT_USER_WEIGHT)
+    return value or None
+
+pattern_cache = {}  # Pattern tuple -> compiled regex, shared by pairs with the same filters
 
 def compile_patterns(patterns):
     """Compile patterns into regex for efficient matching."""
     if not patterns:
         return None
-    escaped = [re.escape(p.strip().lower()) for p in patterns if p.strip()]
-    return re.compile('|'.join(escaped)) if escaped else None
-
-def remove_patterns(text, patterns):
-    """Remove specified patterns from text."""
-    if not text or not patterns:
-        return text
-    compiled = compile_patterns(patterns)
-    if compiled:
-        lines = text.split('\n')
-        filtered_lines = [line for line in lines if not compiled.match(line.strip().lower())]
-        return '\n'.join(filtered_lines).strip()
-    return text
-
-def strip_invisible_characters(text):
+    key = tuple(patterns)
+    if key not in pattern_cache:
+        escaped = [re.escape(p.strip().lower()) for p in patterns if p.strip()]
+        pattern_cache[key] = re.compile('|'.join(escaped)) if escaped else None
+    return pattern_cache[key]
+
+def utf16_len(text):
+    """Length of text in UTF-16 code units, the unit Telegram entity offsets use."""
+    return len(text) if text.isascii() else len(text.encode('utf-16-le')) // 2
+
+class RichText:
+    """Message text with its formatting entities, edited without re-parsing.
+
+    Entity offsets are UTF-16 code units, as Telegram counts them. Every edit shifts,
+    trims or drops the entities it touches. Entities are copied on construction, so
+    the source message's objects are never modified.
+    """
+
+    __slots__ = ('text', 'entities')
+
+    def __init__(self, text='', entities=()):
+        self.text = text or ''
+        self.entities = [copy.copy(e) for e in entities or ()]
+
+    def __add__(self, other):
+        if isinstance(other, str):
+            return RichText(self.text + other, self.entities)
+        result = RichText(self.text + other.text, self.entities)
+        shift = utf16_len(self.text)
+        for e in other.entities:
+            e = copy.copy(e)
+            e.offset += shift
+            result.entities.append(e)
+        return result
+
+    def str_index(self, offset):
+        """String index of a UTF-16 offset."""
+        if self.text.isascii():
+            return offset
+        return len(del_surrogate(add_surrogate(self.text)[:offset]))
+
+    def slice(self, start, end):
+        """Copy of ``text[start:end]`` with the entities clipped to it."""
+        part = RichText(self.text[start:end])
+        low = utf16_len(self.text[:start])
+        high = low + utf16_len(part.text)
+        for e in self.entities:
+            begin, finish = max(e.offset, low), min(e.offset + e.length, high)
+            if finish > begin:
+                e = copy.copy(e)
+                e.offset, e.length = begin - low, finish - begin
+                part.entities.append(e)
+        return part
+
+    def splice(self, edits):
+        """Apply ``(start, end, replacement)`` edits: sorted, non-overlapping string indices.
+
+        An entity starting inside a replaced range starts at the replacement, one
+        ending inside it ends after it; entities left empty are dropped.
+        """
+        if not edits:
+            return self
+        pieces, starts, moved = [], [], []
+        pos = old = new = 0
+        for start, end, replacement in edits:
+            gap = utf16_len(self.text[pos:start])
+            old, new = old + gap, new + gap
+            removed, added = utf16_len(self.text[start:end]), utf16_len(replacement)
+            starts.append(old)
+            moved.append((old + removed, new, added))  # Old end, new start, inserted length
+            pieces += (self.text[pos:start], replacement)
+            old, new, pos = old + removed, new + added, end
+        pieces.append(self.text[pos:])
+        self.text = ''.join(pieces)
+
+        def shift(offset, is_end):
+            # An insertion at an entity's end isn't part of it; one at its start comes before it
+            i = (bisect.bisect_left if is_end else bisect.bisect_right)(starts, offset) - 1
+            if i < 0:
+                return offset
+            old_end, new_start, added = moved[i]
+            if offset >= old_end:
+                return new_start + added + offset - old_end
+            return new_start + added if is_end else new_start
+
+        entities = []
+        for e in self.entities:
+            start, end = shift(e.offset, False), shift(e.offset + e.length, True)
+            if end > start:
+                e.offset, e.length = start, end - start
+                entities.append(e)
+        self.entities = entities
+        return self
+
+    def strip(self):
+        """Trim surrounding whitespace like ``str.strip``."""
+        stripped = self.text.lstrip()
+        lead = len(self.text) - len(stripped)
+        end = lead + len(stripped.rstrip())
+        return self.splice([edit for edit in ((0, lead, ''), (end, len(self.text), '')) if edit[0] < edit[1]])
+
+def parse_template(template):
+    """Parse a custom header/footer's HTML once; None when unset."""
+    if not template:
+        return None
+    return RichText(*html.parse(template))
+
+def remove_patterns(rich, compiled):
+    """Remove lines matching a precompiled pattern from text."""
+    if not rich.text or not compiled:
+        return rich
+    edits, pos = [], 0
+    for line in rich.text.split('\n'):
+        end = pos + len(line)
+        if compiled.match(line.strip().lower()):
+            edits.append((pos, min(end + 1, len(rich.text)), ''))
+        pos = end + 1
+    return rich.splice(edits).strip()
+
+def strip_invisible_characters(rich):
     """Remove invisible Unicode characters to prevent fingerprinting."""
-    if not text:
-        return text
-    return ''.join(c for c in text if unicodedata.category(c)[0] != 'C')
+    edits = []
+    for i, c in enumerate(rich.text):
+        if unicodedata.category(c)[0] == 'C':
+            if edits and edits[-1][1] == i:
+                edits[-1] = (edits[-1][0], i + 1, '')
+            else:
+                edits.append((i, i + 1, ''))
+    return rich.splice(edits)
 
 def log_fingerprint(text, timestamp, pair_name):
     """Log SHA256 fingerprint of text for reverse detection protection."""
@@ -146,98 +1219,60 @@ def log_fingerprint(text, timestamp, pair_name):
     logger.info(f"🧬 Fingerprint [{h}] for pair {pair_name} at {timestamp}")
     return h
 
-def scramble_content_safe(text, entities=None):
+def scramble_content_safe(rich):
     """Scramble content safely, preserving formatting entities."""
-    if not text:
-        return text, entities
-    text = strip_invisible_characters(text)  # Strip invisible characters
-    lines = [line for line in text.split('\n') if line.strip()]
-    
-    # Adjust entity offsets if needed
-    new_entities = entities or []
+    if not rich.text:
+        return rich
+    rich = strip_invisible_characters(rich)
+    lines, pos = [], 0  # (start, end) of non-blank lines
+    for line in rich.text.split('\n'):
+        if line.strip():
+            lines.append((pos, pos + len(line)))
+        pos += len(line) + 1
     if len(lines) > 1:
-        random.shuffle(lines)  # Shuffle non-essential lines
-        if new_entities:
-            # Recompute entity offsets after shuffling
-            new_text = '\n'.join(lines)
-            offset_map = {}
-            original_pos = 0
-            new_pos = 0
-            for orig_line, new_line in zip(text.split('\n'), new_text.split('\n')):
-                offset_map[original_pos] = new_pos
-                original_pos += len(orig_line) + 1
-                new_pos += len(new_line) + 1
-            adjusted_entities = []
-            for ent in new_entities:
-                start = ent.offset
-                end = ent.offset + ent.length
-                new_start = offset_map.get(start, start)
-                new_length = ent.length
-                adjusted_entities.append(type(ent)(offset=new_start, length=new_length, **ent.__dict__))
-            new_entities = adjusted_entities
-        text = new_text.strip()
-    else:
-        text = '\n'.join(lines).strip()
+        random.shuffle(lines)  # Shuffle non-essential lines; entities move with their line
+    scrambled = RichText()
+    for n, (start, end) in enumerate(lines):
+        scrambled = (scrambled + '\n' if n else scrambled) + rich.slice(start, end)
 
     # Randomly add unique suffix or mutation
     if random.random() < 0.3:
         suffixes = ['😊', '👍', '🔥', '.', '..', '...']
-        suffix = f" {random.choice(suffixes)}"
-        text = text + suffix
-        if new_entities:
-            new_entities = [ent for ent in new_entities if ent.offset + ent.length <= len(text) - len(suffix)]
-    if random.random() < 0.2:
-        line_ending = '\n' if random.random() < 0.5 else '\r\n'
-        text = text + line_ending.strip()
+        scrambled += f" {random.choice(suffixes)}"
     if random.random() < 0.1:
-        text = text + '\u200B'  # Controlled zero-width space
-        if new_entities:
-            new_entities = [ent for ent in new_entities if ent.offset + ent.length <= len(text) - 1]
-    
-    return text.strip(), new_entities
+        scrambled += '\u200B'  # Controlled zero-width space
+    return scrambled.strip()
 
 def calculate_image_hash(img_bytes):
     """Calculate MD5 hash of image bytes."""
     return hashlib.md5(img_bytes).hexdigest()
 
-async def is_trap_image(media_bytes, mapping):
-    """Check if media matches a trap image hash."""
-    trap_hashes = mapping.get('trap_image_hashes', [])
-    if not trap_hashes:
-        return False
-    return calculate_image_hash(media_bytes) in trap_hashes
+def is_trap_image(image_hash, pair):
+    """Check if a media hash is one of the pair's trap images."""
+    return image_hash in pair.trap_image_hashes
 
-def remove_mentions_entities(text, entities):
+def remove_mentions_entities(rich):
     """Remove @mentions and t.me links while preserving other formatting."""
-    if not entities:
-        return text, None
-
-    new_text = ''
-    new_entities = []
-    last_offset = 0
-
-    for ent in entities:
-        entity_text = text[ent.offset:ent.offset + ent.length]
+    if not rich.entities:
+        return rich
 
+    edits = []
+    for ent in rich.entities:
+        start, end = rich.str_index(ent.offset), rich.str_index(ent.offset + ent.length)
         is_mention = isinstance(ent, (MessageEntityMention, MessageEntityMentionName))
         is_tme_url = (
             isinstance(ent, (MessageEntityUrl, MessageEntityTextUrl)) and
-            't.me/' in entity_text
+            't.me/' in rich.text[start:end]
         )
+        if (is_mention or is_tme_url) and not (edits and start < edits[-1][1]):
+            edits.append((start, end, ''))
+    return rich.splice(edits).strip()
 
-        if is_mention or is_tme_url:
-            new_text += text[last_offset:ent.offset]
-            last_offset = ent.offset + ent.length
-        else:
-            new_entities.append(ent)
-
-    new_text += text[last_offset:]
-    return new_text.strip(), new_entities
-
-def clean_image(image):
+def clean_image(photo):
     """Clean EXIF and modify image to break perceptual hashing."""
     try:
-        image = image.convert('RGB')
+        from PIL import Image
+        image = Image.open(io.BytesIO(photo)).convert('RGB')
         pixels = image.load()
         for x in range(0, image.width, 20):
             for y in range(0, image.height, 20):
@@ -250,404 +1285,719 @@ def clean_image(image):
         logger.error(f"Error cleaning image: {e}")
         return None
 
-async def process_media(event, mapping):
-    """Process media for stealth and trap checking."""
+def transfer_part_size():
+    """Configured part size, or 512 KB when it isn't a valid Telegram part size."""
+    if TRANSFER_PART_SIZE % 4096 == 0 and 0 < TRANSFER_PART_SIZE <= 524288 and 524288 % TRANSFER_PART_SIZE == 0:
+        return TRANSFER_PART_SIZE
+    return 524288
+
+async def download_parallel(document):
+    """Download a document as TRANSFER_CONCURRENCY interleaved stripes of parts."""
+    size, part = document.size, transfer_part_size()
+    parts = -(-size // part)
+    stripes = max(1, min(TRANSFER_CONCURRENCY, parts))
+    buffer = bytearray(size)
+
+    async def stripe(first):
+        offset = first * part
+        async for chunk in client.iter_download(
+            document, offset=offset, stride=stripes * part, limit=len(range(first, parts, stripes)),
+            request_size=part, chunk_size=part, file_size=size
+        ):
+            buffer[offset:offset + len(chunk)] = chunk
+            offset += stripes * part
+
+    await asyncio.gather(*(stripe(first) for first in range(stripes)))
+    return bytes(buffer)
+
+async def upload_parallel(data, name):
+    """Upload bytes with up to TRANSFER_CONCURRENCY part requests in flight; returns the InputFile to send."""
+    part = max(transfer_part_size(), get_appropriated_part_size(len(data)) * 1024)  # Keeps big files under the part limit
+    total = -(-len(data) // part)
+    file_id = random.getrandbits(63)
+    big = len(data) > BIG_FILE_SIZE
+    limiter = asyncio.Semaphore(TRANSFER_CONCURRENCY)
+
+    async def send_part(index):
+        chunk = data[index * part:(index + 1) * part]
+        async with limiter:
+            if big:
+                saved = await client(SaveBigFilePartRequest(file_id, index, total, chunk))
+            else:
+                saved = await client(SaveFilePartRequest(file_id, index, chunk))
+        if not saved:
+            raise ValueError(f"Telegram rejected part {index} of {total}")
+
+    await asyncio.gather(*(send_part(index) for index in range(total)))
+    return InputFileBig(file_id, total, name) if big else InputFile(file_id, total, name, '')
+
+def media_cache_key(media):
+    """Cache key for a source photo or document, or None for other media."""
+    if isinstance(media, MessageMediaPhoto) and media.photo:
+        return ('src', 'photo', media.photo.id)
+    if isinstance(media, MessageMediaDocument) and media.document:
+        return ('src', 'doc', media.document.id)
+    return None
+
+def media_cache_get(key):
+    """Cached value for ``key`` unless missing or older than MEDIA_CACHE_TTL."""
+    entry = media_cache.get(key)
+    if entry is None:
+        return None
+    if time.monotonic() > entry[0]:
+        del media_cache[key]
+        return None
+    media_cache.move_to_end(key)
+    return entry[1]
+
+def media_cache_put(key, value, expires=None):
+    """Store a value, evicting the least recently used entries beyond MEDIA_CACHE_SIZE."""
+    media_cache[key] = (expires or time.monotonic() + MEDIA_CACHE_TTL, value)
+    media_cache.move_to_end(key)
+    while len(media_cache) > MEDIA_CACHE_SIZE:
+        media_cache.popitem(last=False)
+
+def forget_media(media):
+    """Drop the cached upload for a source media so the next attempt downloads and uploads it again."""
+    key = media_cache_key(media)
+    entry = media_cache.pop(key, None) if key else None
+    if entry:
+        media_cache.pop(('sha', entry[1][1]), None)
+
+def remember_sent_media(media, sent_message):
+    """Point the cache at the media of a sent copy, which Telegram lets us reuse without uploading."""
+    source = media_cache_get(media_cache_key(media))
+    sent_media = getattr(sent_message, 'media', None)
+    if source and isinstance(sent_media, (MessageMediaPhoto, MessageMediaDocument)):
+        content = ('sha', source[1])
+        if content in media_cache:
+            media_cache_put(content, sent_media, media_cache[content][0])
+
+async def process_media(job, pair):
+    """Process media for stealth and trap checking.
+
+    Photos and documents are uploaded here and the handle returned. Repeats of the
+    same source media, or media whose processed bytes were already uploaded, reuse
+    that handle instead of downloading and uploading again.
+    """
     try:
-        media = event.message.media
+        media = job.media
         if isinstance(media, MessageMediaWebPage):
             return None  # Skip web page previews
-        if isinstance(media, MessageMediaPhoto):
-            photo = await client.download_media(event.message, bytes)
-            if await is_trap_image(photo, mapping):
+        key = media_cache_key(media)
+        if key is None:
+            return media
+        cached = media_cache_get(key)
+        if cached and (upload := media_cache_get(('sha', cached[1]))):
+            if is_trap_image(cached[0], pair):
                 reason = "Blocked image hash"
-                await notify_trap(event, mapping, mapping['pair_name'], reason)
-                return None
-            image = Image.open(io.BytesIO(photo))
-            processed_media = clean_image(image)
-            if not processed_media:
+                await notify_trap(job, pair, job.pair_name, reason)
                 return None
-            file_bytes = io.BytesIO(processed_media)
-            file_bytes.name = f"stealth_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.jpg"
-            return file_bytes
-        elif isinstance(media, MessageMediaDocument):
-            file = await client.download_media(event.message, bytes)
-            if await is_trap_image(file, mapping):
-                reason = "Blocked image hash"
-                await notify_trap(event, mapping, mapping['pair_name'], reason)
+            return upload
+
+        stamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
+        if isinstance(media, MessageMediaPhoto):
+            raw = await client.download_media(media, bytes)
+        elif (media.document.size or 0) >= PARALLEL_TRANSFER_MIN_SIZE:
+            raw = await traced("download", download_parallel(media.document))
+        else:
+            raw = await client.download_media(media, bytes)
+        # Hash in a thread (hashlib releases the GIL); documents can be hundreds of MB
+        raw_hash = await asyncio.to_thread(calculate_image_hash, raw)
+        if is_trap_image(raw_hash, pair):
+            reason = "Blocked image hash"
+            await notify_trap(job, pair, job.pair_name, reason)
+            return None
+        if isinstance(media, MessageMediaPhoto):
+            processed = clean_image(raw)
+            if not processed:
                 return None
-            file_bytes = io.BytesIO(file)
-            file_bytes.name = f"stealth_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}{os.path.splitext(media.document.attributes[-1].file_name)[1]}"
-            return file_bytes
-        return media
+            name = f"stealth_{stamp}.jpg"
+            digest = await asyncio.to_thread(lambda: hashlib.sha256(processed).hexdigest())
+        else:
+            processed = raw
+            name = f"stealth_{stamp}{os.path.splitext(media.document.attributes[-1].file_name)[1]}"
+            digest = raw_hash  # Sent as downloaded, so the trap hash also keys the content
+
+        upload = media_cache_get(('sha', digest))
+        if upload is None:
+            if len(processed) >= PARALLEL_TRANSFER_MIN_SIZE:
+                upload = await traced("upload", upload_parallel(processed, name))
+            else:
+                file_bytes = io.BytesIO(processed)
+                file_bytes.name = name
+                upload = await traced("upload", client.upload_file(file_bytes))
+            media_cache_put(('sha', digest), upload)
+        media_cache_put(key, (raw_hash, digest))
+        return upload
     except Exception as e:
         logger.error(f"Error processing media: {e}")
         return None
 
-async def notify_trap(event, mapping, pair_name, reason):
+def notify_owner(text, key=None, category='general'):
+    """Add an owner alert to the next digest; repeats of the same alert are merged."""
+    if not NOTIFY_OWNER:
+        return
+    alert_key = (category, key)
+    alert = pending_alerts.get(alert_key)
+    if alert:
+        alert[0] = text
+        alert[1] += 1
+        return
+    cooldown = ALERT_COOLDOWNS.get(category)
+    if cooldown and time.monotonic() - alert_sent_at.get(alert_key, -cooldown) < cooldown:
+        return
+    pending_alerts[alert_key] = [text, 1]
+
+async def flush_alerts():
+    """Send pending alerts to the owner as one digest, within the hourly cap."""
+    if not pending_alerts or not is_connected or not OWNER_ID:
+        return
+    now = time.monotonic()
+    while digest_times and now - digest_times[0] > 3600:
+        digest_times.popleft()
+    if len(digest_times) >= DIGEST_MAX_PER_HOUR:
+        return
+    taken, items = [], []
+    while pending_alerts and len(items) < DIGEST_MAX_ITEMS:
+        alert_key, alert = pending_alerts.popitem(last=False)
+        taken.append((alert_key, alert, alert_sent_at.get(alert_key)))
+        alert_sent_at[alert_key] = now
+        text, count = alert
+        items.append(f"{text}\n🔁 Repeated {count}x" if count > 1 else text)
+    lines = [f"🔔 Alert Digest ({len(items)})"] + items
+    if pending_alerts:
+        lines.append(f"➕ {len(pending_alerts)} more in the next digest")
+    digest_times.append(now)
+    try:
+        # Plain text: pair names and error messages may contain <, > or &
+        await send_split_message(client, OWNER_ID, "\n\n".join(lines), entities=[])
+    except Exception as e:
+        logger.error(f"Error sending alert digest: {e}")
+        digest_times.remove(now)
+        # Put the alerts back in front, merged with repeats that arrived during the send
+        for alert_key, alert, sent_at in reversed(taken):
+            repeat = pending_alerts.pop(alert_key, None)
+            if repeat:
+                alert = [repeat[0], alert[1] + repeat[1]]
+            pending_alerts[alert_key] = alert
+            pending_alerts.move_to_end(alert_key, last=False)
+            if sent_at is None:
+                alert_sent_at.pop(alert_key, None)
+            else:
+                alert_sent_at[alert_key] = sent_at
+
+async def park(reason, seconds):
+    """Sleep inside a job, recording why so /debug can show parked workers."""
+    task = asyncio.current_task()
+    worker_waits[task] = (reason, time.monotonic() + seconds)
+    try:
+        with span("wait", reason=reason):
+            await asyncio.sleep(seconds)
+    finally:
+        worker_waits.pop(task, None)
+
+async def send_alert_digests():
+    """Batch owner alerts into periodic digests, off the copy workers."""
+    while True:
+        await asyncio.sleep(DIGEST_INTERVAL)
+        await flush_alerts()
+
+async def notify_trap(job, pair, pair_name, reason):
     """Notify owner of trapped content if enabled."""
-    if NOTIFY_OWNER and OWNER_ID:
-        msg_id = getattr(event.message, 'id', 'Unknown')
-        await client.send_message(
-            OWNER_ID,
-            f"🛑 Trap detected in pair '{pair_name}' from '{mapping['source']}'.\n"
-            f"📜 Reason: {reason}\n🆔 Source Message ID: {msg_id}"
-        )
+    msg_id = job.msg_id or 'Unknown'
+    notify_owner(
+        f"🛑 Trap detected in pair '{pair_name}' from '{pair.source}'.\n"
+        f"📜 Reason: {reason}\n🆔 Source Message ID: {msg_id}",
+        pair_name, 'trap'
+    )
 
-async def send_split_message(client, entity, message_text, reply_to=None, silent=False, entities=None):
-    """Send long messages by splitting them into parts."""
-    if len(message_text) <= MAX_MESSAGE_LENGTH:
-        return await client.send_message(
-            entity=entity,
-            message=message_text,
-            reply_to=reply_to,
-            silent=silent,
-            parse_mode='html',
-            formatting_entities=entities or None
-        )
-    parts = [message_text[i:i + MAX_MESSAGE_LENGTH] for i in range(0, len(message_text), MAX_MESSAGE_LENGTH)]
+async def send_split_message(client, entity, message_text, reply_to=None, silent=False, entities=None,
+                             delivered=(), on_part=None):
+    """Send long messages by splitting them into parts.
+
+    With ``entities`` (a list, possibly empty) the text is sent as-is and each part
+    carries the entities that fall inside it; without them it is parsed as HTML.
+    Parts with an index below ``len(delivered)`` were sent by an earlier attempt and
+    are skipped; ``on_part(sent_message, total_parts)`` runs after each new part.
+    """
+    rich = RichText(message_text, entities)
+    parts = [rich.slice(i, i + MAX_MESSAGE_LENGTH) for i in range(0, len(message_text), MAX_MESSAGE_LENGTH)] or [rich]
     sent_messages = []
-    for part in parts:
+    for index, part in enumerate(parts):
+        if index < len(delivered):
+            continue
         sent_msg = await client.send_message(
             entity=entity,
-            message=part,
-            reply_to=reply_to if not sent_messages else None,
+            message=part.text,
+            reply_to=reply_to if index == 0 else None,
             silent=silent,
-            parse_mode='html',
-            formatting_entities=entities or None if not sent_messages else None
+            parse_mode='html' if entities is None else None,
+            formatting_entities=None if entities is None else part.entities
         )
+        if on_part:
+            on_part(sent_msg, len(parts))
         sent_messages.append(sent_msg)
-        await asyncio.sleep(0.5)
+        if len(parts) > 1:
+            await asyncio.sleep(0.5)
     return sent_messages[0] if sent_messages else None
 
-async def copy_message_with_retry(event, mapping, user_id, pair_name):
+def clean_message_text(job, pair, is_reply):
+    """Apply the pair's text filters, carrying the source entities through every edit."""
+    rich = RichText(job.text, job.entities)
+    if not rich.text:
+        return rich.text, rich.entities
+    with span("filter"):
+        rich = remove_patterns(rich, pair.header_re)
+        rich = remove_patterns(rich, pair.footer_re)
+        rich, _ = remove_phrases(rich, pair.remove_phrases)
+        if pair.remove_mentions:
+            rich = remove_mentions_entities(rich)
+        if is_reply and pair.content_scramble:
+            rich.splice([(m.start(), m.end(), '') for m in QUOTE_LINE_RE.finditer(rich.text)])
+        if scramble_content_enabled and pair.content_scramble:
+            rich = scramble_content_safe(rich)
+        rich = apply_custom_header_footer(rich, pair.custom_header, pair.custom_footer)
+    return rich.text, rich.entities
+
+async def copy_message_with_retry(job):
     """Copy message with retries and stealth features."""
-    source_msg_id = event.message.id if hasattr(event.message, 'id') else "Unknown"
+    user_id, pair_name = job.user_id, job.pair_name
     for attempt in range(MAX_RETRIES):
+        pair = job.pair  # Re-read per attempt; config changes re-point the job between retries
         try:
-            message_text = event.message.raw_text or ""
+            message_text = job.text
             text_lower = message_text.lower()
-            original_entities = event.message.entities or []
-            media = event.message.media
-            if isinstance(media, MessageMediaWebPage):
-                media = None  # Skip web page previews
-            reply_to = await handle_reply_mapping(event, mapping)
+            reply_to = await traced("reply_lookup", handle_reply_mapping(job, pair))
             is_reply = reply_to is not None
 
             # Check for trap phrases
-            compiled_traps = compile_patterns(mapping.get('trap_phrases', []))
-            if compiled_traps and compiled_traps.search(text_lower):
+            if pair.trap_re and pair.trap_re.search(text_lower):
                 reason = "Trap phrase in text"
-                await notify_trap(event, mapping, pair_name, reason)
+                await notify_trap(job, pair, pair_name, reason)
                 pair_stats[user_id][pair_name]['blocked'] += 1
                 return True
 
             # Check for known trap variants
-            if any(p.lower() in text_lower for p in TRAP_VARIANTS):
+            if any(p in text_lower for p in TRAP_VARIANTS_LOWER):
                 reason = "Known trap pattern detected"
-                await notify_trap(event, mapping, pair_name, reason)
+                await notify_trap(job, pair, pair_name, reason)
                 pair_stats[user_id][pair_name]['blocked'] += 1
                 return True
 
             # Check for trap links
-            if re.search(r"https?://(fxleaks|track|redirect|trk)\.", text_lower, re.IGNORECASE):
+            if TRAP_LINK_RE.search(text_lower):
                 reason = "Trap link detected"
-                await notify_trap(event, mapping, pair_name, reason)
+                await notify_trap(job, pair, pair_name, reason)
                 pair_stats[user_id][pair_name]['blocked'] += 1
                 return True
 
-            # Text cleaning
-            if message_text:
-                message_text = remove_patterns(message_text, mapping.get('header_patterns', []))
-                message_text = remove_patterns(message_text, mapping.get('footer_patterns', []))
-                message_text, _ = remove_phrases(message_text, mapping.get('remove_phrases', []))
-                if mapping.get('remove_mentions', False):
-                    message_text, original_entities = remove_mentions_entities(message_text, original_entities)
-                if is_reply and mapping.get('content_scramble', False):
-                    message_text = re.sub(r'^>\s.*?\n', '', message_text, flags=re.MULTILINE)
-                if scramble_content_enabled and mapping.get('content_scramble', False):
-                    message_text, original_entities = scramble_content_safe(message_text, original_entities)
-                message_text = apply_custom_header_footer(
-                    message_text, mapping.get('custom_header', ''), mapping.get('custom_footer', '')
-                )
-                if message_text != event.message.raw_text:
-                    original_entities = None
+            # Text cleaning; a partly sent message resumes with the text its first parts came from
+            record = outbox.get(job.key)
+            if record and 'x' in record:
+                message_text, original_entities = record['x'], record['en']
+            else:
+                message_text, original_entities = clean_message_text(job, pair, is_reply)
 
             # Log text fingerprint
             if message_text:
                 log_fingerprint(message_text, datetime.now().isoformat(), pair_name)
 
-            # Preserve formatting if text was modified
-            if original_entities is None and message_text:
-                message_text, original_entities = await client._parse_message_text(message_text, parse_mode='html')
-
             # Random delay with jitter for anti-time slot fingerprinting
-            delay_range = REPLY_DELAY_RANGE = [1.5, 3.0] if is_reply else mapping.get('delay_range', DEFAULT_DELAY_RANGE)
+            # Fast mode uses its global ranges; otherwise the pair's /setdelay range applies
             if FAST_MODE:
                 base_delay = random.uniform(*DEFAULT_DELAY_RANGE) + random.uniform(-0.2, 0.2)
                 anti_fingerprint_delay = random.uniform(*ANTI_FINGERPRINT_DELAY_RANGE)
                 total_delay = max(0, base_delay + anti_fingerprint_delay)
             else:
-                base_delay = random.uniform(*DEFAULT_DELAY_RANGE)
-                total_delay = base_delay
-            if mapping.get('stealth_mode', True):
-                await asyncio.sleep(total_delay)
-
-            # Send message
-            if processed_media := await process_media(event, mapping):
-                sent_message = await client.send_message(
-                    entity=int(mapping['destination']),
-                    file=processed_media,
-                    message=message_text,
-                    reply_to=reply_to,
-                    silent=event.message.silent,
-                    parse_mode='html',
-                    formatting_entities=original_entities or None
-                )
-            else:
-                if not message_text.strip():
+                total_delay = random.uniform(*(REPLY_DELAY_RANGE if is_reply else pair.delay_range))
+            if pair.stealth_mode:
+                await park("stealth delay", total_delay)
+
+            # Send message, resuming after any parts an earlier attempt delivered
+            if record is None and (processed_media := await traced("media", process_media(job, pair))):
+                try:
+                    sent_message = await traced("send", client.send_message(
+                        entity=pair.peer,
+                        file=processed_media,
+                        message=message_text,
+                        reply_to=reply_to,
+                        silent=job.silent,
+                        parse_mode=None,
+                        formatting_entities=original_entities
+                    ), attempt=attempt + 1)
+                except errors.RPCError as e:
+                    if not isinstance(e, errors.FloodWaitError):
+                        forget_media(job.media)  # A stale file reference would fail every retry
+                    raise
+                record_delivery(job.key, sent_message.id, 1)
+                remember_sent_media(job.media, sent_message)
+            elif record is None or len(record['ids']) < record['total']:
+                if record is None and not message_text.strip():
                     reason = "Empty message after filtering"
-                    await notify_trap(event, mapping, pair_name, reason)
+                    await notify_trap(job, pair, pair_name, reason)
                     pair_stats[user_id][pair_name]['blocked'] += 1
                     return True
-                sent_message = await send_split_message(
+                await traced("send", send_split_message(
                     client,
-                    int(mapping['destination']),
+                    pair.peer,
                     message_text,
                     reply_to=reply_to,
-                    silent=event.message.silent,
-                    entities=original_entities
-                )
-
-            await store_message_mapping(event, mapping, sent_message)
+                    silent=job.silent,
+                    entities=original_entities,
+                    delivered=record['ids'] if record else (),
+                    on_part=lambda sent, total: record_delivery(job.key, sent.id, total, message_text, original_entities)
+                ), attempt=attempt + 1)
+
+            await store_message_mapping(job, pair, outbox[job.key]['ids'][0],
+                                        message_digest(message_text, original_entities, job.media))
+            finish_delivery(job.key)
             pair_stats[user_id][pair_name]['forwarded'] += 1
             pair_stats[user_id][pair_name]['last_activity'] = datetime.now().isoformat()
-            if not mapping.get('stealth_mode', True):
-                logger.info(f"Copied message from {mapping['source']} to {mapping['destination']}")
+            if not pair.stealth_mode:
+                logger.info(f"Copied message from {pair.source} to {pair.destination}")
             return True
 
         except errors.FloodWaitError as e:
+            global flood_wait_until
             wait_time = e.seconds
+            flood_wait_until = max(flood_wait_until, time.monotonic() + wait_time)
             logger.warning(f"Flood wait error, sleeping for {wait_time}s for pair '{pair_name}'")
-            await asyncio.sleep(wait_time)
-        except errors.ChatWriteForbiddenError as e:
-            logger.warning(f"Bot forbidden to write in {mapping['destination']}. Pausing pair '{pair_name}'.")
-            mapping['status'] = 'paused'
-            save_mappings()
-            if NOTIFY_OWNER and OWNER_ID:
-                await client.send_message(OWNER_ID, f"⚠️ Paused pair '{pair_name}' due to write permission error.")
+            await park("flood wait", wait_time)
+        except errors.ChatWriteForbiddenError:
+            logger.warning(f"Bot forbidden to write in {pair.destination}. Pausing pair '{pair_name}'.")
+            pause_mapping(user_id, pair_name)
+            finish_delivery(job.key)
+            notify_owner(f"⚠️ Paused pair '{pair_name}' due to write permission error.", pair_name, 'pause')
             return False
-        except errors.ChannelInvalidError as e:
-            logger.warning(f"Invalid channel {mapping['destination']}. Pausing pair '{pair_name}'.")
-            mapping['status'] = 'paused'
-            save_mappings()
-            if NOTIFY_OWNER and OWNER_ID:
-                await client.send_message(OWNER_ID, f"⚠️ Paused pair '{pair_name}' due to invalid channel.")
+        except errors.ChannelInvalidError:
+            logger.warning(f"Invalid channel {pair.destination}. Pausing pair '{pair_name}'.")
+            pause_mapping(user_id, pair_name)
+            finish_delivery(job.key)
+            notify_owner(f"⚠️ Paused pair '{pair_name}' due to invalid channel.", pair_name, 'pause')
             return False
         except Exception as e:
+            if requeue_on_disconnect(job, e):
+                return False
             logger.error(f"Error copying message for pair '{pair_name}': {e}")
             if attempt < MAX_RETRIES - 1:
                 wait_time = RETRY_DELAY * (2 ** attempt)
-                await asyncio.sleep(wait_time)
+                await park(f"retry {attempt + 1}/{MAX_RETRIES}", wait_time)
             else:
-                if NOTIFY_OWNER and OWNER_ID:
-                    await client.send_message(OWNER_ID, f"❌ Failed to copy message for pair '{pair_name}' after {MAX_RETRIES} attempts.")
+                finish_delivery(job.key)
+                notify_owner(f"❌ Failed to copy message for pair '{pair_name}' after {MAX_RETRIES} attempts.", pair_name, 'failure')
                 return False
 
-async def edit_copied_message(event, mapping, user_id, pair_name):
+async def edit_copied_message(job):
     """Edit a copied message when the source is edited."""
+    pair, user_id, pair_name = job.pair, job.user_id, job.pair_name
     try:
         if not hasattr(client, 'forwarded_messages'):
             client.forwarded_messages = {}
-        mapping_key = f"{mapping['source']}:{event.message.id}"
+        mapping_key = f"{pair.source}:{job.msg_id}"
         if mapping_key not in client.forwarded_messages:
             return
 
         forwarded_msg_id = client.forwarded_messages[mapping_key]
-        forwarded_msg = await client.get_messages(int(mapping['destination']), ids=forwarded_msg_id)
-        if not forwarded_msg:
-            del client.forwarded_messages[mapping_key]
-            return
-
-        message_text = event.message.raw_text or ""
+        message_text = job.text
         text_lower = message_text.lower()
-        original_entities = event.message.entities or []
-        media = event.message.media
-        if isinstance(media, MessageMediaWebPage):
-            media = None  # Skip web page previews
-        reply_to = await handle_reply_mapping(event, mapping)
+        media = job.media
+        reply_to = await traced("reply_lookup", handle_reply_mapping(job, pair))
         is_reply = reply_to is not None
 
         # Check traps
-        compiled_traps = compile_patterns(mapping.get('trap_phrases', []))
-        if compiled_traps and compiled_traps.search(text_lower):
+        if pair.trap_re and pair.trap_re.search(text_lower):
             reason = "Trap phrase in edited text"
-            await notify_trap(event, mapping, pair_name, reason)
-            await client.delete_messages(int(mapping['destination']), [forwarded_msg_id])
+            await notify_trap(job, pair, pair_name, reason)
+            await client.delete_messages(pair.peer, [forwarded_msg_id])
             pair_stats[user_id][pair_name]['blocked'] += 1
             pair_stats[user_id][pair_name]['deleted'] += 1
             return
 
         # Check for known trap variants
-        if any(p.lower() in text_lower for p in TRAP_VARIANTS):
+        if any(p in text_lower for p in TRAP_VARIANTS_LOWER):
             reason = "Known trap pattern in edited text"
-            await notify_trap(event, mapping, pair_name, reason)
-            await client.delete_messages(int(mapping['destination']), [forwarded_msg_id])
+            await notify_trap(job, pair, pair_name, reason)
+            await client.delete_messages(pair.peer, [forwarded_msg_id])
             pair_stats[user_id][pair_name]['blocked'] += 1
             pair_stats[user_id][pair_name]['deleted'] += 1
             return
 
         # Check for trap links
-        if re.search(r"https?://(fxleaks|track|redirect|trk)\.", text_lower, re.IGNORECASE):
+        if TRAP_LINK_RE.search(text_lower):
             reason = "Trap link in edited text"
-            await notify_trap(event, mapping, pair_name, reason)
-            await client.delete_messages(int(mapping['destination']), [forwarded_msg_id])
+            await notify_trap(job, pair, pair_name, reason)
+            await client.delete_messages(pair.peer, [forwarded_msg_id])
             pair_stats[user_id][pair_name]['blocked'] += 1
             pair_stats[user_id][pair_name]['deleted'] += 1
             return
 
         # Text cleaning
-        if message_text:
-            message_text = remove_patterns(message_text, mapping.get('header_patterns', []))
-            message_text = remove_patterns(message_text, mapping.get('footer_patterns', []))
-            message_text, _ = remove_phrases(message_text, mapping.get('remove_phrases', []))
-            if mapping.get('remove_mentions', False):
-                message_text, original_entities = remove_mentions_entities(message_text, original_entities)
-            if is_reply and mapping.get('content_scramble', False):
-                message_text = re.sub(r'^>\s.*?\n', '', message_text, flags=re.MULTILINE)
-            if scramble_content_enabled and mapping.get('content_scramble', False):
-                message_text, original_entities = scramble_content_safe(message_text, original_entities)
-            message_text = apply_custom_header_footer(
-                message_text, mapping.get('custom_header', ''), mapping.get('custom_footer', '')
-            )
-            if message_text != event.message.raw_text:
-                original_entities = None
+        message_text, original_entities = clean_message_text(job, pair, is_reply)
+
+        # Skip edits that would leave the copy unchanged, before any lookup or download
+        digest = message_digest(message_text, original_entities, media)
+        if digest == sent_digests.get(mapping_key) and not isinstance(media, MessageMediaPoll):
+            if not pair.stealth_mode:
+                logger.info(f"Edit of {mapping_key} leaves the copy unchanged, skipped")
+            return
+
+        forwarded_msg = await traced("lookup", client.get_messages(pair.peer, ids=forwarded_msg_id))
+        if not forwarded_msg:
+            del client.forwarded_messages[mapping_key]
+            sent_digests.pop(mapping_key, None)
+            return
 
         # Log text fingerprint
         if message_text:
             log_fingerprint(message_text, datetime.now().isoformat(), pair_name)
 
         # Process media
-        processed_media = await process_media(event, mapping)
+        processed_media = await traced("media", process_media(job, pair))
         if processed_media is None and isinstance(media, (MessageMediaPhoto, MessageMediaDocument)):
-            await client.delete_messages(int(mapping['destination']), [forwarded_msg_id])
+            await client.delete_messages(pair.peer, [forwarded_msg_id])
             pair_stats[user_id][pair_name]['blocked'] += 1
             pair_stats[user_id][pair_name]['deleted'] += 1
             return
 
         if not message_text.strip() and not processed_media:
-            await client.delete_messages(int(mapping['destination']), [forwarded_msg_id])
+            await client.delete_messages(pair.peer, [forwarded_msg_id])
             reason = "Empty message after filtering"
-            await notify_trap(event, mapping, pair_name, reason)
+            await notify_trap(job, pair, pair_name, reason)
             pair_stats[user_id][pair_name]['blocked'] += 1
             pair_stats[user_id][pair_name]['deleted'] += 1
             return
 
         if isinstance(media, MessageMediaPoll):
-            await client.delete_messages(int(mapping['destination']), [forwarded_msg_id])
+            await client.delete_messages(pair.peer, [forwarded_msg_id])
             del client.forwarded_messages[mapping_key]
-            await copy_message_with_retry(event, mapping, user_id, pair_name)
+            sent_digests.pop(mapping_key, None)
+            await copy_message_with_retry(job)
             return
 
-        # Preserve formatting if text was modified
-        if original_entities is None and message_text:
-            message_text, original_entities = await client._parse_message_text(message_text, parse_mode='html')
-
-        await client.edit_message(
-            entity=int(mapping['destination']),
-            message=forwarded_msg_id,
-            text=message_text,
-            file=processed_media if processed_media else None,
-            parse_mode='html',
-            formatting_entities=original_entities or None
-        )
+        try:
+            await traced("send", client.edit_message(
+                entity=pair.peer,
+                message=forwarded_msg_id,
+                text=message_text,
+                file=processed_media if processed_media else None,
+                parse_mode=None,
+                formatting_entities=original_entities
+            ))
+        except errors.MessageNotModifiedError:
+            sent_digests[mapping_key] = digest  # Already showing this; remember so the next one is skipped
+            return
+        except errors.RPCError as e:
+            if processed_media and not isinstance(e, errors.FloodWaitError):
+                forget_media(media)
+            raise
+        sent_digests[mapping_key] = digest
         pair_stats[user_id][pair_name]['edited'] += 1
         pair_stats[user_id][pair_name]['last_activity'] = datetime.now().isoformat()
-        if not mapping.get('stealth_mode', True):
-            logger.info(f"Edited copied message {forwarded_msg_id} in {mapping['destination']}")
+        if not pair.stealth_mode:
+            logger.info(f"Edited copied message {forwarded_msg_id} in {pair.destination}")
 
     except Exception as e:
+        if requeue_on_disconnect(job, e):
+            return
         logger.error(f"Error editing message for pair '{pair_name}': {e}")
 
-async def delete_copied_message(event, mapping, user_id, pair_name):
-    """Delete a copied message when the source is deleted."""
+async def delete_copied_message(job):
+    """Delete copied messages when their sources are deleted."""
+    pair, user_id, pair_name = job.pair, job.user_id, job.pair_name
     try:
         if not hasattr(client, 'forwarded_messages'):
             client.forwarded_messages = {}
-        mapping_key = f"{mapping['source']}:{event.message.id}"
-        if mapping_key not in client.forwarded_messages:
+        mapping_keys = [f"{pair.source}:{deleted_id}" for deleted_id in job.msg_ids]
+        mapping_keys = [key for key in mapping_keys if key in client.forwarded_messages]
+        if not mapping_keys:
             return
-        forwarded_msg_id = client.forwarded_messages[mapping_key]
-        await client.delete_messages(int(mapping['destination']), [forwarded_msg_id])
-        pair_stats[user_id][pair_name]['deleted'] += 1
+        forwarded_msg_ids = [client.forwarded_messages[key] for key in mapping_keys]
+        await traced("send", client.delete_messages(pair.peer, forwarded_msg_ids))
+        for key in mapping_keys:
+            client.forwarded_messages.pop(key, None)
+            sent_digests.pop(key, None)
+        pair_stats[user_id][pair_name]['deleted'] += len(forwarded_msg_ids)
         pair_stats[user_id][pair_name]['last_activity'] = datetime.now().isoformat()
-        del client.forwarded_messages[mapping_key]
-        if not mapping.get('stealth_mode', True):
-            logger.info(f"Deleted copied message {forwarded_msg_id} in {mapping['destination']}")
+        if not pair.stealth_mode:
+            logger.info(f"Deleted copied messages {forwarded_msg_ids} in {pair.destination}")
     except Exception as e:
+        if requeue_on_disconnect(job, e):
+            return
         logger.error(f"Error deleting copied message for pair '{pair_name}': {e}")
 
-async def handle_reply_mapping(event, mapping):
+async def handle_reply_mapping(job, pair):
     """Map replies from source to destination messages."""
-    if not hasattr(event.message, 'reply_to') or not event.message.reply_to:
+    if not job.reply_to:
         return None
     try:
-        source_reply_id = event.message.reply_to.reply_to_msg_id
-        mapping_key = f"{mapping['source']}:{source_reply_id}"
+        mapping_key = f"{pair.source}:{job.reply_to}"
         if hasattr(client, 'forwarded_messages') and mapping_key in client.forwarded_messages:
             dest_reply_id = client.forwarded_messages[mapping_key]
             return dest_reply_id if dest_reply_id else None
         return None
     except Exception as e:
-        logger.error(f"Error handling reply mapping for pair '{mapping.get('pair_name', 'unknown')}': {e}")
+        logger.error(f"Error handling reply mapping for pair '{job.pair_name}': {e}")
         return None
 
-async def store_message_mapping(event, mapping, sent_message):
-    """Store mapping of source to destination message IDs."""
+async def store_message_mapping(job, pair, dest_msg_id, digest=None):
+    """Store mapping of source to destination message IDs, with the digest of what was sent."""
     try:
-        if not hasattr(event.message, 'id'):
+        if not job.msg_id:
             return
         if not hasattr(client, 'forwarded_messages'):
             client.forwarded_messages = {}
         if len(client.forwarded_messages) >= MAX_MAPPING_HISTORY:
             oldest_key = next(iter(client.forwarded_messages))
             client.forwarded_messages.pop(oldest_key)
-        mapping_key = f"{mapping['source']}:{event.message.id}"
-        client.forwarded_messages[mapping_key] = sent_message.id
+            sent_digests.pop(oldest_key, None)
+        mapping_key = f"{pair.source}:{job.msg_id}"
+        client.forwarded_messages[mapping_key] = dest_msg_id
+        if digest:
+            sent_digests[mapping_key] = digest
     except Exception as e:
-        logger.error(f"Error storing message mapping for pair '{mapping.get('pair_name', 'unknown')}': {e}")
+        logger.error(f"Error storing message mapping for pair '{job.pair_name}': {e}")
 
-def remove_phrases(text, phrases):
+def remove_phrases(rich, phrases):
     """Remove specific phrases from text."""
-    if not text or not phrases:
-        return text, False
+    if not rich.text or not phrases:
+        return rich, False
     found = False
     for phrase in phrases:
-        if phrase.lower() in text.lower():
-            text = text.replace(phrase, '')
+        if phrase and phrase.lower() in rich.text.lower():
+            rich.splice([(m.start(), m.end(), '') for m in re.finditer(re.escape(phrase), rich.text)])
             found = True
-    return re.sub(r'\s+', ' ', text).strip(), found
+    rich.splice([(m.start(), m.end(), ' ') for m in re.finditer(r'\s+', rich.text) if m.group() != ' '])
+    return rich.strip(), found
 
-def apply_custom_header_footer(text, header, footer):
-    """Apply custom header and footer to message text."""
-    if not text:
-        return text
-    result = text
+def apply_custom_header_footer(rich, header, footer):
+    """Apply a pair's pre-parsed custom header and footer to message text."""
+    if not rich.text:
+        return rich
     if header:
-        result = header + '\n' + result
+        rich = header + '\n' + rich
     if footer:
-        result = result + '\n' + footer
-    return result.strip()
+        rich = rich + '\n' + footer
+    return rich.strip()
+
+# Traffic Capture
+capture_handle = None
+capture_started = 0.0
+
+def start_capture(path):
+    """Open an append-only capture file of source updates for tools/replay.py."""
+    global capture_handle, capture_started
+    stop_capture()
+    capture_handle = open(path, "a", buffering=1, encoding="utf-8")
+    capture_started = time.monotonic()
+    capture_handle.write(json.dumps({'v': 1, 'start': datetime.now().isoformat()}) + "\n")
+    logger.info(f"🎙️ Capturing updates to {path}")
+
+def stop_capture():
+    """Close the capture file if one is open."""
+    global capture_handle
+    if capture_handle:
+        capture_handle.close()
+        capture_handle = None
+
+def media_metadata(media):
+    """Describe media by identity and size, without its contents."""
+    if isinstance(media, MessageMediaPhoto) and media.photo:
+        sizes = [s for s in getattr(media.photo, 'sizes', []) if hasattr(s, 'w')]
+        largest = sizes[-1] if sizes else None
+        size = getattr(largest, 'size', None) or max(getattr(largest, 'sizes', None) or [0])
+        return {'k': 'photo', 'id': media.photo.id, 'w': getattr(largest, 'w', 0), 'h': getattr(largest, 'h', 0), 's': size}
+    if isinstance(media, MessageMediaDocument) and media.document:
+        doc = media.document
+        name = next((a.file_name for a in doc.attributes if hasattr(a, 'file_name')), '')
+        return {'k': 'doc', 'id': doc.id, 's': doc.size, 'mt': doc.mime_type, 'fn': name}
+    return {'k': type(media).__name__}
+
+def message_digest(text, entities, media):
+    """Compact digest of what a copy shows: text, formatting and source media identity."""
+    h = hashlib.blake2b(text.encode(), digest_size=8)
+    for e in entities or ():
+        h.update(repr(e.to_dict()).encode())
+    if media:
+        h.update(json.dumps(media_metadata(media), sort_keys=True).encode())
+    return h.hexdigest()
+
+def capture_update(kind, event):
+    """Append one update ('n'ew, 'e'dit or 'd'elete) to the capture file."""
+    if event.chat_id not in source_index:
+        return
+    record = {'t': round(time.monotonic() - capture_started, 3), 'k': kind, 'c': event.chat_id}
+    if kind == 'd':
+        record['i'] = list(event.deleted_ids)
+    else:
+        message = event.message
+        record['i'] = message.id
+        if message.message:
+            record['x'] = message.message
+        if message.entities:
+            record['en'] = [e.to_dict() for e in message.entities]
+        if message.media and not isinstance(message.media, MessageMediaWebPage):
+            record['m'] = media_metadata(message.media)
+        if message.grouped_id:
+            record['g'] = message.grouped_id
+        if message.reply_to and getattr(message.reply_to, 'reply_to_msg_id', None):
+            record['r'] = message.reply_to.reply_to_msg_id
+        if message.silent:
+            record['s'] = 1
+    try:
+        capture_handle.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + "\n")
+    except Exception as e:
+        logger.error(f"Error writing capture record: {e}")
+
+# Command Routing
+COMMANDS = {}  # command word -> (compiled pattern, handler)
+authorized_users = set()  # owner plus users with pairs; checked before any command parsing
+
+def command(name, pattern):
+    """Register a command handler; ``pattern`` is matched against the whole message."""
+    def register(handler):
+        COMMANDS[name] = (re.compile(pattern), handler)
+        return handler
+    return register
+
+def refresh_authorized_users():
+    """Rebuild the set of user IDs allowed to run commands."""
+    global authorized_users
+    users = {int(user_id) for user_id in channel_mappings if user_id.lstrip('-').isdigit()}
+    users.update(AUTHORIZED_USERS)
+    if OWNER_ID:
+        users.add(OWNER_ID)
+    authorized_users = users
+
+def is_command(event):
+    """Cheap pre-filter: only slash messages from authorized users reach the router."""
+    return event.sender_id in authorized_users and (event.message.message or '').startswith('/')
+
+@client.on(events.NewMessage(func=is_command))
+async def route_command(event):
+    """Dispatch a command through a dictionary lookup on its first word."""
+    text = event.message.message
+    entry = COMMANDS.get(text.split(maxsplit=1)[0].lower())
+    if not entry:
+        return
+    pattern, handler = entry
+    match = pattern.match(text)
+    if not match:
+        return
+    event.pattern_match = match
+    try:
+        await handler(event)
+    except Exception as e:
+        logger.error(f"Error handling command {text.split(maxsplit=1)[0]}: {e}")
 
 # Event Handlers
-@client.on(events.NewMessage(pattern='(?i)^/sx$'))
+@command('/sx', '(?i)^/sx$')
 async def start(event):
-    """Handle /sx command."""
-    global OWNER_ID
-    OWNER_ID = event.sender_id
+    """Handle /sx command; ownership stays with the logged-in account set at startup."""
     if not SILENT_MODE:
         await event.reply("✅ StealthCopyBot Running!\nUse `/commands` for options.")
 
-@client.on(events.NewMessage(pattern='(?i)^/commands$'))
+@command('/commands', '(?i)^/commands$')
 async def list_commands(event):
     """List all available commands."""
     if SILENT_MODE:
@@ -657,6 +2007,7 @@ async def list_commands(event):
 
 **Setup & Management**
 - `/setpair <name> <source> <dest> [yes|no]` - Add pair (yes/no for mentions)
+- `/bulk` + lines or file - Apply many pair changes at once
 - `/listpairs` - Show all pairs
 - `/pausepair <name>` - Pause a pair
 - `/resumepair <name>` - Resume a pair
@@ -693,42 +2044,48 @@ async def list_commands(event):
 - `/addtrapimage <pair>` - Add trap image (reply to image)
 - `/removetrapimage <pair>` - Remove trap image (reply to image)
 - `/showtraps <pair>` - Show trap filters
+
+**👤 Users & Scheduling (owner)**
+- `/adduser <user_id>` - Authorize a user to manage pairs
+- `/removeuser <user_id>` - Remove a user and their pairs
+- `/capture <on|off> [file]` - Record source updates for replay
+- `/setweight <user_id> <weight>` - Set user's share of worker time
+- `/setquota <user_id> <share%> <per_min>` - Cap user's queue share and send rate (0 = no cap)
+- `/showquotas` - Show user weights and quotas
+- `/debug` - Dump workers, queues, waits and tasks
 """
     await event.reply(commands)
 
-@client.on(events.NewMessage(pattern=r'/setfastmode (on|off)'))
+@command('/setfastmode', r'/setfastmode (on|off)')
 async def toggle_fast_mode(event):
-    """Toggle FAST_MODE to adjust delays and worker count."""
-    global FAST_MODE, DEFAULT_DELAY_RANGE, ANTI_FINGERPRINT_DELAY_RANGE, NUM_WORKERS, worker_tasks
+    """Toggle FAST_MODE to adjust delays and the worker pool floor."""
+    global FAST_MODE, DEFAULT_DELAY_RANGE, ANTI_FINGERPRINT_DELAY_RANGE, MIN_WORKERS
     arg = event.pattern_match.group(1).lower()
     if arg == "on":
         FAST_MODE = True
         DEFAULT_DELAY_RANGE = [1, 2]
         ANTI_FINGERPRINT_DELAY_RANGE = [1, 5]
-        old_num_workers = NUM_WORKERS
-        NUM_WORKERS = 10
-        await event.reply("🚀 FAST MODE ENABLED\nBot will forward quickly with stealth.")
+        MIN_WORKERS = 10
+        await event.reply(f"🚀 FAST MODE ENABLED\nBot will forward quickly with stealth.\n⚙️ Workers: at least {MIN_WORKERS}")
     else:
         FAST_MODE = False
         DEFAULT_DELAY_RANGE = [1, 5]
         ANTI_FINGERPRINT_DELAY_RANGE = [2, 5]
-        old_num_workers = NUM_WORKERS
-        NUM_WORKERS = 3
-        await event.reply("🐢 NORMAL MODE ENABLED\nStandard delay and throughput restored.")
-
-    # Adjust worker tasks
-    if old_num_workers != NUM_WORKERS:
-        # Cancel existing worker tasks
-        for task in worker_tasks:
-            task.cancel()
-        worker_tasks.clear()
-        # Start new worker tasks
-        for _ in range(NUM_WORKERS):
-            task = asyncio.create_task(queue_worker())
-            worker_tasks.append(task)
-        logger.info(f"Adjusted to {NUM_WORKERS} queue workers.")
-
-@client.on(events.NewMessage(pattern=r'/setpair (\S+) (\S+) (\S+)(?: (yes|no))?'))
+        MIN_WORKERS = 2
+        await event.reply(f"🐢 NORMAL MODE ENABLED\nStandard delay and throughput restored.\n⚙️ Workers: {MIN_WORKERS}-{MAX_WORKERS}, adaptive")
+
+    # The pool controller keeps the pool within MIN_WORKERS..MAX_WORKERS; apply the new floor now
+    if pool_workers:
+        size = resize_workers(len(pool_workers))
+        logger.info(f"Worker pool floor set to {MIN_WORKERS}, pool now {size}.")
+
+def new_pair_mapping(source, destination, remove_mentions=False):
+    """Mapping dict for a newly added pair."""
+    mapping = copy.deepcopy(PAIR_DEFAULTS)
+    mapping.update(source=source.strip(), destination=destination.strip(), remove_mentions=remove_mentions)
+    return mapping
+
+@command('/setpair', r'/setpair (\S+) (\S+) (\S+)(?: (yes|no))?')
 async def set_pair(event):
     """Add a new forwarding pair."""
     pair_name, source, destination, remove_mentions = event.pattern_match.groups()
@@ -739,29 +2096,13 @@ async def set_pair(event):
         channel_mappings[user_id] = {}
     if user_id not in pair_stats:
         pair_stats[user_id] = {}
-    channel_mappings[user_id][pair_name] = {
-        'source': source.strip(),
-        'destination': destination.strip(),
-        'status': 'active',
-        'remove_mentions': remove_mentions,
-        'header_patterns': [],
-        'footer_patterns': [],
-        'remove_phrases': [],
-        'trap_phrases': [],
-        'trap_image_hashes': [],
-        'delay_range': DEFAULT_DELAY_RANGE,
-        'stealth_mode': True,
-        'content_scramble': False,
-        'custom_header': '',
-        'custom_footer': '',
-        'last_activity': None
-    }
+    channel_mappings[user_id][pair_name] = new_pair_mapping(source, destination, remove_mentions)
     pair_stats[user_id][pair_name] = {'forwarded': 0, 'edited': 0, 'deleted': 0, 'blocked': 0, 'queued': 0, 'last_activity': None}
-    save_mappings()
+    commit_mappings()
     if not SILENT_MODE:
         await event.reply(f"✅ Pair '{pair_name}' added: {source} ➡️ {destination}\nMentions removal: {'✅' if remove_mentions else '❌'}")
 
-@client.on(events.NewMessage(pattern=r'/enablestealth (\S+)'))
+@command('/enablestealth', r'/enablestealth (\S+)')
 async def enable_stealth(event):
     """Enable stealth mode for a pair."""
     pair_name = event.pattern_match.group(1).strip()
@@ -770,11 +2111,11 @@ async def enable_stealth(event):
         await event.reply("❌ Pair not found.")
         return
     channel_mappings[user_id][pair_name]['stealth_mode'] = True
-    save_mappings()
+    commit_mappings()
     if not SILENT_MODE:
         await event.reply(f"✅ Stealth mode enabled for '{pair_name}'.")
 
-@client.on(events.NewMessage(pattern=r'/disablestealth (\S+)'))
+@command('/disablestealth', r'/disablestealth (\S+)')
 async def disable_stealth(event):
     """Disable stealth mode for a pair."""
     pair_name = event.pattern_match.group(1).strip()
@@ -783,11 +2124,11 @@ async def disable_stealth(event):
         await event.reply("❌ Pair not found.")
         return
     channel_mappings[user_id][pair_name]['stealth_mode'] = False
-    save_mappings()
+    commit_mappings()
     if not SILENT_MODE:
         await event.reply(f"❌ Stealth mode disabled for '{pair_name}'.")
 
-@client.on(events.NewMessage(pattern=r'/enablescramble (\S+)'))
+@command('/enablescramble', r'/enablescramble (\S+)')
 async def enable_scramble(event):
     """Enable content scrambling for a pair."""
     pair_name = event.pattern_match.group(1).strip()
@@ -796,11 +2137,11 @@ async def enable_scramble(event):
         await event.reply("❌ Pair not found.")
         return
     channel_mappings[user_id][pair_name]['content_scramble'] = True
-    save_mappings()
+    commit_mappings()
     if not SILENT_MODE:
         await event.reply(f"✅ Content scrambling enabled for '{pair_name}'.")
 
-@client.on(events.NewMessage(pattern=r'/disablescramble (\S+)'))
+@command('/disablescramble', r'/disablescramble (\S+)')
 async def disable_scramble(event):
     """Disable content scrambling for a pair."""
     pair_name = event.pattern_match.group(1).strip()
@@ -809,11 +2150,11 @@ async def disable_scramble(event):
         await event.reply("❌ Pair not found.")
         return
     channel_mappings[user_id][pair_name]['content_scramble'] = False
-    save_mappings()
+    commit_mappings()
     if not SILENT_MODE:
         await event.reply(f"❌ Content scrambling disabled for '{pair_name}'.")
 
-@client.on(events.NewMessage(pattern=r'/addheader (\S+) (.+)'))
+@command('/addheader', r'/addheader (\S+) (.+)')
 async def add_header(event):
     """Add header pattern to remove."""
     pair_name, pattern = event.pattern_match.groups()
@@ -825,11 +2166,11 @@ async def add_header(event):
         return
     if pattern not in channel_mappings[user_id][pair_name]['header_patterns']:
         channel_mappings[user_id][pair_name]['header_patterns'].append(pattern)
-        save_mappings()
+        commit_mappings()
         if not SILENT_MODE:
             await event.reply(f"📑 Added header pattern for '{pair_name}': {pattern}")
 
-@client.on(events.NewMessage(pattern=r'/removeheader (\S+) (.+)'))
+@command('/removeheader', r'/removeheader (\S+) (.+)')
 async def remove_header(event):
     """Remove header pattern."""
     pair_name, pattern = event.pattern_match.groups()
@@ -841,13 +2182,13 @@ async def remove_header(event):
         return
     if pattern in channel_mappings[user_id][pair_name]['header_patterns']:
         channel_mappings[user_id][pair_name]['header_patterns'].remove(pattern)
-        save_mappings()
+        commit_mappings()
         if not SILENT_MODE:
             await event.reply(f"🗑️ Removed header pattern from '{pair_name}': {pattern}")
     else:
         await event.reply("❌ Header pattern not found.")
 
-@client.on(events.NewMessage(pattern=r'/addfooter (\S+) (.+)'))
+@command('/addfooter', r'/addfooter (\S+) (.+)')
 async def add_footer(event):
     """Add footer pattern to remove."""
     pair_name, pattern = event.pattern_match.groups()
@@ -859,13 +2200,13 @@ async def add_footer(event):
         return
     if pattern not in channel_mappings[user_id][pair_name]['footer_patterns']:
         channel_mappings[user_id][pair_name]['footer_patterns'].append(pattern)
-        save_mappings()
+        commit_mappings()
         if not SILENT_MODE:
             await event.reply(f"📑 Added footer pattern for '{pair_name}': {pattern}")
     else:
         await event.reply("⚠️ Footer pattern already exists.")
 
-@client.on(events.NewMessage(pattern=r'/removefooter (\S+) (.+)'))
+@command('/removefooter', r'/removefooter (\S+) (.+)')
 async def remove_footer(event):
     """Remove footer pattern."""
     pair_name, pattern = event.pattern_match.groups()
@@ -877,13 +2218,13 @@ async def remove_footer(event):
         return
     if pattern in channel_mappings[user_id][pair_name]['footer_patterns']:
         channel_mappings[user_id][pair_name]['footer_patterns'].remove(pattern)
-        save_mappings()
+        commit_mappings()
         if not SILENT_MODE:
             await event.reply(f"🗑️ Removed footer pattern from '{pair_name}': {pattern}")
     else:
         await event.reply("❌ Footer pattern not found.")
 
-@client.on(events.NewMessage(pattern=r'/addremoveword (\S+) (.+)'))
+@command('/addremoveword', r'/addremoveword (\S+) (.+)')
 async def add_remove_word(event):
     """Add phrase to remove."""
     pair_name, phrase = event.pattern_match.groups()
@@ -895,11 +2236,11 @@ async def add_remove_word(event):
         return
     if phrase not in channel_mappings[user_id][pair_name]['remove_phrases']:
         channel_mappings[user_id][pair_name]['remove_phrases'].append(phrase)
-        save_mappings()
+        commit_mappings()
         if not SILENT_MODE:
             await event.reply(f"🧹 Added phrase to remove for '{pair_name}': {phrase}")
 
-@client.on(events.NewMessage(pattern=r'/removeword (\S+) (.+)'))
+@command('/removeword', r'/removeword (\S+) (.+)')
 async def remove_word(event):
     """Remove phrase from removal list."""
     pair_name, phrase = event.pattern_match.groups()
@@ -911,13 +2252,13 @@ async def remove_word(event):
         return
     if phrase in channel_mappings[user_id][pair_name]['remove_phrases']:
         channel_mappings[user_id][pair_name]['remove_phrases'].remove(phrase)
-        save_mappings()
+        commit_mappings()
         if not SILENT_MODE:
             await event.reply(f"🗑️ Removed phrase from '{pair_name}': {phrase}")
     else:
         await event.reply("❌ Phrase not found.")
 
-@client.on(events.NewMessage(pattern=r'/enablementionremoval (\S+)'))
+@command('/enablementionremoval', r'/enablementionremoval (\S+)')
 async def enable_mention_removal(event):
     """Enable mention removal for a pair."""
     pair_name = event.pattern_match.group(1).strip()
@@ -926,11 +2267,11 @@ async def enable_mention_removal(event):
         await event.reply("❌ Pair not found.")
         return
     channel_mappings[user_id][pair_name]['remove_mentions'] = True
-    save_mappings()
+    commit_mappings()
     if not SILENT_MODE:
         await event.reply(f"✅ Mention removal enabled for '{pair_name}'.")
 
-@client.on(events.NewMessage(pattern=r'/disablementionremoval (\S+)'))
+@command('/disablementionremoval', r'/disablementionremoval (\S+)')
 async def disable_mention_removal(event):
     """Disable mention removal for a pair."""
     pair_name = event.pattern_match.group(1).strip()
@@ -939,11 +2280,11 @@ async def disable_mention_removal(event):
         await event.reply("❌ Pair not found.")
         return
     channel_mappings[user_id][pair_name]['remove_mentions'] = False
-    save_mappings()
+    commit_mappings()
     if not SILENT_MODE:
         await event.reply(f"❌ Mention removal disabled for '{pair_name}'.")
 
-@client.on(events.NewMessage(pattern=r'/showfilters (\S+)'))
+@command('/showfilters', r'/showfilters (\S+)')
 async def show_filters(event):
     """Show all text filters for a pair."""
     pair_name = event.pattern_match.group(1).strip()
@@ -964,7 +2305,7 @@ async def show_filters(event):
     if not SILENT_MODE:
         await event.reply(filters)
 
-@client.on(events.NewMessage(pattern=r'/addtrapword (\S+) (.+)'))
+@command('/addtrapword', r'/addtrapword (\S+) (.+)')
 async def add_trap_word(event):
     """Add trap phrase."""
     pair_name, word = event.pattern_match.groups()
@@ -976,11 +2317,11 @@ async def add_trap_word(event):
         return
     if word not in channel_mappings[user_id][pair_name]['trap_phrases']:
         channel_mappings[user_id][pair_name]['trap_phrases'].append(word)
-        save_mappings()
+        commit_mappings()
         if not SILENT_MODE:
             await event.reply(f"🛑 Added block phrase for '{pair_name}': {word}")
 
-@client.on(events.NewMessage(pattern=r'/removetrapword (\S+) (.+)'))
+@command('/removetrapword', r'/removetrapword (\S+) (.+)')
 async def remove_trap_word(event):
     """Remove trap phrase."""
     pair_name, word = event.pattern_match.groups()
@@ -992,13 +2333,13 @@ async def remove_trap_word(event):
         return
     if word in channel_mappings[user_id][pair_name]['trap_phrases']:
         channel_mappings[user_id][pair_name]['trap_phrases'].remove(word)
-        save_mappings()
+        commit_mappings()
         if not SILENT_MODE:
             await event.reply(f"🗑️ Removed block phrase from '{pair_name}': {word}")
     else:
         await event.reply("❌ Block phrase not found.")
 
-@client.on(events.NewMessage(pattern=r'/addtrapimage (\S+)'))
+@command('/addtrapimage', r'/addtrapimage (\S+)')
 async def add_trap_image(event):
     """Add trap image hash via reply."""
     pair_name = event.pattern_match.group(1).strip()
@@ -1018,7 +2359,7 @@ async def add_trap_image(event):
         image_hash = calculate_image_hash(media)
         if image_hash not in channel_mappings[user_id][pair_name]['trap_image_hashes']:
             channel_mappings[user_id][pair_name]['trap_image_hashes'].append(image_hash)
-            save_mappings()
+            commit_mappings()
             if not SILENT_MODE:
                 await event.reply(f"🛑 Added trap image hash for '{pair_name}': {image_hash}")
         else:
@@ -1027,7 +2368,7 @@ async def add_trap_image(event):
         await event.reply(f"❌ Error adding trap image: {str(e)}")
         logger.error(f"Error adding trap image for '{pair_name}': {e}")
 
-@client.on(events.NewMessage(pattern=r'/removetrapimage (\S+)'))
+@command('/removetrapimage', r'/removetrapimage (\S+)')
 async def remove_trap_image(event):
     """Remove trap image hash via reply."""
     pair_name = event.pattern_match.group(1).strip()
@@ -1047,7 +2388,7 @@ async def remove_trap_image(event):
         image_hash = calculate_image_hash(media)
         if image_hash in channel_mappings[user_id][pair_name]['trap_image_hashes']:
             channel_mappings[user_id][pair_name]['trap_image_hashes'].remove(image_hash)
-            save_mappings()
+            commit_mappings()
             if not SILENT_MODE:
                 await event.reply(f"🗑️ Removed trap image hash from '{pair_name}': {image_hash}")
         else:
@@ -1056,7 +2397,7 @@ async def remove_trap_image(event):
         await event.reply(f"❌ Error removing trap image: {str(e)}")
         logger.error(f"Error removing trap image for '{pair_name}': {e}")
 
-@client.on(events.NewMessage(pattern=r'/showtraps (\S+)'))
+@command('/showtraps', r'/showtraps (\S+)')
 async def show_traps(event):
     """Show all block filters."""
     pair_name = event.pattern_match.group(1).strip()
@@ -1073,7 +2414,7 @@ async def show_traps(event):
     if not SILENT_MODE:
         await event.reply(traps)
 
-@client.on(events.NewMessage(pattern=r'/pausepair (\S+)'))
+@command('/pausepair', r'/pausepair (\S+)')
 async def pause_pair(event):
     """Pause a forwarding pair."""
     pair_name = event.pattern_match.group(1).strip()
@@ -1082,11 +2423,11 @@ async def pause_pair(event):
         await event.reply("❌ Pair not found.")
         return
     channel_mappings[user_id][pair_name]['status'] = 'paused'
-    save_mappings()
+    commit_mappings()
     if not SILENT_MODE:
         await event.reply(f"⏸️ Pair '{pair_name}' paused.")
 
-@client.on(events.NewMessage(pattern=r'/resumepair (\S+)'))
+@command('/resumepair', r'/resumepair (\S+)')
 async def resume_pair(event):
     """Resume a forwarding pair."""
     pair_name = event.pattern_match.group(1).strip()
@@ -1095,11 +2436,11 @@ async def resume_pair(event):
         await event.reply("❌ Pair not found.")
         return
     channel_mappings[user_id][pair_name]['status'] = 'active'
-    save_mappings()
+    commit_mappings()
     if not SILENT_MODE:
         await event.reply(f"▶️ Pair '{pair_name}' resumed.")
 
-@client.on(events.NewMessage(pattern='(?i)^/pauseall$'))
+@command('/pauseall', '(?i)^/pauseall$')
 async def pause_all(event):
     """Pause all pairs for the user."""
     user_id = str(event.sender_id)
@@ -1108,11 +2449,11 @@ async def pause_all(event):
         return
     for pair_name in channel_mappings[user_id]:
         channel_mappings[user_id][pair_name]['status'] = 'paused'
-    save_mappings()
+    commit_mappings()
     if not SILENT_MODE:
         await event.reply("⏸️ All pairs paused.")
 
-@client.on(events.NewMessage(pattern='(?i)^/resumeall$'))
+@command('/resumeall', '(?i)^/resumeall$')
 async def resume_all(event):
     """Resume all pairs for the user."""
     user_id = str(event.sender_id)
@@ -1121,11 +2462,11 @@ async def resume_all(event):
         return
     for pair_name in channel_mappings[user_id]:
         channel_mappings[user_id][pair_name]['status'] = 'active'
-    save_mappings()
+    commit_mappings()
     if not SILENT_MODE:
         await event.reply("▶️ All pairs resumed.")
 
-@client.on(events.NewMessage(pattern=r'/setdelay (\S+) (\d*\.?\d+) (\d*\.?\d+)'))
+@command('/setdelay', r'/setdelay (\S+) (\d*\.?\d+) (\d*\.?\d+)')
 async def set_delay(event):
     """Set random delay range for a pair."""
     pair_name, min_delay, max_delay = event.pattern_match.groups()
@@ -1139,11 +2480,11 @@ async def set_delay(event):
         await event.reply("❌ Invalid delay range.")
         return
     channel_mappings[user_id][pair_name]['delay_range'] = [min_delay, max_delay]
-    save_mappings()
+    commit_mappings()
     if not SILENT_MODE:
         await event.reply(f"⏱️ Set delay range for '{pair_name}': {min_delay}s - {max_delay}s")
 
-@client.on(events.NewMessage(pattern=r'/status (\S+)'))
+@command('/status', r'/status (\S+)')
 async def status_pair(event):
     """Check status of a specific pair."""
     pair_name = event.pattern_match.group(1).strip()
@@ -1166,36 +2507,38 @@ async def status_pair(event):
     if not SILENT_MODE:
         await event.reply(status_msg)
 
-@client.on(events.NewMessage(pattern='(?i)^/report$'))
-async def report(event):
-    """Show summary report of all pairs."""
-    user_id = str(event.sender_id)
-    if user_id not in channel_mappings or not channel_mappings[user_id]:
-        await event.reply("❌ No pairs found.")
-        return
-    report = ["📊 StealthCopyBot Report"]
+def summary_report(user_id, title):
+    """Report lines with one user's per-pair counters; shared by /report and the periodic report."""
+    report = [title]
+    user_stats = pair_stats.get(user_id, {})
     for pair_name, data in channel_mappings[user_id].items():
-        stats = pair_stats.get(user_id, {}).get(pair_name, {})
+        stats = user_stats.get(pair_name, {})
         report.append(
             f"📌 {pair_name}: {data['source']} ➡️ {data['destination']} [{data['status'].capitalize()}]\n"
             f"   📈 Fwd: {stats.get('forwarded', 0)} | Edt: {stats.get('edited', 0)} | "
             f"Del: {stats.get('deleted', 0)} | Blk: {stats.get('blocked', 0)}"
         )
-    report.append(f"📥 Queue Size: {len(message_queue)}/{MAX_QUEUE_SIZE}")
-    if not SILENT_MODE:
-        await send_split_message_event(event, "\n".join(report))
+    return report
 
-@client.on(events.NewMessage(pattern='(?i)^/monitor$'))
-async def monitor_pairs(event):
-    """Detailed monitoring of pairs."""
+@command('/report', '(?i)^/report$')
+async def report(event):
+    """Show summary report of all pairs."""
     user_id = str(event.sender_id)
     if user_id not in channel_mappings or not channel_mappings[user_id]:
-        await event.reply("❌ Pair not found.")
+        await event.reply("❌ No pairs found.")
         return
+    report = summary_report(user_id, "📊 StealthCopyBot Report")
+    report.append(f"📥 Queue Size: {len(message_queue)}/{MAX_QUEUE_SIZE}")
+    if not SILENT_MODE:
+        await send_split_message_event(event, "\n".join(report))
+
+def monitor_report(user_id):
+    """Detailed per-pair monitor lines for one user, followed by queue and worker state."""
     report = ["📊 Detailed Monitor"]
+    user_stats = pair_stats.get(user_id, {})
     for pair_name, data in channel_mappings[user_id].items():
-        stats = pair_stats.get(user_id, {}).get(pair_name, {})
-        last_activity = stats.get('last_activity', 'N/A')
+        stats = user_stats.get(pair_name, {})
+        last_activity = stats.get('last_activity') or 'N/A'
         if len(last_activity) > 20:
             last_activity = last_activity[:17] + "..."
         report.append(
@@ -1211,11 +2554,37 @@ async def monitor_pairs(event):
             f"   🔄 Scramble: {'✅' if data['content_scramble'] else '❌'}\n"
             f"   ⏱️ Delay: {data['delay_range'][0]}s - {data['delay_range'][1]}s"
         )
-    report.append(f"📥 Queue: {len(message_queue)}/{MAX_QUEUE_SIZE}")
+    report.append(
+        f"📥 Queue: {len(message_queue)}/{MAX_QUEUE_SIZE} "
+        f"(Del: {message_queue.depth(PRIORITY_DELETE)} | Edt: {message_queue.depth(PRIORITY_EDIT)} | "
+        f"New: {message_queue.depth(PRIORITY_NEW)})"
+    )
+    report.append(
+        f"⚙️ Workers: {len(pool_workers)} ({MIN_WORKERS}-{MAX_WORKERS}) | "
+        f"Busy: {sum(1 for t in pool_workers if t in worker_jobs)} | "
+        f"Util: {pool_stats['utilisation']:.0%} | Latency: {pool_stats['latency']:.1f}s"
+        + (" | 🐢 Flood wait" if time.monotonic() < flood_wait_until else "")
+    )
+    report.append(f"👤 Your Queue: {message_queue.user_depth(user_id)} (Weight: {user_quota(user_id, 'weight'):g})")
+    if lag := loop_lag_percentiles():
+        report.append(
+            "🐢 Loop lag: " + " | ".join(f"{name} {value * 1000:.0f}ms" for name, value in lag.items())
+            + f" | Stalls: {len(loop_stalls)}"
+        )
+    return report
+
+@command('/monitor', '(?i)^/monitor$')
+async def monitor_pairs(event):
+    """Detailed monitoring of pairs."""
+    user_id = str(event.sender_id)
+    if user_id not in channel_mappings or not channel_mappings[user_id]:
+        await event.reply("❌ Pair not found.")
+        return
+    report = monitor_report(user_id)
     if not SILENT_MODE:
         await send_split_message_event(event, "\n".join(report))
 
-@client.on(events.NewMessage(pattern=r'/setcustomheader (\S+) (.+)'))
+@command('/setcustomheader', r'/setcustomheader (\S+) (.+)')
 async def set_custom_header(event):
     """Set custom header for a pair."""
     pair_name, header = event.pattern_match.groups()
@@ -1226,11 +2595,11 @@ async def set_custom_header(event):
         await event.reply("❌ Pair not found.")
         return
     channel_mappings[user_id][pair_name]['custom_header'] = header
-    save_mappings()
+    commit_mappings()
     if not SILENT_MODE:
         await event.reply(f"📑 Set custom header for '{pair_name}': {header}")
 
-@client.on(events.NewMessage(pattern=r'/setcustomfooter (\S+) (.+)'))
+@command('/setcustomfooter', r'/setcustomfooter (\S+) (.+)')
 async def set_custom_footer(event):
     """Set custom footer for a pair."""
     pair_name, footer = event.pattern_match.groups()
@@ -1241,11 +2610,11 @@ async def set_custom_footer(event):
         await event.reply("❌ Pair not found.")
         return
     channel_mappings[user_id][pair_name]['custom_footer'] = footer
-    save_mappings()
+    commit_mappings()
     if not SILENT_MODE:
         await event.reply(f"📑 Set custom footer for '{pair_name}': {footer}")
 
-@client.on(events.NewMessage(pattern=r'/clearcustomheaderfooter (\S+)'))
+@command('/clearcustomheaderfooter', r'/clearcustomheaderfooter (\S+)')
 async def clear_custom_header_footer(event):
     """Clear custom header and footer for a pair."""
     pair_name = event.pattern_match.group(1).strip()
@@ -1255,11 +2624,11 @@ async def clear_custom_header_footer(event):
         return
     channel_mappings[user_id][pair_name]['custom_header'] = ''
     channel_mappings[user_id][pair_name]['custom_footer'] = ''
-    save_mappings()
+    commit_mappings()
     if not SILENT_MODE:
         await event.reply(f"🗑️ Cleared custom header and footer for '{pair_name}'.")
 
-@client.on(events.NewMessage(pattern='(?i)^/listpairs$'))
+@command('/listpairs', '(?i)^/listpairs$')
 async def list_pairs(event):
     """List all forwarding pairs for the user."""
     user_id = str(event.sender_id)
@@ -1271,7 +2640,7 @@ async def list_pairs(event):
     if not SILENT_MODE:
         await event.reply("\n".join(pairs))
 
-@client.on(events.NewMessage(pattern='(?i)^/clearpairs$'))
+@command('/clearpairs', '(?i)^/clearpairs$')
 async def clear_pairs(event):
     """Remove all forwarding pairs for the user."""
     user_id = str(event.sender_id)
@@ -1280,10 +2649,353 @@ async def clear_pairs(event):
         return
     channel_mappings[user_id] = {}
     pair_stats[user_id] = {}
-    save_mappings()
+    commit_mappings()
     if not SILENT_MODE:
         await event.reply("🗑️ All pairs cleared.")
 
+def bulk_list_op(key, add):
+    """Bulk op adding or removing a value from one of a pair's filter lists."""
+    def apply(mapping, value):
+        value = value.strip()
+        if add and value not in mapping[key]:
+            mapping[key].append(value)
+        elif not add:
+            if value not in mapping[key]:
+                raise ValueError(f"'{value}' not in {key}")
+            mapping[key].remove(value)
+    return r'(\S+) (.+)', apply
+
+def bulk_flag_op(key, value):
+    """Bulk op setting a pair field to a fixed value."""
+    def apply(mapping):
+        mapping[key] = value
+    return r'(\S+)', apply
+
+def bulk_set_delay(mapping, min_delay, max_delay):
+    min_delay, max_delay = float(min_delay), float(max_delay)
+    if min_delay < 0 or max_delay < min_delay:
+        raise ValueError("invalid delay range")
+    mapping['delay_range'] = [min_delay, max_delay]
+
+def bulk_clear_custom(mapping):
+    mapping['custom_header'] = ''
+    mapping['custom_footer'] = ''
+
+# Pair-level operations accepted by /bulk; each line is a pair command without the slash
+BULK_OPS = {
+    'addheader': bulk_list_op('header_patterns', True),
+    'removeheader': bulk_list_op('header_patterns', False),
+    'addfooter': bulk_list_op('footer_patterns', True),
+    'removefooter': bulk_list_op('footer_patterns', False),
+    'addremoveword': bulk_list_op('remove_phrases', True),
+    'removeword': bulk_list_op('remove_phrases', False),
+    'addtrapword': bulk_list_op('trap_phrases', True),
+    'removetrapword': bulk_list_op('trap_phrases', False),
+    'enablestealth': bulk_flag_op('stealth_mode', True),
+    'disablestealth': bulk_flag_op('stealth_mode', False),
+    'enablescramble': bulk_flag_op('content_scramble', True),
+    'disablescramble': bulk_flag_op('content_scramble', False),
+    'enablementionremoval': bulk_flag_op('remove_mentions', True),
+    'disablementionremoval': bulk_flag_op('remove_mentions', False),
+    'pausepair': bulk_flag_op('status', 'paused'),
+    'resumepair': bulk_flag_op('status', 'active'),
+    'setdelay': (r'(\S+) (\d*\.?\d+) (\d*\.?\d+)', bulk_set_delay),
+    'setcustomheader': (r'(\S+) (.+)', lambda mapping, text: mapping.__setitem__('custom_header', text.strip())),
+    'setcustomfooter': (r'(\S+) (.+)', lambda mapping, text: mapping.__setitem__('custom_footer', text.strip())),
+    'clearcustomheaderfooter': (r'(\S+)', bulk_clear_custom),
+}
+BULK_OPS = {name: (re.compile(pattern + '$'), apply) for name, (pattern, apply) in BULK_OPS.items()}
+BULK_SETPAIR_RE = re.compile(r'(\S+) (\S+) (\S+)(?: (yes|no))?$')
+BULK_PAIR_KEYS = set(new_pair_mapping('0', '0'))
+BULK_IGNORED_KEYS = {'pair_name'}  # Written by older versions; the JSON key is the name
+
+def check_pair_fields(pair_name, mapping):
+    """Type-check an imported mapping against PAIR_DEFAULTS; returns it without ignored keys."""
+    mapping = {key: value for key, value in mapping.items() if key not in BULK_IGNORED_KEYS}
+    problems = []
+    unknown = set(mapping) - BULK_PAIR_KEYS
+    if unknown:
+        problems.append(f"unknown fields {', '.join(sorted(unknown))}")
+    for key in ('source', 'destination'):
+        value = mapping[key]
+        if isinstance(value, bool) or not isinstance(value, (int, str)) or not str(value).strip().lstrip('-').isdigit():
+            problems.append(f"{key} must be a chat ID")
+        else:
+            mapping[key] = str(value).strip()  # Stored as strings, like /setpair does
+    for key, value in mapping.items():
+        default = PAIR_DEFAULTS.get(key)
+        if key not in PAIR_DEFAULTS or (key == 'last_activity' and value is None):
+            continue
+        if key == 'delay_range':
+            if (not isinstance(value, list) or len(value) != 2
+                    or not all(isinstance(v, (int, float)) and not isinstance(v, bool) and v >= 0 for v in value)
+                    or value[0] > value[1]):
+                problems.append("delay_range must be [min, max] seconds")
+        elif key == 'status':
+            if value not in ('active', 'paused'):
+                problems.append("status must be 'active' or 'paused'")
+        elif key == 'last_activity':
+            try:
+                datetime.fromisoformat(value)
+            except (TypeError, ValueError):
+                problems.append("last_activity must be an ISO timestamp or null")
+        elif isinstance(default, list):
+            if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+                problems.append(f"{key} must be a list of strings")
+        elif not isinstance(value, type(default)):
+            problems.append(f"{key} must be {'true or false' if isinstance(default, bool) else 'a string'}")
+    if problems:
+        raise ValueError(f"pair '{pair_name}': {'; '.join(problems)}")
+    return mapping
+
+def parse_bulk_changeset(text):
+    """Parse bulk lines or a JSON {pair_name: mapping} document into (line, op, args) steps."""
+    stripped = text.strip()
+    if stripped.startswith('{'):
+        pairs = json.loads(stripped)
+        if not isinstance(pairs, dict):
+            raise ValueError("JSON import must be an object of {pair_name: mapping}")
+        steps = []
+        for number, (pair_name, mapping) in enumerate(pairs.items(), 1):
+            if mapping is None:
+                steps.append((number, 'removepair', (pair_name,)))
+                continue
+            if not isinstance(mapping, dict) or 'source' not in mapping or 'destination' not in mapping:
+                raise ValueError(f"pair '{pair_name}': needs source and destination")
+            steps.append((number, 'importpair', (pair_name, check_pair_fields(pair_name, mapping))))
+        return steps
+    steps, errors = [], []
+    for number, line in enumerate(stripped.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        op, _, args = line.lstrip('/').partition(' ')
+        op = op.lower()
+        if op == 'setpair':
+            match = BULK_SETPAIR_RE.match(args.strip())
+        elif op == 'removepair':
+            match = re.match(r'(\S+)$', args.strip())
+        elif op in BULK_OPS:
+            match = BULK_OPS[op][0].match(args.strip())
+        else:
+            errors.append(f"line {number}: unknown operation '{op}'")
+            continue
+        if not match:
+            errors.append(f"line {number}: bad arguments for '{op}'")
+            continue
+        steps.append((number, op, match.groups()))
+    if errors:
+        raise ValueError("\n".join(errors))
+    return steps
+
+async def validate_chat_ids(chat_ids):
+    """Resolve chat IDs in one batch; returns {chat_id: error} for the ones that failed."""
+    failed, peers = {}, {}
+    limit = asyncio.Semaphore(BULK_RESOLVE_CONCURRENCY)
+
+    async def check(chat_id, lookup, arg):
+        async with limit:
+            try:
+                return await lookup(arg)
+            except Exception as e:
+                failed[chat_id] = str(e) or type(e).__name__
+
+    results = await asyncio.gather(*(check(c, client.get_input_entity, int(c)) for c in chat_ids))
+    peers = {chat_id: peer for chat_id, peer in zip(chat_ids, results) if chat_id not in failed}
+    if peers:
+        try:
+            await client.get_entity(list(peers.values()))  # One request per peer type
+        except Exception:
+            # Batch failed; find the culprits
+            await asyncio.gather(*(check(c, client.get_entity, peer) for c, peer in peers.items()))
+    for chat_id, peer in peers.items():
+        if chat_id not in failed:
+            resolved_peers[int(chat_id)] = peer
+    return failed
+
+def apply_bulk_changeset(user_id, steps):
+    """Apply steps to a copy of the user's pairs; raises ValueError without changing anything."""
+    draft = copy.deepcopy(channel_mappings.get(user_id, {}))
+    errors = []
+    for number, op, args in steps:
+        try:
+            if op == 'setpair':
+                pair_name, source, destination, remove_mentions = args
+                draft[pair_name] = new_pair_mapping(source, destination, remove_mentions == "yes")
+            elif op == 'importpair':
+                pair_name, mapping = args
+                draft[pair_name] = {**new_pair_mapping(str(mapping['source']), str(mapping['destination'])), **mapping}
+            elif op == 'removepair':
+                if args[0] not in draft:
+                    raise ValueError("pair not found")
+                del draft[args[0]]
+            else:
+                pair_name, *values = args
+                if pair_name not in draft:
+                    raise ValueError(f"pair '{pair_name}' not found")
+                BULK_OPS[op][1](draft[pair_name], *values)
+        except Exception as e:
+            errors.append(f"line {number}: {op}: {e}")
+    try:
+        build_pair_configs({user_id: draft}, strict=True)
+    except ValueError as e:
+        errors.append(str(e))
+    if errors:
+        raise ValueError("\n".join(errors))
+    return draft
+
+@command('/bulk', r'(?is)^/bulk\b\s*(.*)$')
+async def bulk_pairs(event):
+    """Apply many pair changes (or an attached file) as one validated, single-save transaction."""
+    user_id = str(event.sender_id)
+    text = event.pattern_match.group(1)
+    if not text.strip() and event.message.reply_to:
+        replied_msg = await event.get_reply_message()
+        if not replied_msg or not isinstance(replied_msg.media, MessageMediaDocument):
+            await event.reply("❌ Reply to a .txt or .json changeset file, or put the changes after /bulk.")
+            return
+        try:
+            text = (await client.download_media(replied_msg, bytes)).decode('utf-8-sig')
+        except Exception as e:
+            await event.reply(f"❌ Could not read the changeset file: {e}")
+            return
+    if not text.strip():
+        await event.reply("📦 Usage: /bulk followed by one pair command per line, or reply /bulk to a changeset file.")
+        return
+    try:
+        steps = parse_bulk_changeset(text)
+        # Validate the new chat IDs before touching any state
+        chat_ids = set()
+        for _, op, args in steps:
+            if op == 'setpair':
+                chat_ids.update(args[1:3])
+            elif op == 'importpair':
+                chat_ids.update((str(args[1]['source']), str(args[1]['destination'])))
+        known = {str(chat) for pair in pair_configs.values() for chat in (pair.source, pair.destination)}
+        failed = await validate_chat_ids(sorted(chat_ids - known))
+        if failed:
+            raise ValueError("\n".join(f"chat {chat_id}: {error}" for chat_id, error in failed.items()))
+        before = set(channel_mappings.get(user_id, {}))
+        draft = apply_bulk_changeset(user_id, steps)
+    except ValueError as e:
+        await send_split_message_event(event, f"❌ Bulk change rejected, nothing applied:\n{e}")
+        return
+    channel_mappings[user_id] = draft
+    ensure_pair_stats()
+    commit_mappings()
+    if not SILENT_MODE:
+        added, removed = set(draft) - before, before - set(draft)
+        await event.reply(
+            f"📦 Bulk change applied: {len(steps)} operations | ➕ {len(added)} added | "
+            f"➖ {len(removed)} removed | 🔄 {len(set(draft) & before)} kept"
+        )
+
+@command('/capture', r'/capture (on|off)(?: (\S+))?')
+async def toggle_capture(event):
+    """Start or stop recording source updates for offline replay."""
+    if event.sender_id != OWNER_ID:
+        await event.reply("❌ Owner only.")
+        return
+    arg, path = event.pattern_match.groups()
+    if arg == "on":
+        path = path or CAPTURE_FILE or "capture.jsonl"
+        start_capture(path)
+        await event.reply(f"🎙️ Capturing source updates to {path}")
+    else:
+        stop_capture()
+        await event.reply("⏹️ Capture stopped.")
+
+@command('/adduser', r'/adduser (-?\d+)')
+async def add_user(event):
+    """Authorize another user to manage their own pairs."""
+    if event.sender_id != OWNER_ID:
+        await event.reply("❌ Owner only.")
+        return
+    target = event.pattern_match.group(1)
+    channel_mappings.setdefault(target, {})
+    pair_stats.setdefault(target, {})
+    commit_mappings()
+    if not SILENT_MODE:
+        await event.reply(f"👤 User {target} authorized.")
+
+@command('/removeuser', r'/removeuser (-?\d+)')
+async def remove_user(event):
+    """Revoke a user's access and remove their pairs."""
+    if event.sender_id != OWNER_ID:
+        await event.reply("❌ Owner only.")
+        return
+    target = event.pattern_match.group(1)
+    if target not in channel_mappings:
+        await event.reply("❌ User not found.")
+        return
+    del channel_mappings[target]
+    pair_stats.pop(target, None)
+    commit_mappings()
+    if not SILENT_MODE:
+        await event.reply(f"🗑️ User {target} and their pairs removed.")
+
+@command('/setweight', r'/setweight (\S+) (\d*\.?\d+)')
+async def set_weight(event):
+    """Set a user's deficit round-robin weight."""
+    if event.sender_id != OWNER_ID:
+        await event.reply("❌ Owner only.")
+        return
+    target, weight = event.pattern_match.groups()
+    weight = float(weight)
+    if weight <= 0:
+        await event.reply("❌ Invalid weight.")
+        return
+    user_quotas.setdefault(target, {})['weight'] = weight
+    save_quotas()
+    if not SILENT_MODE:
+        await event.reply(f"⚖️ Set weight for user {target}: {weight}")
+
+@command('/setquota', r'/setquota (\S+) (\d*\.?\d+) (\d*\.?\d+)')
+async def set_quota(event):
+    """Set a user's queue share and send rate quotas."""
+    if event.sender_id != OWNER_ID:
+        await event.reply("❌ Owner only.")
+        return
+    target, share, rate = event.pattern_match.groups()
+    share, rate = float(share), float(rate)
+    if share > 100:
+        await event.reply("❌ Invalid queue share.")
+        return
+    quota = user_quotas.setdefault(target, {})
+    quota['share'] = share / 100 or None
+    quota['rate'] = rate or None
+    save_quotas()
+    if not SILENT_MODE:
+        await event.reply(
+            f"⚖️ Set quota for user {target}: Queue share: {f'{share:g}%' if share else 'Unlimited'} | "
+            f"Rate: {f'{rate:g}/min' if rate else 'Unlimited'}"
+        )
+
+@command('/debug', '(?i)^/debug$')
+async def debug_dump(event):
+    """Dump workers, queues, waits and asyncio tasks."""
+    if event.sender_id != OWNER_ID:
+        await event.reply("❌ Owner only.")
+        return
+    await send_split_message_event(event, debug_report(stack_depth=2))
+
+@command('/showquotas', '(?i)^/showquotas$')
+async def show_quotas(event):
+    """Show scheduling weights, quotas and queue depth per user."""
+    if event.sender_id != OWNER_ID:
+        await event.reply("❌ Owner only.")
+        return
+    lines = ["⚖️ User Scheduling"]
+    for target in sorted(set(channel_mappings) | set(user_quotas)):
+        share, rate = user_quota(target, 'share'), user_quota(target, 'rate')
+        lines.append(
+            f"👤 {target}: Weight: {user_quota(target, 'weight'):g} | "
+            f"Share: {f'{share * 100:g}%' if share else 'Unlimited'} | "
+            f"Rate: {f'{rate:g}/min' if rate else 'Unlimited'} | Queued: {message_queue.user_depth(target)}"
+        )
+    if not SILENT_MODE:
+        await send_split_message_event(event, "\n".join(lines))
+
 async def send_split_message_event(event, full_message):
     """Send long message as multiple parts."""
     if len(full_message) <= MAX_MESSAGE_LENGTH:
@@ -1297,136 +3009,509 @@ async def send_split_message_event(event, full_message):
 @client.on(events.NewMessage)
 async def copy_messages(event):
     """Queue new messages for copying."""
-    if not is_connected:
+    if capture_handle:
+        capture_update('n', event)
+    if shutting_down:
         return
-    queued_time = datetime.now()
-    for user_id, pairs in channel_mappings.items():
-        for pair_name, mapping in pairs.items():
-            if mapping['status'] == 'active' and event.chat_id == int(mapping['source']):
-                mapping['pair_name'] = pair_name
-                message_queue.append((event, mapping, user_id, pair_name, queued_time))
-                pair_stats[user_id][pair_name]['queued'] += 1
-                if not mapping.get('stealth_mode', True):
-                    logger.info(f"Message queued for pair '{pair_name}'")
+    for pair in source_index.get(event.chat_id, ()):
+        message_queue.append(Job.from_message(PRIORITY_NEW, event.message, pair))
+        pair_stats[pair.user_id][pair.name]['queued'] += 1
+        if not pair.stealth_mode:
+            logger.info(f"Message queued for pair '{pair.name}'")
 
 @client.on(events.MessageEdited)
 async def handle_message_edit(event):
-    """Handle edited messages."""
-    if not is_connected:
+    """Queue edited messages ahead of new ones."""
+    if capture_handle:
+        capture_update('e', event)
+    if shutting_down:
         return
-    for user_id, pairs in channel_mappings.items():
-        for pair_name, mapping in pairs.items():
-            if mapping['status'] == 'active' and event.chat_id == int(mapping['source']):
-                mapping['pair_name'] = pair_name
-                await edit_copied_message(event, mapping, user_id, pair_name)
-                return
+    for pair in source_index.get(event.chat_id, ()):
+        job = Job.from_message(PRIORITY_EDIT, event.message, pair)
+        # Not copied yet: send the edited version instead
+        if not message_queue.supersede(job):
+            message_queue.append(job)
 
 @client.on(events.MessageDeleted)
 async def handle_message_deleted(event):
-    """Handle deleted messages."""
-    if not is_connected:
+    """Queue deleted messages ahead of everything else."""
+    if capture_handle:
+        capture_update('d', event)
+    if shutting_down:
         return
-    for user_id, pairs in channel_mappings.items():
-        for pair_name, mapping in pairs.items():
-            if mapping['status'] == 'active' and event.chat_id == int(mapping['source']):
-                for deleted_id in event.deleted_ids:
-                    event.message.id = deleted_id
-                    await delete_copied_message(event, mapping, user_id, pair_name)
-                return
+    deleted_ids = tuple(event.deleted_ids)
+    for pair in source_index.get(event.chat_id, ()):
+        # Not copied yet: never send it
+        if removed := message_queue.discard(pair.source, set(deleted_ids)):
+            pair_stats[pair.user_id][pair.name]['deleted'] += removed
+        message_queue.append(Job(PRIORITY_DELETE, pair.user_id, pair.name, pair, deleted_ids))
 
 # Periodic Tasks
-async def check_connection_status():
-    """Monitor connection status."""
+def set_connected(state):
+    """Record a connection state change; the queue gets extra room until the offline backlog drains."""
     global is_connected
+    if state == is_connected:
+        return
+    is_connected = state
+    if state:
+        connected_event.set()
+    else:
+        connected_event.clear()
+        message_queue.reserve = RECONNECT_BUFFER_SIZE
+    logger.info(f"📡 Connection {'established' if state else 'lost'}")
+
+def requeue_on_disconnect(job, error):
+    """Put a job back on the queue if it failed because the connection dropped."""
+    if not isinstance(error, ConnectionError) and client.is_connected():
+        return False
+    if not client.is_connected():
+        set_connected(False)
+    message_queue.append(job)
+    return True
+
+async def maintain_connection():
+    """Track the client's connection lifecycle and reconnect with exponential backoff and jitter."""
     while True:
-        current_status = client.is_connected()
-        if current_status != is_connected:
-            is_connected = current_status
-            logger.info(f"📡 Connection {'established' if is_connected else 'lost'}")
-        await asyncio.sleep(5)
+        set_connected(client.is_connected())
+        if is_connected:
+            try:
+                await client.disconnected
+            except Exception as e:
+                logger.warning(f"📡 Disconnected: {e}")
+            set_connected(False)
+        attempt = 0
+        while not client.is_connected():
+            delay = min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2 ** attempt)
+            delay = random.uniform(delay / 2, delay)
+            logger.info(f"🔄 Reconnecting in {delay:.1f}s (attempt {attempt + 1})")
+            await asyncio.sleep(delay)
+            try:
+                await client.connect()
+            except Exception as e:
+                logger.warning(f"Reconnect attempt {attempt + 1} failed: {e}")
+            attempt += 1
+
+async def run_job(job):
+    """Run a queued job according to its priority class."""
+    with trace_job(job):
+        if job.priority == PRIORITY_DELETE:
+            await delete_copied_message(job)
+        elif job.priority == PRIORITY_EDIT:
+            await edit_copied_message(job)
+        else:
+            await copy_message_with_retry(job)
 
-async def queue_worker():
+async def queue_worker(express=False):
     """Process message queue."""
-    while True:
-        if is_connected and message_queue:
+    task = asyncio.current_task()
+    while task not in retiring_workers:
+        job = message_queue.popleft(express) if is_connected and not shutting_down else None
+        if job:
+            started = time.monotonic()
+            worker_jobs[task] = (job, started)
             try:
-                event, mapping, user_id, pair_name, queued_time = message_queue.popleft()
-                await copy_message_with_retry(event, mapping, user_id, pair_name)
+                await run_job(job)
             except Exception as e:
-                logger.error(f"Queue worker error for pair '{pair_name}': {e}")
+                logger.error(f"Queue worker error for pair '{job.pair_name}': {e}")
+            finally:
+                worker_jobs.pop(task, None)
+            pool_stats['latency'] += 0.2 * (time.monotonic() - started - pool_stats['latency'])
+            continue
         await asyncio.sleep(0.1)
+    retiring_workers.discard(task)
+    if task in worker_tasks:
+        worker_tasks.remove(task)
+
+def start_workers():
+    """(Re)start the regular and express queue workers."""
+    for task in worker_tasks:
+        task.cancel()
+    worker_tasks.clear()
+    pool_workers.clear()
+    retiring_workers.clear()
+    resize_workers(NUM_WORKERS)
+    for _ in range(EXPRESS_WORKERS):
+        worker_tasks.append(asyncio.create_task(queue_worker(express=True)))
+
+def resize_workers(size):
+    """Grow or shrink the regular worker pool; retired workers finish their current job first."""
+    size = max(MIN_WORKERS, min(MAX_WORKERS, size))
+    while len(pool_workers) < size:
+        task = asyncio.create_task(queue_worker())
+        pool_workers.append(task)
+        worker_tasks.append(task)
+    while len(pool_workers) > size:
+        # Prefer idle workers so shrinking never delays a send
+        idle = [t for t in pool_workers if t not in worker_jobs]
+        task = idle[-1] if idle else pool_workers[-1]
+        pool_workers.remove(task)
+        retiring_workers.add(task)
+    return size
+
+def pool_target():
+    """Pool size needed to drain the current backlog at the observed send latency."""
+    size = len(pool_workers)
+    busy = sum(1 for t in pool_workers if t in worker_jobs)
+    backlog = len(message_queue)
+    if time.monotonic() < flood_wait_until:
+        # More workers would only pile up behind the same flood wait
+        return min(size, max(busy, MIN_WORKERS))
+    needed = busy + math.ceil(backlog * max(pool_stats['latency'], 0.1) / POOL_DRAIN_TARGET)
+    if needed >= size:
+        return needed
+    return size - 1  # Shrink gradually so bursts don't thrash the pool
+
+async def adjust_worker_pool():
+    """Periodically resize the worker pool from queue depth, latency and flood-wait pressure."""
+    while True:
+        await asyncio.sleep(POOL_CHECK_INTERVAL)
+        if pool_workers:
+            busy = sum(1 for t in pool_workers if t in worker_jobs)
+            pool_stats['utilisation'] += 0.3 * (busy / len(pool_workers) - pool_stats['utilisation'])
+        if not is_connected or shutting_down:
+            continue
+        old_size = len(pool_workers)
+        new_size = resize_workers(pool_target())
+        if new_size != old_size:
+            logger.info(f"⚙️ Worker pool {old_size} ➡️ {new_size} (queue {len(message_queue)}, latency {pool_stats['latency']:.1f}s)")
 
 async def check_queue_inactivity():
     """Check for stuck messages in queue."""
     while True:
         await asyncio.sleep(60)
-        if not is_connected or not NOTIFY_OWNER or not OWNER_ID or not message_queue:
+        if not NOTIFY_OWNER or not message_queue:
             continue
-        current_time = datetime.now()
-        for event, _, _, pair_name, queued_time in message_queue:
-            wait_duration = (current_time - queued_time).total_seconds()
+        current_time = time.monotonic()
+        for job in message_queue:
+            wait_duration = current_time - job.enqueued
             if wait_duration > QUEUE_INACTIVITY_THRESHOLD:
-                source_msg_id = event.message.id if hasattr(event.message, 'id') else "Unknown"
-                await client.send_message(
-                    OWNER_ID,
-                    f"⏳ Queue Inactivity Alert: Message for '{pair_name}' stuck for {int(wait_duration // 60)} minutes."
+                notify_owner(
+                    f"⏳ Queue Inactivity Alert: Message for '{job.pair_name}' stuck for {int(wait_duration // 60)} minutes.",
+                    job.pair_name, 'queue'
                 )
                 break
 
+def scan_pair_inactivity(current_time):
+    """Alert on active pairs with no activity for INACTIVITY_THRESHOLD."""
+    for user_id, pairs in channel_mappings.items():
+        user_stats = pair_stats.get(user_id, {})
+        for pair_name, mapping in pairs.items():
+            if mapping['status'] != 'active':
+                continue
+            last_activity = user_stats.get(pair_name, {}).get('last_activity')
+            if last_activity:
+                last_activity_time = datetime.fromisoformat(last_activity)
+                if (current_time - last_activity_time).total_seconds() > INACTIVITY_THRESHOLD:
+                    notify_owner(
+                        f"⏰ Inactivity Alert: Pair '{pair_name}' inactive for over {INACTIVITY_THRESHOLD // 3600} hours.",
+                        pair_name, 'inactivity'
+                    )
+
 async def check_pair_inactivity():
     """Check for inactive pairs."""
     while True:
         await asyncio.sleep(300)
-        if not is_connected or not NOTIFY_OWNER or not OWNER_ID:
+        if not NOTIFY_OWNER:
             continue
-        current_time = datetime.now()
-        for user_id, pairs in channel_mappings.items():
-            for pair_name, mapping in pairs.items():
-                if mapping['status'] != 'active':
-                    continue
-                stats = pair_stats.get(user_id, {}).get(pair_name, {})
-                last_activity = stats.get('last_activity')
-                if last_activity:
-                    last_activity_time = datetime.fromisoformat(last_activity)
-                    if (current_time - last_activity_time).total_seconds() > INACTIVITY_THRESHOLD:
-                        await client.send_message(
-                            OWNER_ID,
-                            f"⏰ Inactivity Alert: Pair '{pair_name}' inactive for over {INACTIVITY_THRESHOLD // 3600} hours."
-                        )
+        scan_pair_inactivity(datetime.now())
 
 async def send_periodic_report():
     """Send periodic reports."""
     while True:
         await asyncio.sleep(21600)
-        if not is_connected or not NOTIFY_OWNER or not OWNER_ID:
+        if not NOTIFY_OWNER:
             continue
         for user_id in channel_mappings:
-            report = ["📊 6-Hour Report"]
-            for pair_name, data in channel_mappings[user_id].items():
-                stats = pair_stats.get(user_id, {}).get(pair_name, {})
-                report.append(
-                    f"📌 {pair_name}: {data['source']} ➡️ {data['destination']} [{data['status'].capitalize()}]\n"
-                    f"   📈 Fwd: {stats.get('forwarded', 0)} | Edt: {stats.get('edited', 0)} | "
-                    f"Del: {stats.get('deleted', 0)} | Blk: {stats.get('blocked', 0)}"
-                )
+            report = summary_report(user_id, "📊 6-Hour Report")
             report.append(f"📥 Queue: {len(message_queue)}/{MAX_QUEUE_SIZE}")
-            await client.send_message(OWNER_ID, "\n".join(report))
+            notify_owner("\n".join(report), user_id, 'report')
+
+def format_stack(task, depth):
+    """Innermost frames of a task's await chain as 'func (file:line)' strings."""
+    frames = []
+    coro = task.get_coro()
+    while coro is not None:
+        frame = getattr(coro, 'cr_frame', None) or getattr(coro, 'gi_frame', None)
+        if frame is None:
+            break
+        frames.append(frame)
+        coro = getattr(coro, 'cr_await', None) or getattr(coro, 'gi_yieldfrom', None)
+    if depth:
+        frames = frames[-depth:]
+    return [frame_label(f) for f in frames]
+
+def frame_label(frame):
+    """A frame as 'func (file:line)'."""
+    return f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})"
+
+async def sample_loop_lag():
+    """Heartbeat on the event loop recording how late each timer fires."""
+    global loop_heartbeat
+    while True:
+        expected = time.monotonic() + LOOP_LAG_INTERVAL
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        loop_heartbeat = time.monotonic()
+        loop_lag.append(max(0.0, loop_heartbeat - expected))
+
+def watch_loop(loop, loop_thread_id):
+    """Watchdog thread: while the heartbeat is overdue, record what the loop thread is running."""
+    stall = None
+    while not watchdog_stop.wait(LOOP_LAG_THRESHOLD / 2):
+        overdue = time.monotonic() - loop_heartbeat - LOOP_LAG_INTERVAL
+        if overdue >= LOOP_LAG_THRESHOLD:
+            if stall is None:
+                frames, frame = [], sys._current_frames().get(loop_thread_id)
+                while frame is not None and len(frames) < LOOP_STALL_FRAMES:
+                    frames.append(frame_label(frame))
+                    frame = frame.f_back
+                task = asyncio.current_task(loop)
+                stall = {'at': datetime.now().isoformat(timespec='seconds'), 'seconds': overdue,
+                         'task': task.get_name() if task else "(callback)", 'stack': frames[::-1]}
+                loop_stalls.append(stall)
+            stall['seconds'] = overdue
+        elif stall is not None:
+            logger.warning(
+                f"🐢 Event loop blocked for at least {stall['seconds']:.2f}s in {stall['task']}: " + " <- ".join(reversed(stall['stack']))
+            )
+            stall = None
+
+def start_loop_watchdog():
+    """Start the lag heartbeat on the running loop and the watchdog thread that samples its stack."""
+    global loop_heartbeat
+    loop_heartbeat = time.monotonic()
+    background_tasks.append(asyncio.create_task(sample_loop_lag()))
+    watchdog_stop.clear()
+    threading.Thread(
+        target=watch_loop, args=(asyncio.get_running_loop(), threading.get_ident()), name="loop-watchdog", daemon=True
+    ).start()
+
+def loop_lag_percentiles():
+    """p50/p95/p99/max of recent event-loop lag in seconds, or None before the first heartbeat."""
+    samples = sorted(loop_lag)
+    if not samples:
+        return None
+    return {name: samples[min(len(samples) - 1, int(fraction * len(samples)))]
+            for name, fraction in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99), ('max', 1.0))}
+
+def debug_report(stack_depth=None):
+    """Snapshot of workers, queues, waits, state sizes and asyncio tasks."""
+    now = time.monotonic()
+    lines = ["🔍 Debug Snapshot", "", "👷 Workers"]
+    for index, task in enumerate(worker_tasks, 1):
+        kind = "express" if task not in pool_workers and task not in retiring_workers else "regular"
+        running = worker_jobs.get(task)
+        if running:
+            job, started = running
+            state = f"job {job.key if job.pair else job.pair_name} ({now - started:.1f}s)"
+        else:
+            state = "idle"
+        wait = worker_waits.get(task)
+        if wait:
+            state += f" | ⏸️ {wait[0]}, {max(0.0, wait[1] - now):.1f}s left"
+        lines.append(f"   #{index} {kind}{' (retiring)' if task in retiring_workers else ''}: {state}")
+
+    lines += ["", f"📥 Queue: {len(message_queue)}/{MAX_QUEUE_SIZE}"
+                  + (f" (+{message_queue.reserve} reserve)" if message_queue.reserve else "")]
+    per_pair = {}
+    for job in message_queue:
+        counts, oldest = per_pair.get((job.user_id, job.pair_name), ([0, 0, 0], now))
+        counts[job.priority] += 1
+        per_pair[(job.user_id, job.pair_name)] = (counts, min(oldest, job.enqueued))
+    for (user_id, pair_name), (counts, oldest) in sorted(per_pair.items(), key=lambda item: item[1][1]):
+        lines.append(
+            f"   {user_id}/{pair_name}: Del: {counts[PRIORITY_DELETE]} | Edt: {counts[PRIORITY_EDIT]} | "
+            f"New: {counts[PRIORITY_NEW]} | Oldest: {now - oldest:.0f}s"
+        )
+
+    lines += ["", "⏸️ Waits"]
+    if now < flood_wait_until:
+        lines.append(f"   Flood wait in force for {flood_wait_until - now:.0f}s")
+    waits = sorted(worker_waits.values(), key=lambda wait: wait[1])
+    for reason, until in waits:
+        lines.append(f"   {reason}: {max(0.0, until - now):.1f}s left")
+    if now >= flood_wait_until and not waits:
+        lines.append("   None")
+
+    lines += [
+        "", "📦 State",
+        f"   Pairs: {sum(len(pairs) for pairs in channel_mappings.values())} across {len(channel_mappings)} users",
+        f"   Message map: {len(getattr(client, 'forwarded_messages', {}))}/{MAX_MAPPING_HISTORY}",
+        f"   Stats: {sum(len(pairs) for pairs in pair_stats.values())} pairs | Outbox: {len(outbox)} | "
+        f"Pending alerts: {len(pending_alerts)} | Media cache: {len(media_cache)}/{MEDIA_CACHE_SIZE}",
+    ]
+
+    lines += ["", "🐢 Event loop"]
+    lag = loop_lag_percentiles()
+    lines.append("   Lag: " + (" | ".join(f"{name} {value * 1000:.1f}ms" for name, value in lag.items())
+                               if lag else "no samples"))
+    for stall in reversed(loop_stalls):
+        lines.append(f"   {stall['at']} blocked ≥{stall['seconds']:.2f}s in {stall['task']}")
+        lines.extend(f"      {frame}" for frame in stall['stack'][-(stack_depth or LOOP_STALL_FRAMES):])
+
+    lines += ["", "🧠 Memory", f"   RSS: {current_rss() / 1048576:.1f} MB"]
+    if tracemalloc.is_tracing():
+        traced, peak = tracemalloc.get_traced_memory()
+        lines.append(f"   Traced: {traced / 1048576:.1f} MB (peak {peak / 1048576:.1f} MB)")
+    lines.append("   " + " | ".join(f"{name}: {count}" for name, count in memory_counts().items()))
+
+    tasks = asyncio.all_tasks()
+    lines += ["", f"🧵 Tasks ({len(tasks)})"]
+    for task in sorted(tasks, key=lambda t: t.get_name()):
+        coro = task.get_coro()
+        lines.append(f"   {task.get_name()}: {getattr(coro, '__qualname__', coro)}")
+        lines.extend(f"      {frame}" for frame in format_stack(task, stack_depth))
+    return "\n".join(lines)
+
+async def handle_debug_request(reader, writer):
+    """Answer GET /debug on the local debug port."""
+    try:
+        request_line = (await reader.readline()).decode(errors='replace').split()
+        while (await reader.readline()).strip():
+            pass  # Skip headers
+        if len(request_line) >= 2 and request_line[0] == "GET" and request_line[1].split('?')[0] == "/debug":
+            status, body = "200 OK", debug_report()
+        else:
+            status, body = "404 Not Found", "Not found"
+        body = body.encode()
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except Exception as e:
+        logger.error(f"Debug endpoint error: {e}")
+    finally:
+        writer.close()
+
+async def serve_debug():
+    """Serve the debug snapshot on localhost only."""
+    server = await asyncio.start_server(handle_debug_request, "127.0.0.1", DEBUG_PORT)
+    logger.info(f"🔍 Debug endpoint on http://127.0.0.1:{DEBUG_PORT}/debug")
+    async with server:
+        await server.serve_forever()
+
+def current_rss():
+    """Resident set size of this process in bytes."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # Peak, in KB on Linux
+
+def memory_counts():
+    """Entry counts of the bot's long-lived data structures."""
+    return {
+        'pairs': sum(len(pairs) for pairs in channel_mappings.values()),
+        'pair_configs': len(pair_configs),
+        'message_map': len(getattr(client, 'forwarded_messages', {})),
+        'pair_stats': sum(len(pairs) for pairs in pair_stats.values()),
+        'queued_jobs': len(message_queue),
+        'queued_media': sum(1 for job in message_queue if job.media),
+        'outbox': len(outbox),
+        'media_cache': len(media_cache),
+        'resolved_peers': len(resolved_peers),
+        'pending_alerts': len(pending_alerts),
+        'tasks': len(asyncio.all_tasks()),
+    }
+
+def write_memory_report(snapshot, previous, rss, counts, gc_objects):
+    """Append the top allocation growth sites since the previous snapshot."""
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+    ))
+    lines = [
+        f"=== {datetime.now().isoformat()} | RSS {rss / 1048576:.1f} MB | "
+        f"traced {sum(stat.size for stat in snapshot.statistics('filename')) / 1048576:.1f} MB | "
+        f"gc objects {gc_objects}",
+        "    " + " | ".join(f"{name}: {count}" for name, count in counts.items()),
+    ]
+    if previous is not None:
+        for stat in snapshot.compare_to(previous, 'traceback')[:MEMORY_TOP_SITES]:
+            if stat.size_diff <= 0:
+                break
+            lines.append(f"  +{stat.size_diff / 1024:.1f} KB ({stat.count_diff:+d} blocks), now {stat.size / 1024:.1f} KB")
+            lines.extend(f"      {frame.filename}:{frame.lineno}" for frame in reversed(stat.traceback))
+    with open(MEMORY_PROFILE_FILE, "a") as f:
+        f.write("\n".join(lines) + "\n")
+    return snapshot
+
+async def profile_memory():
+    """Take periodic tracemalloc snapshots and write the growth between them."""
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(MEMORY_TRACE_FRAMES)
+    logger.info(f"🧠 Memory profiling every {MEMORY_PROFILE_INTERVAL}s to {MEMORY_PROFILE_FILE}")
+    previous = None
+    while True:
+        await asyncio.sleep(MEMORY_PROFILE_INTERVAL)
+        try:
+            snapshot = tracemalloc.take_snapshot()
+            # Diffing and writing run off the event loop; the snapshot is a standalone copy
+            previous = await asyncio.to_thread(
+                write_memory_report, snapshot, previous, current_rss(), memory_counts(), len(gc.get_objects())
+            )
+        except Exception as e:
+            logger.error(f"Memory profiling error: {e}")
 
 # Main Function
+def request_shutdown():
+    """Signal handler: begin a graceful shutdown."""
+    logger.info("🛑 Shutdown requested")
+    shutdown_event.set()
+
+async def shutdown():
+    """Stop intake, let in-flight sends finish within the grace period, then checkpoint."""
+    global shutting_down
+    shutting_down = True
+    watchdog_stop.set()
+    deadline = time.monotonic() + SHUTDOWN_GRACE
+    while worker_jobs and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    # Unfinished sends resume from the outbox after restart
+    in_flight = [job for job, _ in worker_jobs.values()]
+    for task in worker_tasks + background_tasks:
+        task.cancel()
+    await asyncio.gather(*worker_tasks, *background_tasks, return_exceptions=True)
+    save_checkpoint(in_flight)
+    await flush_alerts()
+    save_mappings()
+    stop_capture()
+    if client.is_connected():
+        await client.disconnect()
+    session.close()  # Already written by disconnect() unless the connection was down
+
 async def main():
     """Start the bot."""
     load_mappings()
-    global worker_tasks
-    tasks = [
-        check_connection_status(),
+    load_quotas()
+    load_checkpoint()
+    load_outbox()
+    if CAPTURE_FILE:
+        start_capture(CAPTURE_FILE)
+    if TRACE_FILE:
+        start_tracing(TRACE_FILE)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, request_shutdown)
+        except (NotImplementedError, RuntimeError):
+            pass  # Not supported on this platform; KeyboardInterrupt still applies
+    background_tasks.extend(asyncio.create_task(coro) for coro in (
         send_periodic_report(),
         check_pair_inactivity(),
-        check_queue_inactivity()
-    ]
-    for _ in range(NUM_WORKERS):
-        task = asyncio.create_task(queue_worker())
-        worker_tasks.append(task)
-    tasks.extend(worker_tasks)
+        check_queue_inactivity(),
+        adjust_worker_pool(),
+        send_alert_digests(),
+        watch_mappings(),
+        flush_session()
+    ))
+    if DEBUG_PORT:
+        background_tasks.append(asyncio.create_task(serve_debug()))
+    if MEMORY_PROFILE_FILE:
+        background_tasks.append(asyncio.create_task(profile_memory()))
+    start_loop_watchdog()
+    start_workers()
 
     try:
         await client.start()
@@ -1436,16 +3521,18 @@ async def main():
             code = input("Enter verification code: ")
             await client.sign_in(phone=phone, code=code)
 
-        global is_connected, OWNER_ID
-        is_connected = client.is_connected()
+        global OWNER_ID
+        set_connected(client.is_connected())
         OWNER_ID = (await client.get_me()).id
+        refresh_authorized_users()
         logger.info(f"📡 Initial connection {'established' if is_connected else 'not established'}")
-
-        await client.run_until_disconnected()
+        background_tasks.append(asyncio.create_task(maintain_connection()))
+        await resolve_peers()
+        await shutdown_event.wait()
     except Exception as e:
         logger.error(f"❌ Fatal error: {e}")
     finally:
-        save_mappings()
+        await shutdown()
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,266 @@
+"""Fault-injection harness measuring how the bot recovers from Telegram failures.
+
+A scriptable stub client injects faults into the calls made by
+``copy_message_with_retry``, ``edit_copied_message`` and ``delete_copied_message``
+while synthetic traffic flows through the real handlers and workers. Runs use a
+virtual clock, so a 300 s flood wait takes well under a second of wall time.
+
+Traffic keeps flowing for ``--duration`` seconds, fault or not. For each scenario
+the harness reports:
+
+    baseline   peak queue depth (queued + running jobs) before the fault starts
+    recover    time from the fault clearing (or starting, if permanent) until the
+               depth is back at the baseline
+    drain      time from the last fed message until the queue is empty
+    overflow   messages the scheduler evicted or refused because the queue was full
+    lost       other messages that never arrived, i.e. lost to the fault itself
+    duplicated, peak_queue, faults, workers
+
+Usage:
+    python tools/fault_harness.py                      # all scenarios
+    python tools/fault_harness.py flood_wait --rate 2  # one scenario, 2 msgs/s
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from telethon import errors  # noqa: E402
+
+from replay import build_event, track_in_flight  # noqa: E402
+from stub_client import StubClient, load_bot  # noqa: E402
+
+SOURCES = [-1001000000001, -1001000000002, -1001000000003]
+DESTINATIONS = [-1002000000001, -1002000000002, -1002000000003]
+
+# name -> fault kind, start (s), duration (s, None = permanent), affected destinations
+SCENARIOS = {
+    'flood_wait': ('flood', 30, 300, DESTINATIONS),
+    'disconnect': ('disconnect', 30, 120, DESTINATIONS),
+    'channel_invalid': ('channel_invalid', 30, None, DESTINATIONS[:1]),
+}
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    """Event loop whose clock jumps to the next timer whenever nothing is ready."""
+
+    def __init__(self):
+        super().__init__()
+        self._now = 0.0
+
+    def time(self):
+        return self._now
+
+    def _run_once(self):
+        if not self._ready and self._scheduled:
+            self._now = max(self._now, self._scheduled[0]._when)
+        super()._run_once()
+
+
+class VirtualTime:
+    """Stand-in for the ``time`` module whose monotonic clock follows the loop."""
+
+    def __init__(self, loop):
+        self._loop = loop
+
+    def monotonic(self):
+        return self._loop.time()
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+class FaultyClient(StubClient):
+    """Stub client that fails calls to selected destinations inside a time window."""
+
+    def __init__(self, loop, kind, start, duration, targets, **kwargs):
+        super().__init__(**kwargs)
+        self.loop = loop
+        self.kind = kind
+        self.start = start
+        self.end = start + duration if duration is not None else float('inf')
+        self.targets = set(targets)
+        self.injected = Counter()
+
+        if kind == 'disconnect':
+            loop.call_at(start, self.drop, ConnectionError("Simulated disconnect"))
+
+    def _active(self):
+        return self.start <= self.loop.time() < self.end
+
+    def before_call(self, name, entity):
+        if self.kind == 'disconnect':
+            if name == 'connect' and self._active():
+                self.injected[name] += 1
+                raise OSError("Simulated network down")
+            if not self.connected and name != 'connect':
+                self.injected[name] += 1
+                raise ConnectionError("Cannot send requests while disconnected")
+            return
+        if not self._active():
+            return
+        if entity not in self.targets:
+            return
+        self.injected[name] += 1
+        if self.kind == 'flood':
+            raise errors.FloodWaitError(request=None, capture=max(1, int(self.end - self.loop.time())))
+        if self.kind == 'channel_invalid':
+            raise errors.ChannelInvalidError(request=None)
+
+
+def make_mappings():
+    return {'1': {
+        f"pair{i}": {'source': str(src), 'destination': str(dst), 'status': 'active', 'stealth_mode': True}
+        for i, (src, dst) in enumerate(zip(SOURCES, DESTINATIONS))
+    }}
+
+
+async def feed_traffic(bot, rate, duration, deleted):
+    """Post messages round-robin across sources, editing and deleting a few."""
+    count = int(rate * duration)
+    for n in range(1, count + 1):
+        await asyncio.sleep(1 / rate)
+        chat = SOURCES[n % len(SOURCES)]
+        await bot.copy_messages(build_event({'k': 'n', 'c': chat, 'i': n, 'x': f"signal #{n}"}))
+        if n % 7 == 0 and n > 3:
+            edit_id = n - 3
+            edit_chat = SOURCES[edit_id % len(SOURCES)]
+            await bot.handle_message_edit(build_event({'k': 'e', 'c': edit_chat, 'i': edit_id, 'x': f"signal #{edit_id} (upd)"}))
+        if n % 11 == 0 and n > 5:
+            delete_id = n - 5
+            deleted.add(delete_id)
+            await bot.handle_message_deleted(build_event({'k': 'd', 'c': SOURCES[delete_id % len(SOURCES)], 'i': [delete_id]}))
+    return count
+
+
+async def run_scenario(name, args):
+    kind, start, duration, targets = SCENARIOS[name]
+    loop = asyncio.get_running_loop()
+    random.seed(args.seed)
+    bot = load_bot()
+    if not args.verbose:
+        logging.getLogger("StealthCopyBot").setLevel(logging.CRITICAL)
+    bot.time = VirtualTime(loop)
+    stub = FaultyClient(loop, kind, start, duration, targets, latency=args.latency)
+    bot.client = stub
+    bot.MAPPINGS_FILE = "channel_mappings.json"  # inside the scratch working directory
+    bot.channel_mappings = make_mappings()
+    bot.pair_stats = {'1': {p: {'forwarded': 0, 'edited': 0, 'deleted': 0, 'blocked': 0, 'queued': 0,
+                                'last_activity': None} for p in bot.channel_mappings['1']}}
+    bot.rebuild_pair_configs()
+    bot.OWNER_ID = stub.me_id
+    bot.set_connected(True)
+    bot.NUM_WORKERS = args.workers
+
+    peak = SimpleNamespace(depth=0, drops=0)
+    overflow = set()  # source message IDs of copy jobs dropped by the scheduler
+    queue = bot.message_queue
+    append, drop_oldest = queue.append, queue._drop_oldest
+
+    def tracked_drop(user_id, reason):
+        q = queue.queues[bot.PRIORITY_NEW].get(user_id)
+        if q:
+            overflow.add(q[0].msg_id)
+            peak.drops += 1
+        return drop_oldest(user_id, reason)
+
+    def tracked_append(job):
+        size, drops = len(queue), peak.drops
+        append(job)
+        if len(queue) == size and peak.drops == drops and job.priority == bot.PRIORITY_NEW:
+            overflow.add(job.msg_id)  # Refused outright
+        peak.depth = max(peak.depth, len(queue))
+    queue._drop_oldest, queue.append = tracked_drop, tracked_append
+
+    state = track_in_flight(bot)
+    bot.start_workers()
+    monitor = [asyncio.create_task(bot.maintain_connection())]
+    if args.adaptive:
+        bot.MIN_WORKERS, bot.MAX_WORKERS = args.min_workers, args.max_workers
+        monitor.append(asyncio.create_task(bot.adjust_worker_pool()))
+    samples = []  # (time, queued + running jobs) once per second
+
+    async def sample_depth():
+        while True:
+            samples.append((loop.time(), len(bot.message_queue) + state.in_flight))
+            await asyncio.sleep(1)
+    monitor.append(asyncio.create_task(sample_depth()))
+    deleted = set()
+    count = await feed_traffic(bot, args.rate, args.duration, deleted)
+
+    fed_at = loop.time()
+    deadline = fed_at + args.timeout
+    while (bot.message_queue or state.in_flight) and loop.time() < deadline:
+        await asyncio.sleep(0.1)
+    drained = not (bot.message_queue or state.in_flight)
+    drain_time = loop.time() - fed_at if drained else None
+    samples.append((loop.time(), len(bot.message_queue) + state.in_flight))
+
+    for task in bot.worker_tasks + monitor:
+        task.cancel()
+
+    clear_at = stub.end if stub.end != float('inf') else stub.start
+    baseline = max((depth for t, depth in samples if t < stub.start), default=0)
+    recovered_at = next((t for t, depth in samples if t >= clear_at and depth <= baseline), None)
+
+    destinations = set(DESTINATIONS)
+    tags = Counter(text.split('#')[1].split()[0] for entity, _, text in stub.sent
+                   if entity in destinations and '#' in text)
+    expected = {str(n) for n in range(1, count + 1) if n not in deleted}
+    missing = expected - tags.keys()
+    overflowed = {tag for tag in missing if int(tag) in overflow}
+    duplicated = sum(c - 1 for c in tags.values() if c > 1)
+    return {
+        'scenario': name,
+        'messages': count,
+        'baseline': baseline,
+        'recover': f"{recovered_at - clear_at:.1f}s" if recovered_at is not None else "never",
+        'drain': f"{drain_time:.1f}s" if drained else f">{args.timeout:.0f}s",
+        'overflow': len(overflowed),
+        'lost': len(missing - overflowed),
+        'duplicated': duplicated,
+        'peak_queue': peak.depth,
+        'faults': sum(stub.injected.values()),
+        'workers': len(bot.pool_workers),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("scenarios", nargs="*", choices=[[]] + list(SCENARIOS), default=[],
+                        help="scenarios to run (default: all)")
+    parser.add_argument("--rate", type=float, default=1.0, help="new messages per second")
+    parser.add_argument("--duration", type=float, default=360, help="seconds of traffic")
+    parser.add_argument("--workers", type=int, default=5, help="number of queue workers")
+    parser.add_argument("--adaptive", action="store_true", help="let the pool controller resize the workers")
+    parser.add_argument("--min-workers", type=int, default=2)
+    parser.add_argument("--max-workers", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.2, help="simulated seconds per client call")
+    parser.add_argument("--timeout", type=float, default=3600, help="give up draining after this long")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true", help="show the bot's logging")
+    args = parser.parse_args()
+
+    results = []
+    for name in args.scenarios or SCENARIOS:
+        loop = VirtualClockLoop()
+        try:
+            results.append(loop.run_until_complete(run_scenario(name, args)))
+        finally:
+            loop.close()
+    columns = ['scenario', 'messages', 'baseline', 'recover', 'drain', 'overflow', 'lost', 'duplicated',
+               'peak_queue', 'faults', 'workers']
+    print("  ".join(f"{c:>15}" for c in columns))
+    for result in results:
+        print("  ".join(f"{result[c]!s:>15}" for c in columns))
+
+
+if __name__ == "__main__":
+    main()
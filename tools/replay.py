@@ -0,0 +1,162 @@
+"""Replay a capture file through the copy pipeline against a stub client.
+
+Captures are written by the bot when ``CAPTURE_FILE`` is set or after ``/capture on``.
+Each update is rebuilt into a Telethon message and fed to the same ``copy_messages``,
+``handle_message_edit`` and ``handle_message_deleted`` handlers the live bot uses.
+
+Usage:
+    python tools/replay.py capture.jsonl --mappings channel_mappings.json
+    python tools/replay.py capture.jsonl --mappings m.json --speed 10   # 10x faster
+    python tools/replay.py capture.jsonl --mappings m.json --speed 0    # as fast as possible
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from telethon import utils  # noqa: E402
+from telethon.tl import types  # noqa: E402
+
+from stub_client import StubClient, disable_delays, load_bot  # noqa: E402
+
+
+def read_capture(path):
+    """Load capture records, skipping the header line."""
+    with open(path, encoding="utf-8") as f:
+        return [record for record in map(json.loads, f) if 'k' in record]
+
+
+def build_media(meta):
+    """Recreate photo and document media from captured metadata; other kinds are dropped."""
+    if not meta:
+        return None
+    if meta['k'] == 'photo':
+        size = types.PhotoSize('y', meta.get('w', 0), meta.get('h', 0), meta.get('s', 0))
+        return types.MessageMediaPhoto(photo=types.Photo(meta['id'], 0, b'', None, [size], 2))
+    if meta['k'] == 'doc':
+        attributes = [types.DocumentAttributeFilename(meta.get('fn') or 'file.bin')]
+        return types.MessageMediaDocument(document=types.Document(
+            meta['id'], 0, b'', None, meta.get('mt', 'application/octet-stream'), meta.get('s', 0), 2, attributes
+        ))
+    return None
+
+
+def build_entity(data):
+    data = dict(data)
+    return getattr(types, data.pop('_'))(**data)
+
+
+def build_event(record):
+    """Rebuild the handler event for a capture record."""
+    chat_id = record['c']
+    if record['k'] == 'd':
+        return SimpleNamespace(chat_id=chat_id, deleted_ids=record['i'])
+    peer_id, peer_type = utils.resolve_id(chat_id)
+    message = types.Message(
+        id=record['i'],
+        peer_id=peer_type(peer_id),
+        date=None,
+        message=record.get('x', ''),
+        entities=[build_entity(e) for e in record.get('en', [])] or None,
+        media=build_media(record.get('m')),
+        reply_to=types.MessageReplyHeader(reply_to_msg_id=record['r']) if record.get('r') else None,
+        silent=bool(record.get('s')),
+        grouped_id=record.get('g'),
+    )
+    return SimpleNamespace(chat_id=chat_id, sender_id=chat_id, message=message)
+
+
+def track_in_flight(bot):
+    """Wrap the bot's job runner to count jobs that are currently executing."""
+    state = SimpleNamespace(in_flight=0, done=0)
+    run_job = bot.run_job
+
+    async def counted(job):
+        state.in_flight += 1
+        try:
+            await run_job(job)
+        finally:
+            state.in_flight -= 1
+            state.done += 1
+    bot.run_job = counted
+    return state
+
+
+async def wait_drained(bot, state, poll=0.01):
+    """Wait until the queue is empty and no worker is mid-job."""
+    while bot.message_queue or state.in_flight:
+        await asyncio.sleep(poll)
+
+
+async def replay(bot, records, speed):
+    """Feed records to the handlers, honouring captured timing scaled by ``speed``."""
+    handlers = {'n': bot.copy_messages, 'e': bot.handle_message_edit, 'd': bot.handle_message_deleted}
+    start = time.monotonic()
+    for record in records:
+        if speed > 0:
+            delay = record['t'] / speed - (time.monotonic() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        await handlers[record['k']](build_event(record))
+    return time.monotonic() - start
+
+
+async def run(args):
+    records = read_capture(args.capture)
+    bot = load_bot(quiet=not args.verbose)
+    stub = StubClient(latency=args.latency)
+    bot.client = stub
+    bot.MAPPINGS_FILE = args.mappings
+    bot.load_mappings()
+    bot.MAPPINGS_FILE = "channel_mappings.json"  # scratch copy in the working directory, never the input
+    if not args.keep_delays:
+        disable_delays(bot)
+    bot.OWNER_ID = stub.me_id
+    bot.set_connected(True)
+    bot.NUM_WORKERS = args.workers
+    if args.trace:
+        bot.TRACE_SAMPLE_RATE = 1.0
+        bot.start_tracing(args.trace)
+    state = track_in_flight(bot)
+    bot.start_workers()
+
+    feed_time = await replay(bot, records, args.speed)
+    drain_start = time.monotonic()
+    await wait_drained(bot, state)
+    drain_time = time.monotonic() - drain_start
+
+    kinds = {k: sum(1 for r in records if r['k'] == k) for k in 'ned'}
+    total = feed_time + drain_time
+    print(f"Replayed {len(records)} updates (new {kinds['n']}, edit {kinds['e']}, delete {kinds['d']})")
+    print(f"Feed time: {feed_time:.2f}s | Drain after feed: {drain_time:.2f}s | Jobs run: {state.done}")
+    print(f"Throughput: {len(records) / total if total else 0:.1f} updates/s")
+    print("Client calls: " + ", ".join(f"{name}={count}" for name, count in sorted(stub.calls.items())))
+    for user_id, pairs in bot.pair_stats.items():
+        for pair_name, stats in pairs.items():
+            print(f"  {user_id}/{pair_name}: " + " ".join(f"{k}={v}" for k, v in stats.items() if k != 'last_activity'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("capture", help="capture file written by the bot")
+    parser.add_argument("--mappings", required=True, help="channel_mappings.json to replay against")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="1 = original timing, N = N times faster, 0 = as fast as possible")
+    parser.add_argument("--workers", type=int, default=5, help="number of queue workers")
+    parser.add_argument("--latency", type=float, default=0.05, help="simulated seconds per client call")
+    parser.add_argument("--keep-delays", action="store_true", help="keep the stealth send delays")
+    parser.add_argument("--trace", help="write spans for every job to this JSONL file (see trace_report.py)")
+    parser.add_argument("--verbose", action="store_true", help="show the bot's INFO logging")
+    args = parser.parse_args()
+    args.capture = os.path.abspath(args.capture)
+    args.mappings = os.path.abspath(args.mappings)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
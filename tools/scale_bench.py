@@ -0,0 +1,177 @@
+"""Scale benchmark: how the O(pairs) paths grow with the mapping set.
+
+For each size a fresh interpreter generates a synthetic ``channel_mappings.json``
+spread over many tenants (``--pairs-per-user`` pairs each), loads it and measures:
+
+    load      load_mappings (JSON, defaults, stats, PairConfigs, dispatch index)
+    mem       memory retained by the loaded mappings (tracemalloc) and process RSS
+    new/edit/del
+              per-update cost of copy_messages, handle_message_edit and
+              handle_message_deleted for a random source (workers are not started)
+    report    summary_report + monitor_report text for one tenant
+    inact     one scan_pair_inactivity pass over every pair
+
+The last row is the growth exponent between the smallest and largest size:
+~1 means linear in pairs, ~0 constant. Load, memory and the inactivity scan are
+expected to be linear; dispatch and per-tenant reports should stay flat, so an
+exponent well above 0 there is a regression.
+
+Usage:
+    python tools/scale_bench.py
+    python tools/scale_bench.py --pairs 1000 10000 100000 --pairs-per-user 50 --csv curves.csv
+"""
+import argparse
+import csv
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+METRICS = [  # key, header, scale, unit
+    ('load', 'load ms', 1e3, 'ms'),
+    ('mem', 'mem MB', 1 / 1048576, 'MB'),
+    ('rss', 'rss MB', 1 / 1048576, 'MB'),
+    ('new', 'new us', 1e6, 'us'),
+    ('edit', 'edit us', 1e6, 'us'),
+    ('delete', 'del us', 1e6, 'us'),
+    ('report', 'report ms', 1e3, 'ms'),
+    ('monitor', 'monitor ms', 1e3, 'ms'),
+    ('inactivity', 'inact ms', 1e3, 'ms'),
+]
+
+
+def make_mappings(pairs, per_user):
+    now = time.strftime("%Y-%m-%dT%H:%M:%S")
+    mappings = {}
+    for i in range(pairs):
+        mappings.setdefault(str(1000 + i // per_user), {})[f"pair{i}"] = {
+            'source': str(-1001000000000 - i), 'destination': str(-1002000000000 - i),
+            'status': 'active' if i % 10 else 'paused', 'header_patterns': ['join us', f"vip {i % 50}"],
+            'footer_patterns': ['t.me/'], 'remove_phrases': ['promo'], 'stealth_mode': bool(i % 2),
+            'last_activity': now,
+        }
+    return mappings
+
+
+def best_of(fn, repeat):
+    """Fastest of ``repeat`` timed calls, in seconds."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def child(pairs, per_user, updates, workdir):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import asyncio
+    import gc
+    import tracemalloc
+    from types import SimpleNamespace
+
+    from replay import build_event
+    from stub_client import StubClient, load_bot
+
+    mappings = make_mappings(pairs, per_user)
+    with open(os.path.join(workdir, "channel_mappings.json"), "w") as f:
+        json.dump(mappings, f)
+    bot = load_bot(workdir, quiet=True)
+    bot.client = StubClient()
+    result = {'load': best_of(bot.load_mappings, 3)}
+
+    # Memory held by one load, measured on its own so tracing doesn't skew the timings
+    bot.channel_mappings, bot.pair_stats = {}, {}
+    bot.rebuild_pair_configs()
+    gc.collect()
+    tracemalloc.start()
+    bot.load_mappings()
+    result['mem'] = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    result['rss'] = bot.current_rss()
+
+    # Stats as a running bot would have them, so the report and scan format real values
+    now = mappings['1000']['pair0']['last_activity']
+    for user_stats in bot.pair_stats.values():
+        for stats in user_stats.values():
+            stats.update(forwarded=120, edited=4, deleted=2, last_activity=now)
+
+    rng = random.Random(1)
+    sources = list(bot.source_index)
+    picks = [rng.choice(sources) for _ in range(updates)]
+    new_events = [build_event({'k': 'n', 'c': c, 'i': n, 'x': "signal"}) for n, c in enumerate(picks, 1)]
+    edit_events = [build_event({'k': 'e', 'c': c, 'i': n, 'x': "signal (upd)"}) for n, c in enumerate(picks, 1)]
+    delete_events = [SimpleNamespace(chat_id=c, deleted_ids=[n]) for n, c in enumerate(picks, 1)]
+
+    async def dispatch(handler, events):
+        bot.message_queue = bot.JobScheduler(bot.MAX_QUEUE_SIZE)
+        start = time.perf_counter()
+        for event in events:
+            await handler(event)
+        return (time.perf_counter() - start) / len(events)
+
+    async def run_dispatch():
+        return {
+            'new': await dispatch(bot.copy_messages, new_events),
+            'edit': await dispatch(bot.handle_message_edit, edit_events),
+            'delete': await dispatch(bot.handle_message_deleted, delete_events),
+        }
+
+    result.update(asyncio.run(run_dispatch()))
+    bot.message_queue = bot.JobScheduler(bot.MAX_QUEUE_SIZE)
+    user_id = next(iter(bot.channel_mappings))
+    result['report'] = best_of(lambda: "\n".join(bot.summary_report(user_id, "📊 Report")), 5)
+    result['monitor'] = best_of(lambda: "\n".join(bot.monitor_report(user_id)), 5)
+    from datetime import datetime
+    result['inactivity'] = best_of(lambda: bot.scan_pair_inactivity(datetime.now()), 3)
+    print(json.dumps(result))
+
+
+def measure(pairs, args):
+    with tempfile.TemporaryDirectory(prefix="ghostx_scale_") as workdir:
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", str(pairs), str(args.pairs_per_user),
+             str(args.updates), workdir],
+            check=True, capture_output=True, text=True
+        ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--pairs", type=int, nargs="+", default=[100, 1000, 10000, 50000])
+    parser.add_argument("--pairs-per-user", type=int, default=20, help="tenant size; users grow with pairs")
+    parser.add_argument("--updates", type=int, default=2000, help="events timed per handler")
+    parser.add_argument("--csv", help="also write the curves to this CSV file")
+    parser.add_argument("--child", nargs=4, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(*map(int, args.child[:3]), args.child[3])
+        return
+
+    sizes = sorted(args.pairs)
+    results = [measure(pairs, args) for pairs in sizes]
+    print(f"{'pairs':>8} {'users':>6} " + " ".join(f"{header:>11}" for _, header, _, _ in METRICS))
+    for pairs, result in zip(sizes, results):
+        users = math.ceil(pairs / args.pairs_per_user)
+        print(f"{pairs:>8} {users:>6} " + " ".join(f"{result[key] * scale:>11.2f}" for key, _, scale, _ in METRICS))
+    if len(sizes) > 1:
+        span = math.log(sizes[-1] / sizes[0])
+        exponents = [math.log(max(results[-1][key], 1e-12) / max(results[0][key], 1e-12)) / span
+                     for key, _, _, _ in METRICS]
+        print(f"{'growth':>8} {'':>6} " + " ".join(f"{f'n^{e:.2f}':>11}" for e in exponents))
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(['pairs', 'users'] + [f"{key}_{unit}" for key, _, _, unit in METRICS])
+            for pairs, result in zip(sizes, results):
+                writer.writerow([pairs, math.ceil(pairs / args.pairs_per_user)]
+                                + [round(result[key] * scale, 4) for key, _, scale, _ in METRICS])
+
+
+if __name__ == "__main__":
+    main()
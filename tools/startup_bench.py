@@ -0,0 +1,118 @@
+"""Startup benchmark: import time and time-to-first-message at several pair counts.
+
+Each measurement runs in a fresh interpreter so module caches don't carry over.
+The parent writes a mappings file with N pairs, then launches a child that imports
+the bot, runs the same loading steps as ``main()`` and feeds one new message through
+the real handler and a worker to a stub client:
+
+    import   importing ``GhostX .py`` (Telethon and the bot itself)
+    load     load_mappings + quotas + checkpoint + outbox
+    first    launching the child interpreter to the first copied message being sent
+    rss      resident memory after the first message
+
+The bot imports PIL only when an image is cleaned, but Telethon imports PIL itself
+when it is installed; the output says so when that makes the lazy import moot.
+
+Usage:
+    python tools/startup_bench.py                 # 10, 1000 and 10000 pairs
+    python tools/startup_bench.py --pairs 50000 --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def write_fixture(pairs, workdir):
+    with open(os.path.join(workdir, "channel_mappings.json"), "w") as f:
+        json.dump({'1': {
+            f"pair{i}": {'source': str(-1001000000000 - i), 'destination': str(-1002000000000 - i),
+                         'status': 'active', 'header_patterns': ['join us'], 'stealth_mode': False}
+            for i in range(pairs)
+        }}, f)
+
+
+def child(pairs, workdir, launched):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from stub_client import StubClient, disable_delays, load_bot
+
+    start = time.perf_counter()
+    bot = load_bot(workdir)
+    imported = time.perf_counter()
+
+    import asyncio
+    from replay import build_event
+
+    async def first_message():
+        bot.load_mappings()
+        bot.load_quotas()
+        bot.load_checkpoint()
+        bot.load_outbox()
+        loaded = time.perf_counter()
+        stub = StubClient()
+        bot.client = stub
+        disable_delays(bot)
+        bot.OWNER_ID = stub.me_id
+        bot.set_connected(True)
+        bot.start_workers()
+        await bot.copy_messages(build_event({'k': 'n', 'c': -1001000000000 - (pairs - 1), 'i': 1, 'x': "hello"}))
+        while not stub.sent:
+            await asyncio.sleep(0.001)
+        return loaded, time.time()
+
+    loaded, first = asyncio.run(first_message())
+    print(json.dumps({
+        'import': imported - start,
+        'load': loaded - imported,
+        'first': first - launched,
+        'rss': bot.current_rss(),
+        'pil_loaded': 'PIL.Image' in sys.modules,
+    }))
+
+
+def measure(pairs, runs):
+    results = []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory(prefix="ghostx_bench_") as workdir:
+            write_fixture(pairs, workdir)
+            out = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--child", str(pairs), workdir, repr(time.time())],
+                check=True, capture_output=True, text=True
+            ).stdout
+        results.append(json.loads(out.strip().splitlines()[-1]))
+    return {key: statistics.median(r[key] for r in results) if key != 'pil_loaded' else results[0][key]
+            for key in results[0]}
+
+
+def telethon_loads_pil():
+    """Whether importing Telethon alone pulls in PIL."""
+    out = subprocess.run([sys.executable, "-c", "import sys, telethon; print('PIL.Image' in sys.modules)"],
+                         check=True, capture_output=True, text=True).stdout
+    return out.strip() == "True"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--pairs", type=int, nargs="+", default=[10, 1000, 10000])
+    parser.add_argument("--runs", type=int, default=3, help="runs per size; the median is reported")
+    parser.add_argument("--child", nargs=3, metavar=("PAIRS", "WORKDIR", "LAUNCHED"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(int(args.child[0]), args.child[1], float(args.child[2]))
+        return
+
+    print(f"{'pairs':>8} {'import ms':>10} {'load ms':>10} {'first ms':>10} {'rss MB':>8} {'PIL loaded':>11}")
+    for pairs in args.pairs:
+        r = measure(pairs, args.runs)
+        print(f"{pairs:>8} {r['import'] * 1000:>10.1f} {r['load'] * 1000:>10.1f} {r['first'] * 1000:>10.1f} "
+              f"{r['rss'] / 1048576:>8.1f} {str(r['pil_loaded']):>11}")
+    if telethon_loads_pil():
+        print("Note: Telethon imports PIL itself, so the bot's lazy PIL import saves nothing at startup here.")
+
+
+if __name__ == "__main__":
+    main()
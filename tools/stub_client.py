@@ -0,0 +1,189 @@
+"""Offline stand-ins for running the bot without Telegram.
+
+``load_bot()`` imports ``GhostX .py`` as a module from a scratch directory, so its
+session, log and JSON files stay out of the checkout. ``StubClient`` answers the
+client calls made by the copy pipeline, with an optional per-call latency.
+"""
+import asyncio
+import importlib.util
+import io
+import itertools
+import logging
+import os
+import sys
+import tempfile
+from collections import Counter
+from types import SimpleNamespace
+
+BOT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "GhostX .py")
+
+
+def load_bot(workdir=None, quiet=True):
+    """Import the bot module with ``workdir`` (a new temp dir by default) as the cwd.
+
+    The process stays in ``workdir`` so the bot's relative file paths resolve there;
+    resolve any user-supplied paths before calling this.
+    """
+    workdir = workdir or tempfile.mkdtemp(prefix="ghostx_")
+    os.chdir(workdir)
+    spec = importlib.util.spec_from_file_location("ghostx", BOT_PATH)
+    bot = importlib.util.module_from_spec(spec)
+    sys.modules["ghostx"] = bot
+    spec.loader.exec_module(bot)
+    if quiet:
+        logging.getLogger("StealthCopyBot").setLevel(logging.WARNING)
+    return bot
+
+
+def disable_delays(bot):
+    """Zero the stealth delays so runs measure the pipeline, not the sleeps.
+
+    Call after loading mappings: per-pair ``delay_range`` values are zeroed too.
+    """
+    bot.DEFAULT_DELAY_RANGE = [0, 0]
+    bot.ANTI_FINGERPRINT_DELAY_RANGE = [0, 0]
+    bot.REPLY_DELAY_RANGE = [0, 0]
+    for pairs in bot.channel_mappings.values():
+        for mapping in pairs.values():
+            mapping['delay_range'] = [0, 0]
+    bot.rebuild_pair_configs()
+
+
+class StubClient:
+    """Minimal async client recording every call the pipeline makes.
+
+    ``before_call(name, entity)`` runs ahead of each call and may raise to inject
+    faults; ``latency`` seconds are awaited per call to mimic network round trips.
+    File part requests also take ``len(part) / transfer_rate`` seconds when a rate
+    (bytes per second per request) is given.
+    """
+
+    def __init__(self, latency=0.0, me_id=1, transfer_rate=None):
+        self.latency = latency
+        self.transfer_rate = transfer_rate
+        self.me_id = me_id
+        self.connected = True
+        self.calls = Counter()
+        self.messages = {}  # (entity, id) -> text currently in the destination
+        self.sent = []  # (entity, id, text) for every successful send
+        self._ids = itertools.count(1)
+        self._photos = {}
+        self._disconnected = None
+        self.uploaded_parts = {}  # file_id -> {part index: bytes}
+
+    def before_call(self, name, entity):
+        """Hook for fault injection; the default does nothing."""
+
+    async def _call(self, name, entity=None):
+        self.before_call(name, entity)
+        self.calls[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def is_connected(self):
+        return self.connected
+
+    @property
+    def disconnected(self):
+        """Future resolved when the connection drops, like ``TelegramClient.disconnected``."""
+        if self._disconnected is None:
+            self._disconnected = asyncio.get_running_loop().create_future()
+            if not self.connected:
+                self._disconnected.set_result(None)
+        return asyncio.shield(self._disconnected)
+
+    def drop(self, error=None):
+        """Simulate the connection dropping underneath the bot."""
+        self.connected = False
+        if self._disconnected is not None and not self._disconnected.done():
+            if error:
+                self._disconnected.set_exception(error)
+            else:
+                self._disconnected.set_result(None)
+
+    async def connect(self):
+        await self._call('connect')
+        self.connected = True
+        self._disconnected = None
+
+    async def disconnect(self):
+        self.drop()
+
+    async def get_me(self):
+        return SimpleNamespace(id=self.me_id)
+
+    async def get_input_entity(self, peer):
+        await self._call('get_input_entity', peer)
+        return peer
+
+    async def send_message(self, entity, message='', **kwargs):
+        await self._call('send_message', entity)
+        msg = SimpleNamespace(id=next(self._ids), chat_id=entity, message=message)
+        self.messages[(entity, msg.id)] = message
+        self.sent.append((entity, msg.id, message))
+        return msg
+
+    async def send_file(self, entity, file, caption='', **kwargs):
+        return await self.send_message(entity, caption, file=file, **kwargs)
+
+    async def edit_message(self, entity=None, message=None, text=None, **kwargs):
+        await self._call('edit_message', entity)
+        self.messages[(entity, message)] = text
+
+    async def delete_messages(self, entity, ids):
+        await self._call('delete_messages', entity)
+        for msg_id in ids if isinstance(ids, (list, tuple)) else [ids]:
+            self.messages.pop((entity, msg_id), None)
+
+    async def get_messages(self, entity, ids=None):
+        await self._call('get_messages', entity)
+        return SimpleNamespace(id=ids) if (entity, ids) in self.messages else None
+
+    async def download_media(self, media, file=bytes):
+        await self._call('download_media')
+        photo = getattr(media, 'photo', None)
+        if photo is not None:
+            size = photo.sizes[-1] if photo.sizes else SimpleNamespace(w=64, h=64)
+            return self._photo_bytes(max(size.w, 1), max(size.h, 1))
+        document = getattr(media, 'document', None)
+        return bytes(getattr(document, 'size', 0) or 0)
+
+    async def _transfer(self, name, size):
+        await self._call(name)
+        if self.transfer_rate:
+            await asyncio.sleep(size / self.transfer_rate)
+
+    async def iter_download(self, file, offset=0, stride=None, limit=None, request_size=512 * 1024,
+                            chunk_size=None, file_size=None):
+        """Yield zero-filled parts of a document, one request per part, like ``TelegramClient.iter_download``."""
+        size = file_size if file_size is not None else getattr(file, 'size', 0)
+        chunk_size = chunk_size or request_size
+        stride = stride or chunk_size
+        for _ in itertools.repeat(None) if limit is None else range(limit):
+            if offset >= size:
+                return
+            chunk = bytes(min(chunk_size, size - offset))
+            await self._transfer('download_part', len(chunk))
+            yield chunk
+            offset += stride
+
+    async def upload_file(self, file, file_name=None, **kwargs):
+        """Accept a whole file in one call and return its ``InputFile``."""
+        from telethon.tl import types  # Deferred so importing this module doesn't load Telethon
+        data = file.getvalue() if hasattr(file, 'getvalue') else bytes(file)
+        await self._transfer('upload_file', len(data))
+        return types.InputFile(next(self._ids), 1, file_name or getattr(file, 'name', 'upload'), '')
+
+    async def __call__(self, request):
+        """Raw API requests; only the file part uploads are supported."""
+        await self._transfer(type(request).__name__, len(request.bytes))
+        self.uploaded_parts.setdefault(request.file_id, {})[request.file_part] = request.bytes
+        return True
+
+    def _photo_bytes(self, w, h):
+        if (w, h) not in self._photos:
+            from PIL import Image
+            output = io.BytesIO()
+            Image.new('RGB', (w, h), (120, 60, 30)).save(output, format='JPEG')
+            self._photos[(w, h)] = output.getvalue()
+        return self._photos[(w, h)]
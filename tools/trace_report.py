@@ -0,0 +1,76 @@
+"""Summarise sampled job spans written by the bot's TRACE_FILE sink.
+
+For each pair and job kind, prints p50/p99 of the whole job and of every stage
+below it (reply lookup, filter, media, waits, send), so the stage that
+dominates tail latency stands out.
+
+Usage:
+    python tools/trace_report.py traces.jsonl [traces.jsonl.1 ...] [--pair NAME]
+"""
+import argparse
+import json
+from collections import defaultdict
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def read_spans(paths):
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def summarise(spans, pair=None):
+    """(pair, kind) -> stage -> list of durations; stages are named by their path under the root."""
+    by_trace = defaultdict(list)
+    for record in spans:
+        by_trace[record['trace']].append(record)
+    timings = defaultdict(lambda: defaultdict(list))
+    for records in by_trace.values():
+        root = next((r for r in records if r['parent'] is None), None)
+        if root is None or (pair and root.get('pair') != pair):
+            continue
+        names = {r['span']: r['name'] for r in records}
+        parents = {r['span']: r['parent'] for r in records}
+        stages = timings[(root.get('pair'), root['name'])]
+        stages['(job)'].append(root['ms'])
+        stages['(queued)'].append(root.get('queued_ms', 0))
+        totals = defaultdict(float)  # Retries repeat stages; count each stage once per job
+        for record in records:
+            if record is root:
+                continue
+            path, parent = [record['name'] + (f":{record['reason']}" if 'reason' in record else '')], record['parent']
+            while parent and parent != root['span']:
+                path.append(names.get(parent, '?'))
+                parent = parents.get(parent)
+            totals[" > ".join(reversed(path))] += record['ms']
+        for stage, ms in totals.items():
+            stages[stage].append(ms)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("files", nargs="+", help="trace JSONL files (rotated backups included)")
+    parser.add_argument("--pair", help="only report this pair")
+    args = parser.parse_args()
+
+    timings = summarise(read_spans(args.files), args.pair)
+    for (pair, kind), stages in sorted(timings.items(), key=lambda item: (str(item[0][0]), item[0][1])):
+        jobs = len(stages['(job)'])
+        print(f"{pair} / {kind}: {jobs} sampled jobs")
+        print(f"    {'stage':<32} {'count':>6} {'p50 ms':>10} {'p99 ms':>10} {'max ms':>10}")
+        ordered = sorted(stages.items(), key=lambda item: -percentile(item[1], 0.99))
+        for stage, values in ordered:
+            print(f"    {stage:<32} {len(values):>6} {percentile(values, 0.5):>10.1f} "
+                  f"{percentile(values, 0.99):>10.1f} {max(values):>10.1f}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Media transfer benchmark: sequential versus parallel part transfers.
+
+Copies one large document through the bot's real ``process_media`` path against a
+stub client in which every part request costs a round trip plus ``part / rate``
+seconds, Telegram's per-request throughput limit being what makes single-stream
+transfers slow. Runs on the fault harness's virtual clock, so a several-minute
+transfer finishes in a moment. Concurrency 1 is the sequential baseline.
+
+Usage:
+    python tools/transfer_bench.py
+    python tools/transfer_bench.py --size-mb 500 --concurrency 1 4 8 16 --part-kb 256 512
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from telethon.tl import types  # noqa: E402
+
+from fault_harness import VirtualClockLoop  # noqa: E402
+from stub_client import StubClient, load_bot  # noqa: E402
+
+
+def make_job(bot, size):
+    document = types.Document(1, 0, b'', None, 'video/mp4', size, 2, [types.DocumentAttributeFilename('clip.mp4')])
+    pair = bot.PairConfig('1', 'bench', bot.new_pair_mapping('-1001', '-1002'))
+    return bot.Job(bot.PRIORITY_NEW, '1', 'bench', pair, (1,), '', media=types.MessageMediaDocument(document=document))
+
+
+async def transfer(bot, stub, job):
+    loop = bot.asyncio.get_running_loop()
+    start = loop.time()
+    media = await bot.process_media(job, job.pair)
+    if media is None:
+        raise RuntimeError("process_media returned nothing; see the bot log")
+    return loop.time() - start, sum(len(parts) for parts in stub.uploaded_parts.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--size-mb", type=float, default=200)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--part-kb", type=int, nargs="+", default=[512])
+    parser.add_argument("--rtt", type=float, default=0.1, help="seconds of round trip per part request")
+    parser.add_argument("--rate-mb", type=float, default=2.0, help="MB/s one part request can move")
+    args = parser.parse_args()
+
+    bot = load_bot()
+    bot.PARALLEL_TRANSFER_MIN_SIZE = 0  # Part transfers at every size; concurrency 1 is the sequential path
+    size = int(args.size_mb * 1024 * 1024)
+    print(f"{args.size_mb:g} MB document, {args.rtt * 1000:.0f} ms RTT, {args.rate_mb:g} MB/s per request")
+    print(f"{'part KB':>8} {'concurrency':>12} {'parts':>7} {'seconds':>9} {'speedup':>8}")
+    for part_kb in args.part_kb:
+        baseline = None
+        for concurrency in args.concurrency:
+            bot.TRANSFER_PART_SIZE = part_kb * 1024
+            bot.TRANSFER_CONCURRENCY = concurrency
+            bot.media_cache.clear()  # Every run is a first sighting
+            stub = StubClient(latency=args.rtt, transfer_rate=args.rate_mb * 1024 * 1024)
+            bot.client = stub
+            loop = VirtualClockLoop()
+            try:
+                seconds, parts = loop.run_until_complete(transfer(bot, stub, make_job(bot, size)))
+            finally:
+                loop.close()
+            baseline = baseline or seconds
+            print(f"{part_kb:>8} {concurrency:>12} {parts:>7} {seconds:>9.1f} {baseline / seconds:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()